@@ -22,7 +22,31 @@ python3 -m pip install -r requirements.txt
 echo "Applying migrations..."
 python3 manage.py migrate --noinput
 
+echo "Compiling History rows that were never compiled..."
+python3 manage.py compile_history --missing-only
+
+echo "Refreshing the read-only database copy (when READ_ONLY_SQLITE_PATH is set)..."
+python3 manage.py refresh_readonly_db
+
 echo "Collecting static files..."
 python3 manage.py collectstatic --noinput
 
+echo "Building poster/background derivatives..."
+python3 manage.py build_derivatives
+
+echo "Moving the moov box of the videos to the front (faststart)..."
+python3 manage.py faststart_media
+
+echo "Probing media dimensions, sizes and durations..."
+python3 manage.py probe_media
+
+echo "Fingerprinting and precompressing media..."
+python3 manage.py build_media_manifest
+
+echo "Building phase snapshots..."
+python3 manage.py build_snapshots
+
+echo "Warming the page cache..."
+python3 manage.py warmcache
+
 echo "Deployment steps finished. Please reload the web app in the PythonAnywhere Web tab to apply changes."
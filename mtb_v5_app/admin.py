@@ -1,17 +1,118 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db.models.expressions import RawSQL
+from django.forms.models import BaseInlineFormSet
+from django.utils.text import Truncator
+from . import search
 from .models import Page, Media, History
+from .phases import PHASES
 
-class MediaInline( admin.TabularInline ):
- model = Media
+class PhaseFilter( admin.SimpleListFilter ):
+ # Fixed choices: no SELECT DISTINCT over the table; the filter itself hits the (phase, position, id) indexes.
+ title = 'phase'
+ parameter_name = 'phase'
+
+ def lookups( self, request, model_admin ):
+  return [ ( code, f'{code} ({label})' ) for code, label in PHASES ]
+
+ def queryset( self, request, queryset ):
+  if self.value( ):
+   return queryset.filter( phase = self.value( ) )
+  return queryset
+
+def history_excerpt( obj ):
+ return Truncator( search.html_to_text( obj.compiled_content or obj.content ) ).chars( 80 )
+history_excerpt.short_description = 'excerpt'
+
+class PaginatedInlineFormSet( BaseInlineFormSet ):
+ """Edit one page of the related rows at a time (``?<prefix>-page=N``)."""
+ per_page = 25
+ page_number = 1
+ query = None
+
+ def get_queryset( self ):
+  if not hasattr( self, 'page' ):
+   self.paginator = Paginator( super( ).get_queryset( ), self.per_page )
+   self.page = self.paginator.get_page( self.page_number )
+   self._page_rows = list( self.page.object_list )
+   # Every row belongs to the parent: reuse it instead of one query per row in __str__.
+   for obj in self._page_rows:
+    setattr( obj, self.fk.name, self.instance )
+  return self._page_rows
+
+ def page_links( self ):
+  self.get_queryset( )
+  query = self.query.copy( ) if self.query is not None else {}
+  links = []
+  for number in self.paginator.get_elided_page_range( self.page.number ):
+   if number == self.page.number or number == Paginator.ELLIPSIS:
+    links.append( ( number, None ) )
+   else:
+    query[ f'{self.prefix}-page' ] = number
+    links.append( ( number, '?' + query.urlencode( ) ) )
+  return links
+
+class PaginatedInline( admin.TabularInline ):
+ formset = PaginatedInlineFormSet
+ template = 'admin/edit_inline/paginated_tabular.html'
+ classes = [ 'collapse' ]
+ show_change_link = True
  extra = 0
+ per_page = 25
 
-class HistoryInline( admin.TabularInline ):
+ def get_formset( self, request, obj = None, **kwargs ):
+  formset = super( ).get_formset( request, obj, **kwargs )
+  formset.per_page = self.per_page
+  formset.page_number = request.GET.get( f'{formset.get_default_prefix( )}-page', 1 )
+  formset.query = request.GET
+  return formset
+
+class MediaInline( PaginatedInline ):
+ model = Media
+ fields = [ 'title', 'type', 'phase', 'position', 'path' ]
+
+class HistoryInline( PaginatedInline ):
  model = History
- extra = 0
+ # No CKEditor per row: the content is edited on the row's own page ("Change" link).
+ fields = [ history_excerpt, 'phase', 'position' ]
+ readonly_fields = [ history_excerpt ]
+
+ def has_add_permission( self, request, obj = None ):
+  return False
 
 class PageAdmin( admin.ModelAdmin ):
+ list_display = [ 'name', 'phase' ]
+ list_filter = [ PhaseFilter ]
+ search_fields = [ 'name' ]
  inlines = [ MediaInline, HistoryInline ]
 
+class MediaAdmin( admin.ModelAdmin ):
+ list_display = [ 'title', 'type', 'phase', 'position', 'page' ]
+ list_select_related = [ 'page' ]
+ list_filter = [ PhaseFilter, 'type' ]
+ search_fields = [ 'title', 'path' ]
+ autocomplete_fields = [ 'page' ]
+ readonly_fields = [ 'width', 'height', 'size', 'duration', 'content_hash' ]  # filled by probe_media
+ list_per_page = 50
+ show_full_result_count = False
+
+class HistoryAdmin( admin.ModelAdmin ):
+ list_display = [ '__str__', history_excerpt, 'phase', 'position', 'updated_at' ]
+ list_select_related = [ 'page' ]
+ list_filter = [ PhaseFilter ]
+ autocomplete_fields = [ 'page' ]
+ list_per_page = 50
+ show_full_result_count = False
+ search_fields = [ 'content' ]
+ search_help_text = 'Full-text search: every word must appear, the last one may be a prefix.'
+
+ def get_search_results( self, request, queryset, search_term ):
+  # FTS5 index lookup instead of a LIKE scan over the CKEditor HTML.
+  if not search.fts_query( search_term ) or not search.is_available( queryset.db ):
+   return super( ).get_search_results( request, queryset, search_term )
+  sql, params = search.matching_ids_sql( search_term )
+  return queryset.filter( id__in = RawSQL( sql, params ) ), False
+
 admin.site.register( Page, PageAdmin )
-admin.site.register( Media )
-admin.site.register( History )
+admin.site.register( Media, MediaAdmin )
+admin.site.register( History, HistoryAdmin )
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 class MtbV5AppConfig( AppConfig ):
  default_auto_field = 'django.db.models.BigAutoField'
  name = 'mtb_v5_app'
+
+ def ready( self ):
+  from . import signals  # noqa: F401  (connects the cache invalidation handlers)
+  from . import sqlite_tuning  # noqa: F401  (applies SQLITE_PRAGMAS to new connections)
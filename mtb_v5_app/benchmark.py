@@ -0,0 +1,353 @@
+"""In-process load generator for the public endpoints.
+
+Used by ``manage.py loadtest``: seeds synthetic ``Page``/``Media``/``History``
+rows plus media files, then calls the project's WSGI application directly
+from a thread pool (no sockets, no external server) and reports requests/sec
+and latency percentiles per scenario.
+
+``manage.py bench_concurrency`` uses ``run_capacity()`` to compare the WSGI and
+ASGI entry points while a number of slow clients are streaming videos.
+"""
+
+import asyncio
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from io import BytesIO
+
+import django
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import override_settings
+
+from .history_compiler import compile_history
+from .metrics import percentile
+from .models import History, Media, Page
+from .phases import PHASE_CODES
+
+
+@contextmanager
+def scratch_environment():
+    """Throw-away test database and ``MEDIA_ROOT`` for a benchmark run; yields the media root.
+
+    The real database is never touched: a test database is created and
+    dropped afterwards, caches are cleared and snapshots are disabled.
+    """
+    media_root = tempfile.mkdtemp(prefix='mtb-bench-')
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        with override_settings(MEDIA_ROOT=media_root, SNAPSHOT_ENABLED=False):
+            for alias in settings.CACHES:
+                caches[alias].clear()
+            yield media_root
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def run_metadata(server, options, option_names):
+    """Environment details stored next to benchmark results."""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'server': server,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': settings.DATABASES['default']['ENGINE'],
+        'home_cache_enabled': settings.HOME_CACHE_ENABLED,
+        'options': {name: options[name] for name in option_names},
+    }
+
+
+def seed(pages, media, history, media_root, video_bytes):
+    """Create synthetic rows and one poster/video pair per phase on disk."""
+    page_objs = Page.objects.bulk_create(
+        [Page(name=f'Bench page {i}', phase=PHASE_CODES[i % len(PHASE_CODES)]) for i in range(max(pages, 1))]
+    )
+    Media.objects.bulk_create(
+        [
+            Media(
+                title=f'Clip {i}', phase=PHASE_CODES[i % len(PHASE_CODES)], path='bench-clip',
+                type='video' if i % 2 else 'image', page=page_objs[i % len(page_objs)], position=i,
+            )
+            for i in range(media)
+        ],
+        batch_size=500,
+    )
+    content = '<p>The Beatles played the Cavern Club in 1961 with John, Paul, George and Pete.</p>' * 20
+    compiled = compile_history(content)
+    History.objects.bulk_create(
+        [
+            History(content=content, compiled_content=compiled, phase=PHASE_CODES[i % len(PHASE_CODES)],
+                    page=page_objs[i % len(page_objs)], position=i)
+            for i in range(history)
+        ],
+        batch_size=500,
+    )
+    chunk = os.urandom(min(video_bytes, 1024 * 1024))
+    for phase in PHASE_CODES:
+        phase_dir = os.path.join(media_root, phase)
+        os.makedirs(phase_dir, exist_ok=True)
+        with open(os.path.join(phase_dir, 'bench-clip.mp4'), 'wb') as f:
+            written = 0
+            while written < video_bytes:
+                f.write(chunk[:video_bytes - written])
+                written += len(chunk)
+        with open(os.path.join(phase_dir, 'bench-clip.jpg'), 'wb') as f:
+            f.write(chunk[:64 * 1024])
+
+
+def default_scenarios(video_bytes):
+    """``(name, path, headers)`` for every endpoint and phase."""
+    scenarios = [(f'home:{phase}', f'/?phase={phase}', {}) for phase in PHASE_CODES]
+    scenarios += [(f'api:{phase}', f'/api/phase/{phase}/', {}) for phase in PHASE_CODES]
+    scenarios.append(('health', '/health/', {}))
+    scenarios.append(('media:poster', '/media/01/bench-clip.jpg', {}))
+    scenarios.append(('media:video', '/media/01/bench-clip.mp4', {}))
+    range_end = min(video_bytes, 1024 * 1024) - 1
+    scenarios.append(('media:range', '/media/01/bench-clip.mp4', {'HTTP_RANGE': f'bytes=0-{range_end}'}))
+    return scenarios
+
+
+def _environ(path, headers):
+    path_info, _, query = path.partition('?')
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path_info,
+        'QUERY_STRING': query,
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'localhost',
+        'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    environ.update(headers)
+    return environ
+
+
+def wsgi_request(application, path, headers=None, chunk_delay=0.0):
+    """Run one request through ``application``; returns ``(status, body_bytes)``.
+
+    ``chunk_delay`` sleeps after every body chunk to mimic a slow client.
+    """
+    status_holder = []
+
+    def start_response(status, response_headers, exc_info=None):
+        status_holder.append(int(status.split(' ', 1)[0]))
+
+    result = application(_environ(path, headers or {}), start_response)
+    size = 0
+    try:
+        for chunk in result:
+            size += len(chunk)
+            if chunk_delay:
+                time.sleep(chunk_delay)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return status_holder[0], size
+
+
+def summarize(latencies, errors, wall_seconds, total_bytes):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'rps': round(count / wall_seconds, 1) if wall_seconds else None,
+        'mean_ms': round(statistics.mean(latencies), 3) if latencies else None,
+        'p50_ms': round(percentile(latencies, 50), 3) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95), 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 3) if latencies else None,
+        'bytes': total_bytes,
+    }
+
+
+def run_scenario(application, path, requests, concurrency, headers=None):
+    """Fire ``requests`` requests at ``path`` from ``concurrency`` threads."""
+    latencies = []
+    errors = 0
+    total_bytes = 0
+    lock = threading.Lock()
+    remaining = iter(range(requests))
+
+    def worker():
+        nonlocal errors, total_bytes
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            started = time.perf_counter()
+            try:
+                status, size = wsgi_request(application, path, headers)
+            except Exception:
+                status, size = 500, 0
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(elapsed)
+                total_bytes += size
+                if status >= 400:
+                    errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    return summarize(latencies, errors, time.perf_counter() - started, total_bytes)
+
+
+def _scope(path, headers):
+    path_info, _, query = path.partition('?')
+    # Scenario headers use WSGI environ names (HTTP_RANGE -> range).
+    header_list = [(b'host', b'localhost')] + [
+        (key[5:].lower().replace('_', '-').encode(), value.encode())
+        for key, value in headers.items() if key.startswith('HTTP_')
+    ]
+    return {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path_info,
+        'raw_path': path_info.encode(),
+        'query_string': query.encode(),
+        'root_path': '',
+        'headers': header_list,
+        'client': ('127.0.0.1', 0),
+        'server': ('localhost', 80),
+    }
+
+
+async def asgi_request(application, path, headers=None, chunk_delay=0.0):
+    """ASGI counterpart of ``wsgi_request()``; returns ``(status, body_bytes)``."""
+    finished = asyncio.Event()
+    request_sent = False
+    status = None
+    size = 0
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal status, size
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        elif message['type'] == 'http.response.body':
+            size += len(message.get('body', b''))
+            if chunk_delay and message.get('more_body'):
+                await asyncio.sleep(chunk_delay)
+
+    try:
+        await application(_scope(path, headers or {}), receive, send)
+    finally:
+        finished.set()
+    return status, size
+
+
+def _record(stats, started, status, size):
+    stats['latencies'].append((time.perf_counter() - started) * 1000)
+    stats['bytes'] += size
+    if status is None or status >= 400:
+        stats['errors'] += 1
+
+
+def _capacity_result(viewer_stats, page_stats, page_seconds, total_seconds):
+    return {
+        'pages': summarize(page_stats['latencies'], page_stats['errors'], page_seconds, page_stats['bytes']),
+        'videos': summarize(viewer_stats['latencies'], viewer_stats['errors'], total_seconds, viewer_stats['bytes']),
+    }
+
+
+def run_capacity_wsgi(application, page_path, video_path, viewers, pages, concurrency, workers, chunk_delay):
+    """Page latency while ``viewers`` slow clients download ``video_path``.
+
+    ``workers`` threads play the server's worker pool (e.g. gunicorn
+    ``--threads``): every request, streaming or not, holds one until done.
+    """
+    viewer_stats = {'latencies': [], 'errors': 0, 'bytes': 0}
+    page_stats = {'latencies': [], 'errors': 0, 'bytes': 0}
+    lock = threading.Lock()
+
+    def timed(stats, path, delay, submitted):
+        # Latency runs from submission, so waiting for a free worker counts.
+        try:
+            status, size = wsgi_request(application, path, None, delay)
+        except Exception:
+            status, size = 500, 0
+        with lock:
+            _record(stats, submitted, status, size)
+
+    remaining = iter(range(pages))
+
+    def page_client(server):
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            server.submit(timed, page_stats, page_path, 0.0, time.perf_counter()).result()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as server:
+        for _ in range(viewers):
+            server.submit(timed, viewer_stats, video_path, chunk_delay, time.perf_counter())
+        with ThreadPoolExecutor(max_workers=concurrency) as clients:
+            for _ in range(concurrency):
+                clients.submit(page_client, server)
+        page_seconds = time.perf_counter() - started
+    return _capacity_result(viewer_stats, page_stats, page_seconds, time.perf_counter() - started)
+
+
+async def run_capacity_asgi(application, page_path, video_path, viewers, pages, concurrency, chunk_delay):
+    """``run_capacity_wsgi()`` against an ASGI application on one event loop."""
+    viewer_stats = {'latencies': [], 'errors': 0, 'bytes': 0}
+    page_stats = {'latencies': [], 'errors': 0, 'bytes': 0}
+
+    async def timed(stats, path, delay):
+        started = time.perf_counter()
+        try:
+            status, size = await asgi_request(application, path, None, delay)
+        except Exception:
+            status, size = 500, 0
+        _record(stats, started, status, size)
+
+    remaining = iter(range(pages))
+
+    async def page_client():
+        while next(remaining, None) is not None:
+            await timed(page_stats, page_path, 0.0)
+
+    started = time.perf_counter()
+    streams = [asyncio.create_task(timed(viewer_stats, video_path, chunk_delay)) for _ in range(viewers)]
+    await asyncio.gather(*(page_client() for _ in range(concurrency)))
+    page_seconds = time.perf_counter() - started
+    await asyncio.gather(*streams)
+    return _capacity_result(viewer_stats, page_stats, page_seconds, time.perf_counter() - started)
@@ -0,0 +1,298 @@
+"""Full-response cache for the phase home page.
+
+Rendered ``home.html`` responses are stored per phase in the cache alias named
+by ``settings.HOME_CACHE_ALIAS``. Entries are dropped by the model signals in
+``mtb_v5_app.signals`` whenever ``Page``, ``Media`` or ``History`` change.
+Hit/miss counters live in the same cache so every process (and the
+``clearcache --show-stats`` command) sees the same numbers when a shared
+backend is used. The file-based and database caches have no atomic
+``incr()`` (it is a read plus a rewrite), so with those the counters are kept
+per process and added to the shared ones at most every
+``HOME_CACHE_STATS_FLUSH_SECONDS``; a request never writes them itself.
+
+The JSON phase payloads served by ``views.phase_api`` are stored next to the
+pages (``kind='api'``) and invalidated together with them. An entry keeps the
+body and the headers the view had set (``Content-Type``, ``Vary``,
+``Content-Language``, ...), so a replayed response matches the rendered one.
+Headers the middleware adds afterwards are added again on every request.
+Cached pages must not depend on the session, the user or the CSRF token:
+their middleware only reacts to a render that actually happens.
+
+The same cache also holds a content version per phase (an ETag plus a
+Last-Modified timestamp) so conditional GETs can be answered with a 304
+without querying ``Media``/``History`` or rendering the template. Besides the
+rows and the templates, the version covers the derivatives and media
+manifests: the markup embeds their fingerprinted URLs, so rebuilding either
+one must produce a new ETag.
+"""
+
+import functools
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.utils import make_template_fragment_key
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.template.loader import get_template
+
+from . import derivatives, media_manifest, snapshots
+from .models import History, Media
+from .phases import PHASE_CODES
+
+KEY_PREFIX = 'mtb:home'
+HITS_KEY = f'{KEY_PREFIX}:hits'
+MISSES_KEY = f'{KEY_PREFIX}:misses'
+
+
+def get_cache():
+    return caches[getattr(settings, 'HOME_CACHE_ALIAS', 'default')]
+
+
+# Cached representations of a phase: the rendered home page and the JSON payload.
+PAGE_KINDS = ('page', 'api')
+# Part of the key: entries written in an older layout are never read back.
+ENTRY_FORMAT = 2
+# Recomputed for every response instead of replayed.
+UNCACHED_HEADERS = frozenset({'content-length', 'date', 'expires', 'set-cookie'})
+
+
+def page_key(phase, kind='page'):
+    return f'{KEY_PREFIX}:{kind}:{ENTRY_FORMAT}:{phase}'
+
+
+# {% cache %} fragments in base.html/home.html: the shared <head> and the per-phase pieces.
+SHARED_FRAGMENTS = ('mtb_head',)
+PHASE_FRAGMENTS = ('mtb_phase_style', 'mtb_phase_menu')
+
+
+def fragment_keys(phases):
+    return [make_template_fragment_key(name) for name in SHARED_FRAGMENTS] + [
+        make_template_fragment_key(name, [phase]) for name in PHASE_FRAGMENTS for phase in phases
+    ]
+
+
+def _incr(key, cache=None, delta=1):
+    cache = cache or get_cache()
+    # add() is a no-op when the counter already exists; counters never expire.
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # Evicted between add() and incr(); start again from delta.
+        cache.set(key, delta, timeout=None)
+
+
+async def _aincr(key, cache):
+    await cache.aadd(key, 0, timeout=None)
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        await cache.aset(key, 1, timeout=None)
+
+
+# Backends whose incr() rewrites a file/row: counted per process instead (see the module docstring).
+NON_ATOMIC_BACKENDS = (FileBasedCache, DatabaseCache)
+
+_pending_lock = threading.Lock()
+_pending = {HITS_KEY: 0, MISSES_KEY: 0}
+_last_flush = time.monotonic()
+
+
+def _count_locally(key):
+    """Count ``key`` in process memory; True when the pending counts are due to be flushed."""
+    global _last_flush
+    with _pending_lock:
+        _pending[key] += 1
+        if time.monotonic() - _last_flush < settings.HOME_CACHE_STATS_FLUSH_SECONDS:
+            return False
+        _last_flush = time.monotonic()
+    return True
+
+
+def flush_stats(cache=None):
+    """Add this process' pending hit/miss counts to the shared counters."""
+    cache = cache or get_cache()
+    with _pending_lock:
+        pending = dict(_pending)
+        for key in _pending:
+            _pending[key] = 0
+    for key, count in pending.items():
+        if count:
+            _incr(key, cache, count)
+
+
+def _count(key, cache):
+    if not isinstance(cache, NON_ATOMIC_BACKENDS):
+        _incr(key, cache)
+    elif _count_locally(key):
+        flush_stats(cache)
+
+
+async def _acount(key, cache):
+    if not isinstance(cache, NON_ATOMIC_BACKENDS):
+        await _aincr(key, cache)
+    elif _count_locally(key):
+        await sync_to_async(flush_stats)(cache)
+
+
+def get_page(phase, kind='page'):
+    """Return a cached ``HttpResponse`` for ``phase`` or ``None`` on a miss."""
+    cache = get_cache()
+    entry = cache.get(page_key(phase, kind))
+    if entry is None:
+        _count(MISSES_KEY, cache)
+        return None
+    _count(HITS_KEY, cache)
+    content, headers = entry
+    return HttpResponse(content, headers=headers)
+
+
+async def aget_page(phase, kind='page'):
+    """Async ``get_page()`` for the ASGI views."""
+    cache = get_cache()
+    entry = await cache.aget(page_key(phase, kind))
+    if entry is None:
+        await _acount(MISSES_KEY, cache)
+        return None
+    await _acount(HITS_KEY, cache)
+    content, headers = entry
+    return HttpResponse(content, headers=headers)
+
+
+def _entry(response):
+    headers = {name: value for name, value in response.items() if name.lower() not in UNCACHED_HEADERS}
+    return response.content, headers
+
+
+def set_page(phase, response, kind='page'):
+    """Store the rendered body and headers of ``response`` for ``phase``."""
+    if response.status_code != 200 or response.streaming:
+        return
+    get_cache().set(page_key(phase, kind), _entry(response), timeout=getattr(settings, 'HOME_CACHE_TIMEOUT', 600))
+
+
+async def aset_page(phase, response, kind='page'):
+    if response.status_code != 200 or response.streaming:
+        return
+    await get_cache().aset(
+        page_key(phase, kind), _entry(response), timeout=getattr(settings, 'HOME_CACHE_TIMEOUT', 600),
+    )
+
+
+def invalidate_pages(phases=None):
+    """Drop the cached pages, payloads, template fragments and versions for ``phases`` (all five by default)."""
+    phases = PHASE_CODES if phases is None else phases
+    get_cache().delete_many(
+        [page_key(phase, kind) for phase in phases for kind in PAGE_KINDS]
+        + [version_key(phase) for phase in phases]
+        + fragment_keys(phases)
+    )
+
+
+def version_key(phase):
+    return f'{KEY_PREFIX}:version:{phase}'
+
+
+def _template_stamps():
+    """Modification times of the templates the home page is rendered from."""
+    return tuple(
+        os.stat(get_template(name).origin.name).st_mtime_ns
+        for name in ('home.html', 'base.html')
+    )
+
+
+_cached_template_stamps = functools.lru_cache(maxsize=None)(_template_stamps)
+
+
+def asset_stamps():
+    """``[mtime_ns, size]`` of the derivatives and media manifests (zeros when one is missing)."""
+    stamps = []
+    for path in (derivatives.manifest_path(), media_manifest.manifest_path()):
+        try:
+            st = os.stat(path)
+        except OSError:
+            stamps += [0, 0]
+        else:
+            stamps += [st.st_mtime_ns, st.st_size]
+    return stamps
+
+
+def compute_version(phase, using=None):
+    """Derive the phase version from the database (two aggregate queries).
+
+    ``using=None`` follows the database routers, so a public request takes
+    the version from the same (possibly read-only) database as the content.
+    """
+    stamps = _template_stamps() if settings.DEBUG else _cached_template_stamps()
+    assets = asset_stamps()
+    parts = [phase, *map(str, stamps), *map(str, assets)]
+    last_modified = datetime.fromtimestamp(max(*stamps, *assets[::2]) / 1e9, tz=timezone.utc)
+    for model in (Media, History):
+        agg = model.objects.using(using).filter(phase=phase).aggregate(
+            count=Count('id'), max_id=Max('id'), latest=Max('updated_at'),
+        )
+        parts += [str(agg['count']), str(agg['max_id']), agg['latest'].isoformat() if agg['latest'] else '']
+        if agg['latest'] and agg['latest'] > last_modified:
+            last_modified = agg['latest']
+    etag = hashlib.md5(':'.join(parts).encode(), usedforsecurity=False).hexdigest()
+    return {'etag': f'"{etag}"', 'last_modified': last_modified, 'assets': assets}
+
+
+def get_version(phase):
+    """Return ``{'etag': ..., 'last_modified': ...}`` for ``phase``.
+
+    Versions are taken from the phase snapshot when one is loaded, otherwise
+    computed on first use, and cached until the content changes (or
+    ``HOME_CACHE_TIMEOUT`` expires, for per-process backends).
+    """
+    cache = get_cache()
+    version = cache.get(version_key(phase))
+    if version is None:
+        version = _load_version(phase)
+        cache.set(version_key(phase), version, timeout=getattr(settings, 'HOME_CACHE_TIMEOUT', 600))
+    return version
+
+
+async def aget_version(phase):
+    """Async ``get_version()``; a miss is resolved in the database thread."""
+    cache = get_cache()
+    version = await cache.aget(version_key(phase))
+    if version is None:
+        version = await sync_to_async(_load_version)(phase)
+        await cache.aset(version_key(phase), version, timeout=getattr(settings, 'HOME_CACHE_TIMEOUT', 600))
+    return version
+
+
+def _load_version(phase):
+    snapshot = snapshots.load_snapshot(phase) if settings.SNAPSHOT_ENABLED else None
+    # A manifest rebuilt after the snapshot changes the markup but not the snapshot's version.
+    if snapshot is not None and snapshot.get('assets') == asset_stamps():
+        return {'etag': snapshot['etag'], 'last_modified': snapshot['last_modified']}
+    return compute_version(phase)
+
+
+def get_stats(cache=None):
+    """Return hit/miss counters and the number of phases currently cached."""
+    cache = cache or get_cache()
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    if isinstance(cache, NON_ATOMIC_BACKENDS):
+        # Plus what this process has not flushed yet.
+        hits += _pending[HITS_KEY]
+        misses += _pending[MISSES_KEY]
+    total = hits + misses
+    cached = cache.get_many([page_key(phase) for phase in PHASE_CODES])
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': (hits / total) if total else 0.0,
+        'cached_phases': len(cached),
+    }
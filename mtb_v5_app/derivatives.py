@@ -0,0 +1,259 @@
+"""Resized, content-hashed derivatives of posters and phase backgrounds.
+
+``manage.py build_derivatives`` writes WebP and JPEG copies of every image in
+the phase directories at a few widths into ``MEDIA_ROOT/derivatives/``. Each
+file name carries a hash of the source bytes, so the URLs change exactly when
+the source does. ``derivatives/manifest.json`` maps source paths (relative to
+``MEDIA_ROOT``, e.g. ``01/first_era-01.jpg``) to their variants and is what the
+``media_tags`` template tags read to emit ``srcset``/``sizes``.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from .phases import PHASE_CODES
+
+DERIVATIVES_DIR = 'derivatives'
+MANIFEST_NAME = 'manifest.json'
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# format name -> (file extension, Pillow format, save options)
+FORMATS = {
+    'webp': ('.webp', 'WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('.jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+_manifest_cache = {}
+
+
+def derivatives_root(media_root=None):
+    return os.path.join(media_root or settings.MEDIA_ROOT, DERIVATIVES_DIR)
+
+
+def manifest_path(media_root=None):
+    return os.path.join(derivatives_root(media_root), MANIFEST_NAME)
+
+
+def content_hash(path, length=12):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:length]
+
+
+def find_sources(media_root=None, phases=PHASE_CODES):
+    """Relative paths of every poster/background image in the phase directories."""
+    media_root = media_root or settings.MEDIA_ROOT
+    sources = []
+    for phase in phases:
+        phase_dir = os.path.join(media_root, phase)
+        if not os.path.isdir(phase_dir):
+            continue
+        with os.scandir(phase_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(SOURCE_EXTENSIONS):
+                    sources.append(f'{phase}/{entry.name}')
+    return sorted(sources)
+
+
+def _variants_exist(media_root, entry):
+    return all(
+        os.path.exists(os.path.join(media_root, rel))
+        for variants in entry['variants'].values()
+        for rel in variants.values()
+    )
+
+
+def _save_atomic(image, path, pil_format, options):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            image.save(f, pil_format, **options)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def generate(media_root, rel_path, widths, previous=None, force=False):
+    """Create the derivatives of one source image.
+
+    Returns ``(rel_path, entry, status)`` with ``status`` one of ``'unchanged'``
+    (mtime and size match the manifest), ``'touched'`` (mtime changed but the
+    content hash did not), ``'generated'`` or ``'failed'`` (unreadable image). Runs in worker processes, so it
+    only touches the filesystem.
+    """
+    source = os.path.join(media_root, rel_path)
+    st = os.stat(source)
+    if previous and not force and _variants_exist(media_root, previous):
+        if (previous['mtime_ns'], previous['size']) == (st.st_mtime_ns, st.st_size):
+            return rel_path, previous, 'unchanged'
+        digest = content_hash(source)
+        if previous['hash'] == digest:
+            return rel_path, dict(previous, mtime_ns=st.st_mtime_ns, size=st.st_size), 'touched'
+    else:
+        digest = content_hash(source)
+
+    stem = os.path.splitext(rel_path)[0]
+    os.makedirs(os.path.dirname(os.path.join(derivatives_root(media_root), stem)), exist_ok=True)
+    try:
+        with Image.open(source) as original:
+            image = ImageOps.exif_transpose(original).convert('RGB')
+    except (OSError, SyntaxError):
+        # Not a decodable image (e.g. a Git LFS pointer); keep any previous entry.
+        return rel_path, previous, 'failed'
+    width, height = image.size
+    # Every configured width narrower than the source, plus the source width
+    # itself (capped at the largest configured width).
+    targets = sorted({w for w in widths if w < width} | {min(width, max(widths))})
+
+    variants = {name: {} for name in FORMATS}
+    for target in targets:
+        resized = image if target == width else image.resize(
+            (target, max(1, round(height * target / width))), Image.LANCZOS,
+        )
+        for name, (extension, pil_format, options) in FORMATS.items():
+            rel_out = f'{DERIVATIVES_DIR}/{stem}-{digest}-{target}{extension}'
+            out = os.path.join(media_root, rel_out)
+            if force or not os.path.exists(out):
+                _save_atomic(resized, out, pil_format, options)
+            variants[name][str(target)] = rel_out
+
+    entry = {
+        'mtime_ns': st.st_mtime_ns,
+        'size': st.st_size,
+        'hash': digest,
+        'width': width,
+        'height': height,
+        'variants': variants,
+    }
+    return rel_path, entry, 'generated'
+
+
+def load_json_cached(path):
+    """Parse the JSON file at ``path``, re-reading it only when the file changes ({} if missing)."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return {}
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _manifest_cache.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    _manifest_cache[path] = (stamp, data)
+    return data
+
+
+def write_json_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def load_manifest(media_root=None):
+    """Return the derivatives manifest, re-reading it only when the file changes."""
+    return load_json_cached(manifest_path(media_root))
+
+
+def write_manifest(manifest, media_root=None):
+    write_json_atomic(manifest_path(media_root), manifest)
+
+
+def remove_unreferenced(manifest, media_root=None):
+    """Delete derivative files no longer listed in ``manifest``; returns the count."""
+    media_root = media_root or settings.MEDIA_ROOT
+    referenced = {
+        os.path.normpath(os.path.join(media_root, rel))
+        for entry in manifest.values()
+        for variants in entry['variants'].values()
+        for rel in variants.values()
+    }
+    removed = 0
+    for dirpath, _, filenames in os.walk(derivatives_root(media_root)):
+        for filename in filenames:
+            path = os.path.normpath(os.path.join(dirpath, filename))
+            if filename != MANIFEST_NAME and path not in referenced:
+                os.unlink(path)
+                removed += 1
+    return removed
+
+
+def build(media_root=None, sources=None, widths=None, workers=None, force=False):
+    """Generate derivatives for ``sources`` (default: all) and update the manifest.
+
+    Returns ``{status: count}``. A full build also drops manifest entries and
+    files whose source image no longer exists.
+    """
+    media_root = media_root or settings.MEDIA_ROOT
+    widths = tuple(widths or settings.DERIVATIVE_WIDTHS)
+    full_build = sources is None
+    sources = find_sources(media_root) if full_build else list(sources)
+    manifest = dict(load_manifest(media_root))
+
+    jobs = [(media_root, rel, widths, manifest.get(rel), force) for rel in sources]
+    if workers == 1 or len(jobs) <= 1:
+        results = [generate(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(generate, *zip(*jobs)))
+
+    counts = {'generated': 0, 'touched': 0, 'unchanged': 0, 'failed': 0, 'removed': 0}
+    for rel_path, entry, status in results:
+        if entry is not None:
+            manifest[rel_path] = entry
+        counts[status] += 1
+    if full_build:
+        for rel_path in set(manifest) - set(sources):
+            del manifest[rel_path]
+    if counts['generated'] or counts['touched'] or full_build:
+        write_manifest(manifest, media_root)
+    if full_build:
+        counts['removed'] = remove_unreferenced(manifest, media_root)
+    return counts
+
+
+def srcset(rel_path, fmt='webp'):
+    """``srcset`` value for ``rel_path`` or ``''`` when no derivatives exist."""
+    entry = load_manifest().get(rel_path)
+    if not entry:
+        return ''
+    variants = entry['variants'][fmt]
+    return ', '.join(
+        f'{settings.MEDIA_URL}{variants[w]} {w}w' for w in sorted(variants, key=int)
+    )
+
+
+def url_for_width(rel_path, width, fmt='webp'):
+    """URL of the smallest derivative at least ``width`` wide (original as fallback)."""
+    entry = load_manifest().get(rel_path)
+    if not entry:
+        return f'{settings.MEDIA_URL}{rel_path}'
+    variants = entry['variants'][fmt]
+    sizes = sorted(variants, key=int)
+    chosen = next((w for w in sizes if int(w) >= width), sizes[-1])
+    return f'{settings.MEDIA_URL}{variants[chosen]}'
+
+
+def poster_source(phase, path):
+    """Poster image of a ``Media`` row, relative to ``MEDIA_ROOT``."""
+    return f'{phase}/{path}.jpg'
@@ -0,0 +1,118 @@
+"""Readiness probes for ``/health/?mode=ready`` and ``manage.py check_db``.
+
+Liveness (plain ``/health/``) only shows that the process answers requests.
+Readiness also checks what a page render needs:
+- the database answers a ``SELECT 1``;
+- no migration is pending;
+- ``MEDIA_ROOT`` is a readable directory;
+- the read-only database answers too, when one is configured.
+
+``readiness()`` keeps its result in process memory for
+``HEALTH_CACHE_SECONDS``. A load balancer polling every second then costs
+one real probe per interval and process. The cache is per process, so a
+failing shared cache backend cannot hide or fake the result.
+"""
+
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.db.migrations.executor import MigrationExecutor
+
+from .models import History, Media
+
+_lock = threading.Lock()
+_cached = None  # (time.monotonic() of the probe, result)
+
+
+def check_database(using=DEFAULT_DB_ALIAS):
+    with connections[using].cursor() as cursor:
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+    return {'ok': True}
+
+
+def check_migrations(using=DEFAULT_DB_ALIAS):
+    executor = MigrationExecutor(connections[using])
+    plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+    pending = [f'{migration.app_label}.{migration.name}' for migration, _ in plan]
+    return {'ok': not pending, 'pending': pending}
+
+
+def check_media_root(path=None):
+    path = path or settings.MEDIA_ROOT
+    return {'ok': os.path.isdir(path) and os.access(path, os.R_OK | os.X_OK), 'path': str(path)}
+
+
+def _timed(check, *args):
+    started = time.perf_counter()
+    try:
+        result = check(*args)
+    except Exception as exc:  # a probe reports failures, it does not raise them
+        result = {'ok': False, 'error': f'{type(exc).__name__}: {exc}'}
+    result['ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+
+def run_checks(using=DEFAULT_DB_ALIAS):
+    """Run every readiness probe now: ``{'status': 'ok'|'error', 'checks': {name: {'ok', 'ms', ...}}}``."""
+    checks = {
+        'database': _timed(check_database, using),
+        'migrations': _timed(check_migrations, using),
+        'media_root': _timed(check_media_root),
+    }
+    if settings.READ_ONLY_DATABASE and using == DEFAULT_DB_ALIAS:
+        checks['readonly_database'] = _timed(check_database, settings.READ_ONLY_DATABASE)
+    status = 'ok' if all(check['ok'] for check in checks.values()) else 'error'
+    return {'status': status, 'checks': checks}
+
+
+def readiness():
+    """``run_checks()`` result, at most ``HEALTH_CACHE_SECONDS`` old."""
+    global _cached
+    cached = _cached
+    if cached is not None and time.monotonic() - cached[0] < settings.HEALTH_CACHE_SECONDS:
+        return cached[1]
+    with _lock:
+        # Concurrent requests wait for the probe already running instead of starting their own.
+        if _cached is not None and time.monotonic() - _cached[0] < settings.HEALTH_CACHE_SECONDS:
+            return _cached[1]
+        result = run_checks()
+        _cached = (time.monotonic(), result)
+    return result
+
+
+def clear_cache():
+    global _cached
+    _cached = None
+
+
+def table_sizes(using=DEFAULT_DB_ALIAS):
+    """``[(table, rows, bytes or None)]``; bytes come from SQLite's ``dbstat`` table when it is compiled in."""
+    connection = connections[using]
+    sizes = {}
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            try:
+                cursor.execute('SELECT name, SUM(pgsize) FROM dbstat GROUP BY name')
+                sizes = dict(cursor.fetchall())
+            except OperationalError:  # no such table: dbstat
+                sizes = {}
+        rows = []
+        for table in connection.introspection.table_names(cursor):
+            cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+            rows.append((table, cursor.fetchone()[0], sizes.get(table)))
+    return rows
+
+
+def home_query_plans(phase, using=DEFAULT_DB_ALIAS):
+    """``[(label, sql, plan)]`` for the queries ``views.home`` runs without a snapshot."""
+    plans = []
+    for label, queryset in (
+        ('Media of the phase', Media.objects.using(using).filter(phase=phase)),
+        ('History of the phase', History.objects.using(using).filter(phase=phase)),
+    ):
+        plans.append((label, str(queryset.query), queryset.explain()))
+    return plans
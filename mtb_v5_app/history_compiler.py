@@ -0,0 +1,194 @@
+"""Server-side compilation of ``History.content`` (CKEditor HTML).
+
+``compile_history()`` turns the stored editor HTML into the markup the home
+page renders:
+
+* sanitized against an allowlist of the tags/attributes/styles the CKEditor
+  toolbar in ``settings.CKEDITOR_5_CONFIGS`` can produce (scripts, event
+  handlers and ``javascript:`` URLs are dropped);
+* whitespace inside text collapsed to single spaces;
+* the highlighting rules of ``static/js/history-enhancer.js`` (band name,
+  Beatle names, years, quotations, album/LP/EP/Single titles) applied to text
+  nodes only, so attributes and tags are never rewritten.
+
+The result is stored in ``History.compiled_content`` when the row is saved.
+"""
+
+import re
+from html import escape
+from html.parser import HTMLParser
+
+ALLOWED_TAGS = {
+    'a', 'b', 'blockquote', 'br', 'code', 'div', 'em', 'figure', 'figcaption', 'h1', 'h2', 'h3', 'h4',
+    'h5', 'h6', 'hr', 'i', 'img', 'li', 'ol', 'p', 'pre', 's', 'small', 'span', 'strike', 'strong',
+    'sub', 'sup', 'table', 'tbody', 'td', 'th', 'thead', 'tr', 'u', 'ul',
+}
+VOID_TAGS = {'br', 'hr', 'img'}
+# Start tag -> (open tags it implicitly closes, open tags that stop the search).
+# A simplified version of the HTML parsing rules for optional end tags.
+_BLOCK_TAGS = {
+    'blockquote', 'div', 'figure', 'figcaption', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'ol', 'p', 'pre',
+    'table', 'ul',
+}
+IMPLIED_END_TAGS = {
+    **{tag: ({'p'}, {'table', 'td', 'th'}) for tag in _BLOCK_TAGS},
+    'li': ({'li'}, {'ol', 'ul', 'table'}),
+    'td': ({'td', 'th'}, {'tr', 'table'}),
+    'th': ({'td', 'th'}, {'tr', 'table'}),
+    'tr': ({'tr'}, {'table'}),
+    'tbody': ({'thead', 'tbody'}, {'table'}),
+    'thead': ({'thead', 'tbody'}, {'table'}),
+}
+# Dropped together with everything inside them.
+DROP_CONTENT_TAGS = {'script', 'style', 'iframe', 'object', 'embed', 'noscript', 'template', 'svg', 'math'}
+
+ALLOWED_ATTRIBUTES = {
+    '*': {'class', 'style', 'title'},
+    'a': {'href', 'target', 'rel'},
+    'img': {'src', 'alt', 'width', 'height'},
+    'td': {'colspan', 'rowspan'},
+    'th': {'colspan', 'rowspan'},
+}
+ALLOWED_STYLES = {
+    'background-color', 'color', 'font-family', 'font-size', 'font-style', 'font-weight',
+    'margin-left', 'padding-left', 'text-align', 'text-decoration',
+}
+ALLOWED_URL_SCHEMES = ('http', 'https', 'mailto', 'tel')
+
+_SCHEME_RE = re.compile(r'^\s*([a-zA-Z][a-zA-Z0-9+.\-]*):')
+_WHITESPACE_RE = re.compile(r'\s+')
+_UNSAFE_STYLE_VALUE_RE = re.compile(r'url\s*\(|expression\s*\(|[<>\\]', re.IGNORECASE)
+
+# Ported from history-enhancer.js, combined into one pass. Alternatives are
+# tried in the same priority order the script applied them. The quote rule
+# only fires on quotes that are not inside a word, so apostrophes ("John's")
+# are left alone.
+_ENHANCE_RE = re.compile(
+    r'(?P<band_name>\b(?:The Beatles|Beatles)\b)'
+    r'|(?P<beatle_name>\b(?:John|Paul|George|Ringo|Lennon|McCartney|Harrison|Starr)\b)'
+    r'|(?P<year>\b(?:19\d{2}|20\d{2})\b)'
+    r'|(?<!\w)["“‘](?P<quote>[^"\'“”‘’<>]+)["”’](?!\w)'
+    r'|(?P<album_name>\b[A-Za-z ]+?(?:Album|LP|EP|Single)\b)'
+)
+_ENHANCE_CLASSES = {
+    'band_name': 'band-name',
+    'beatle_name': 'beatle-name',
+    'year': 'year',
+    'album_name': 'album-name',
+}
+
+
+def _safe_url(value):
+    match = _SCHEME_RE.match(value)
+    return match is None or match.group(1).lower() in ALLOWED_URL_SCHEMES
+
+
+def _clean_style(value):
+    declarations = []
+    for declaration in value.split(';'):
+        name, _, style_value = declaration.partition(':')
+        name = name.strip().lower()
+        style_value = style_value.strip()
+        if name in ALLOWED_STYLES and style_value and not _UNSAFE_STYLE_VALUE_RE.search(style_value):
+            declarations.append(f'{name}: {style_value}')
+    return '; '.join(declarations)
+
+
+def enhance_text(text):
+    """Escape ``text`` and wrap the highlighted terms in ``<span>``s."""
+    parts = []
+    position = 0
+    for match in _ENHANCE_RE.finditer(text):
+        parts.append(escape(text[position:match.start()], quote=False))
+        kind = match.lastgroup
+        if kind == 'quote':
+            parts.append(f'<span class="quote">"{escape(match.group("quote"), quote=False)}"</span>')
+        else:
+            parts.append(f'<span class="{_ENHANCE_CLASSES[kind]}">{escape(match.group(), quote=False)}</span>')
+        position = match.end()
+    parts.append(escape(text[position:], quote=False))
+    return ''.join(parts)
+
+
+class _Compiler(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self.open_tags = []
+        self.drop_depth = 0
+
+    def _attributes(self, tag, attrs):
+        allowed = ALLOWED_ATTRIBUTES['*'] | ALLOWED_ATTRIBUTES.get(tag, set())
+        cleaned = []
+        for name, value in attrs:
+            name = name.lower()
+            value = value or ''
+            if name not in allowed:
+                continue
+            if name in ('href', 'src') and not _safe_url(value):
+                continue
+            if name == 'style':
+                value = _clean_style(value)
+                if not value:
+                    continue
+            cleaned.append(f' {name}="{escape(value, quote=True)}"')
+        names = {name.lower() for name, _ in attrs}
+        if tag == 'a' and 'target' in names and 'rel' not in names:
+            cleaned.append(' rel="noopener noreferrer"')
+        return ''.join(cleaned)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            self.drop_depth += 1
+            return
+        if self.drop_depth or tag not in ALLOWED_TAGS:
+            return
+        self._close_implied(tag)
+        self.out.append(f'<{tag}{self._attributes(tag, attrs)}>')
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def _close_implied(self, tag):
+        closes, boundaries = IMPLIED_END_TAGS.get(tag, ((), ()))
+        for index in range(len(self.open_tags) - 1, -1, -1):
+            open_tag = self.open_tags[index]
+            if open_tag in closes:
+                self._close_to(index)
+                return
+            if open_tag in boundaries:
+                return
+
+    def _close_to(self, index):
+        while len(self.open_tags) > index:
+            self.out.append(f'</{self.open_tags.pop()}>')
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS:
+            self.drop_depth = max(self.drop_depth - 1, 0)
+            return
+        if self.drop_depth or tag not in self.open_tags:
+            return
+        # Close anything left open inside this element so the output nests properly.
+        self._close_to(len(self.open_tags) - 1 - self.open_tags[::-1].index(tag))
+
+    def handle_data(self, data):
+        if self.drop_depth:
+            return
+        if 'pre' in self.open_tags:
+            self.out.append(escape(data, quote=False))
+        else:
+            self.out.append(enhance_text(_WHITESPACE_RE.sub(' ', data)))
+
+    def result(self):
+        self.close()
+        self._close_to(0)
+        return ''.join(self.out).strip()
+
+
+def compile_history(html):
+    """Return sanitized, whitespace-collapsed, enhanced HTML for ``html``."""
+    if not html:
+        return ''
+    compiler = _Compiler()
+    compiler.feed(html)
+    return compiler.result()
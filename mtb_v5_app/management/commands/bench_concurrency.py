@@ -0,0 +1,86 @@
+import asyncio
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mtb_v5_app import benchmark
+
+## Compare WSGI (8 worker threads) and ASGI with 0, 16 and 64 slow video viewers (throw-away test database)
+#python manage.py bench_concurrency
+
+## More viewers, slower clients, results kept for comparison
+#python manage.py bench_concurrency --viewers 0 --viewers 128 --chunk-delay 0.02 --output bench/concurrency.json
+
+class Command(BaseCommand):
+    help = (
+        'Measure home page latency while slow clients stream videos, through the WSGI '
+        'application (fixed worker pool) and the ASGI application (async views)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--viewers', type=int, action='append', help='Concurrent video downloads (repeatable, default: 0, 16, 64)')
+        parser.add_argument('--pages', type=int, default=200, help='Home page requests per run (default: 200)')
+        parser.add_argument('--concurrency', type=int, default=4, help='Concurrent page clients (default: 4)')
+        parser.add_argument('--workers', type=int, default=8, help='WSGI worker threads, like gunicorn --threads (default: 8)')
+        parser.add_argument('--video-size', type=int, default=2 * 1024 * 1024, help='Bytes per generated video file')
+        parser.add_argument('--chunk-delay', type=float, default=0.01, help='Seconds a viewer waits per 64 KiB chunk (default: 0.01)')
+        parser.add_argument('--output', type=str, help='Write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        options['viewers'] = options['viewers'] or [0, 16, 64]
+        if min(options['pages'], options['concurrency'], options['workers'], options['video_size']) < 1:
+            raise CommandError('--pages, --concurrency, --workers and --video-size must be positive')
+        if min(options['viewers']) < 0 or options['chunk_delay'] < 0:
+            raise CommandError('--viewers and --chunk-delay cannot be negative')
+
+        from mtb_v5_settings.asgi import application as asgi_application
+        from mtb_v5_settings.wsgi import application as wsgi_application
+
+        page_path = '/?phase=01'
+        video_path = '/media/01/bench-clip.mp4'
+        results = []
+        with benchmark.scratch_environment() as media_root:
+            benchmark.seed(10, 500, 100, media_root, options['video_size'])
+            # Warm-up: fill the page cache and import everything on both paths.
+            benchmark.wsgi_request(wsgi_application, page_path)
+            asyncio.run(benchmark.asgi_request(asgi_application, page_path))
+
+            self.stdout.write(
+                f'\n{"server":<6} {"viewers":>8} {"page req/s":>11} {"p50 ms":>9} {"p95 ms":>9} '
+                f'{"p99 ms":>9} {"video p50 s":>12} {"errors":>7}'
+            )
+            for viewers in options['viewers']:
+                for server in ('wsgi', 'asgi'):
+                    started = time.perf_counter()
+                    if server == 'wsgi':
+                        stats = benchmark.run_capacity_wsgi(
+                            wsgi_application, page_path, video_path, viewers, options['pages'],
+                            options['concurrency'], options['workers'], options['chunk_delay'],
+                        )
+                    else:
+                        stats = asyncio.run(benchmark.run_capacity_asgi(
+                            asgi_application, page_path, video_path, viewers, options['pages'],
+                            options['concurrency'], options['chunk_delay'],
+                        ))
+                    stats.update(server=server, viewers=viewers, seconds=round(time.perf_counter() - started, 3))
+                    results.append(stats)
+                    self._print(stats)
+
+        if options['output']:
+            meta = benchmark.run_metadata(
+                'wsgi+asgi', options, ('viewers', 'pages', 'concurrency', 'workers', 'video_size', 'chunk_delay'),
+            )
+            with open(options['output'], 'w') as f:
+                json.dump({'meta': meta, 'results': results}, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Results written to {options["output"]}'))
+
+    def _print(self, stats):
+        pages, videos = stats['pages'], stats['videos']
+        video_p50 = f'{videos["p50_ms"] / 1000:.2f}' if videos['p50_ms'] is not None else '-'
+        errors = pages['errors'] + videos['errors']
+        style = self.style.ERROR if errors else self.style.SUCCESS
+        self.stdout.write(style(
+            f'{stats["server"]:<6} {stats["viewers"]:>8} {pages["rps"]:>11} {pages["p50_ms"]:>9} '
+            f'{pages["p95_ms"]:>9} {pages["p99_ms"]:>9} {video_p50:>12} {errors:>7}'
+        ))
@@ -0,0 +1,117 @@
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mtb_v5_app.phases import PHASE_CODES
+
+## Compare the home page Media queries before/after the phase index (100k rows)
+#python manage.py bench_phase_query
+
+## Bigger table, more repetitions
+#python manage.py bench_phase_query --rows 500000 --repeat 100
+
+COLUMNS = 'id, title, phase, path, type, page_id, updated_at'
+
+# Schema of mtb_v5_app_media and the queries Django issues, before and after migration 0004.
+# Both listings return the same rows in the same order (position keeps its default), so the
+# only difference measured is the schema: the baseline table (no position column, no index)
+# sorting by id versus the (phase, position, id) index.
+#
+# The index is not covering for the listing: with five phases each one holds ~20% of the
+# table, and fetching those rows through the index costs about as much as scanning and
+# sorting them, so the listing does not get faster. Only the version aggregate
+# (COUNT/MAX, answered from the index alone) does. Repeated listings are served by the page
+# cache and the phase snapshots instead.
+SCHEMAS = {
+    'before': {
+        'ddl': [
+            'CREATE TABLE media (id integer PRIMARY KEY AUTOINCREMENT, title varchar(255), phase varchar(2), '
+            'path varchar(255), type varchar(255), page_id bigint, updated_at datetime)',
+        ],
+        'queries': {
+            'listing': f'SELECT {COLUMNS} FROM media WHERE phase = ? ORDER BY id',
+            'count': 'SELECT COUNT(id), MAX(id) FROM media WHERE phase = ?',
+        },
+    },
+    'after': {
+        'ddl': [
+            'CREATE TABLE media (id integer PRIMARY KEY AUTOINCREMENT, title varchar(255), phase varchar(2), '
+            'path varchar(255), type varchar(255), page_id bigint, updated_at datetime, '
+            'position integer NOT NULL DEFAULT 0)',  # populate_media_table leaves the default
+            'CREATE INDEX media_phase_position_idx ON media (phase, position, id)',
+        ],
+        'queries': {
+            'listing': f'SELECT {COLUMNS} FROM media WHERE phase = ? ORDER BY phase, position, id',
+            'count': 'SELECT COUNT(id), MAX(id) FROM media WHERE phase = ?',
+        },
+    },
+}
+
+class Command(BaseCommand):
+    help = 'Benchmark the home page phase queries on a synthetic Media table, before and after indexing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100_000, help='Media rows to generate (default: 100000)')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per query and phase (default: 20)')
+        parser.add_argument('--seed', type=int, default=1964, help='Random seed for the synthetic data')
+
+    def handle(self, *args, **options):
+        if options['rows'] < 1 or options['repeat'] < 1:
+            raise CommandError('--rows and --repeat must be positive')
+
+        rng = random.Random(options['seed'])
+        rows = [
+            (f'Clip {i}', rng.choice(PHASE_CODES), f'clip-{i}', rng.choice(('image', 'video')), 0,
+             '2025-01-01 00:00:00')
+            for i in range(options['rows'])
+        ]
+
+        self.stdout.write(f'{options["rows"]} media rows in an on-disk SQLite file, '
+                          f'{options["repeat"]} runs per query and phase\n')
+        results = {}
+        fetched = {}
+        with tempfile.TemporaryDirectory() as tmp:
+            for label, schema in SCHEMAS.items():
+                conn = sqlite3.connect(os.path.join(tmp, f'{label}.sqlite3'))
+                conn.execute(schema['ddl'][0])
+                conn.executemany(
+                    'INSERT INTO media (title, phase, path, type, page_id, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                    rows,
+                )
+                for statement in schema['ddl'][1:]:
+                    conn.execute(statement)
+                conn.commit()
+                conn.execute('ANALYZE')
+
+                self.stdout.write(self.style.WARNING(f'{label}:'))
+                for name, query in schema['queries'].items():
+                    plan = ' | '.join(r[-1] for r in conn.execute(f'EXPLAIN QUERY PLAN {query}', ('01',)))
+                    timings = []
+                    for phase in PHASE_CODES:
+                        for _ in range(options['repeat']):
+                            started = time.perf_counter()
+                            result = conn.execute(query, (phase,)).fetchall()
+                            timings.append((time.perf_counter() - started) * 1000)
+                        fetched[label, name, phase] = result
+                    timings.sort()
+                    results[label, name] = statistics.mean(timings)
+                    self.stdout.write(
+                        f'  {name:<8} mean {statistics.mean(timings):7.2f} ms, '
+                        f'p50 {timings[len(timings) // 2]:7.2f} ms, '
+                        f'p95 {timings[int(len(timings) * 0.95) - 1]:7.2f} ms  [{plan}]'
+                    )
+                conn.close()
+
+        if any(fetched['before', name, phase] != fetched['after', name, phase] for _, name, phase in fetched):
+            raise CommandError('The before/after queries returned different rows')
+        self.stdout.write('')
+        for name in SCHEMAS['before']['queries']:
+            self.stdout.write(self.style.SUCCESS(
+                f'{name}: {results["before", name] / results["after", name]:.1f}x (mean before / mean after)'
+            ))
+        self.stdout.write('The index is not covering for the listing; only the count/max aggregate reads it alone.')
@@ -0,0 +1,87 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.http import HttpRequest, QueryDict
+from django.template import RequestContext
+from django.template.backends.django import DjangoTemplates
+from django.test.utils import override_settings
+
+from mtb_v5_app import views
+from mtb_v5_app.phases import PHASE_CODES
+
+## Per-render cost of home.html: plain vs cached template loader, fragment caching off vs on
+#python manage.py bench_templates
+
+## More repetitions
+#python manage.py bench_templates --repeat 500
+
+BENCH_CACHE = 'mtb-bench-templates'
+
+# (label, cached loader, fragment timeout)
+VARIANTS = (
+    ('plain loader, no fragments', False, 0),
+    ('cached loader, no fragments', True, 0),
+    ('cached loader + fragments', True, 3600),
+)
+
+class Command(BaseCommand):
+    help = 'Benchmark rendering home.html with and without the cached template loader and fragment caching'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=100, help='Timed renders per phase and variant (default: 100)')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be positive')
+
+        # Query once up front: only the template work is timed.
+        contents = {}
+        for phase in PHASE_CODES:
+            media_list, history_list = views._phase_content(phase)
+            contents[phase] = (list(media_list), list(history_list))
+
+        template_settings = settings.TEMPLATES[0]
+        caches = dict(settings.CACHES, **{BENCH_CACHE: {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': BENCH_CACHE,
+        }})
+        self.stdout.write(f'home.html, {options["repeat"]} renders per phase and variant\n')
+        results = {}
+        with override_settings(CACHES=caches):
+            for label, cached_loader, fragment_timeout in VARIANTS:
+                loaders = settings.TEMPLATE_LOADERS
+                if cached_loader:
+                    loaders = [('django.template.loaders.cached.Loader', loaders)]
+                # Same engine as settings.TEMPLATES (tag libraries, context processors), other loaders.
+                engine = DjangoTemplates({
+                    'NAME': f'bench-{label}', 'DIRS': template_settings['DIRS'], 'APP_DIRS': False,
+                    'OPTIONS': dict(template_settings['OPTIONS'], loaders=loaders),
+                }).engine
+                timings = []
+                for phase, (media_list, history_list) in contents.items():
+                    request = HttpRequest()
+                    request.method = 'GET'
+                    request.GET = QueryDict(f'phase={phase}')
+                    context = dict(
+                        views._home_context(phase, media_list, history_list),
+                        fragment_timeout=fragment_timeout, fragment_cache=BENCH_CACHE,
+                    )
+                    # Warm-up render: compiles the templates and fills the fragments.
+                    engine.get_template('home.html').render(RequestContext(request, context))
+                    for _ in range(options['repeat']):
+                        started = time.perf_counter()
+                        engine.get_template('home.html').render(RequestContext(request, context))
+                        timings.append((time.perf_counter() - started) * 1000)
+                timings.sort()
+                results[label] = statistics.mean(timings)
+                self.stdout.write(
+                    f'  {label:<28} mean {statistics.mean(timings):6.2f} ms, '
+                    f'p50 {timings[len(timings) // 2]:6.2f} ms, '
+                    f'p95 {timings[int(len(timings) * 0.95) - 1]:6.2f} ms'
+                )
+
+        self.stdout.write('')
+        baseline = results[VARIANTS[0][0]]
+        for label, mean in results.items():
+            self.stdout.write(self.style.SUCCESS(f'{label}: {baseline / mean:.1f}x (mean plain loader / mean)'))
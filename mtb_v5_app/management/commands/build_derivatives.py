@@ -0,0 +1,58 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from mtb_v5_app import caching, derivatives
+
+## Generate poster/background derivatives (run by deploy.sh; unchanged files are skipped)
+#python manage.py build_derivatives
+
+## Regenerate everything with custom widths
+#python manage.py build_derivatives --force --widths 480,960,1920
+
+class Command(BaseCommand):
+    help = 'Generate resized WebP/JPEG derivatives of posters and phase backgrounds'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Worker processes (default: number of CPUs)'
+        )
+        parser.add_argument(
+            '--widths',
+            type=str,
+            help='Comma-separated target widths (default: DERIVATIVE_WIDTHS)'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenerate files even when the source is unchanged'
+        )
+
+    def handle(self, *args, **options):
+        widths = settings.DERIVATIVE_WIDTHS
+        if options['widths']:
+            try:
+                widths = [int(w) for w in options['widths'].split(',') if w.strip()]
+            except ValueError:
+                raise CommandError('--widths must be a comma-separated list of integers')
+        if not widths or min(widths) < 1:
+            raise CommandError('At least one positive width is required')
+
+        self.stdout.write(f'Building derivatives in {derivatives.derivatives_root()} (widths: {", ".join(map(str, widths))})')
+        started = time.perf_counter()
+        counts = derivatives.build(widths=widths, workers=options['workers'], force=options['force'])
+        elapsed = time.perf_counter() - started
+        if counts['generated'] or counts['touched'] or counts['removed']:
+            caching.invalidate_pages()
+        if counts['failed']:
+            self.stdout.write(self.style.WARNING(f'{counts["failed"]} source image(s) could not be decoded'))
+        self.stdout.write(self.style.SUCCESS(
+            f'{counts["generated"]} generated, {counts["touched"]} re-stamped, '
+            f'{counts["unchanged"]} unchanged, {counts["removed"]} stale file(s) removed '
+            f'in {elapsed:.2f}s'
+        ))
@@ -0,0 +1,43 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from mtb_v5_app import caching, media_manifest
+
+## Fingerprint MEDIA_ROOT and write .br/.gz variants (run by deploy.sh; unchanged files are skipped)
+#python manage.py build_media_manifest
+
+## Re-hash and recompress everything
+#python manage.py build_media_manifest --force
+
+class Command(BaseCommand):
+    help = 'Hash every file in MEDIA_ROOT into media-manifest.json and precompress compressible types'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Worker threads (default: number of CPUs)'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Re-hash and recompress files even when size and mtime are unchanged'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Building {media_manifest.manifest_path()}')
+        if media_manifest.brotli is None:
+            self.stdout.write(self.style.WARNING('brotli is not installed; writing gzip variants only'))
+        started = time.perf_counter()
+        counts = media_manifest.build(workers=options['workers'], force=options['force'])
+        elapsed = time.perf_counter() - started
+        if counts['hashed'] or counts['removed']:
+            # Rendered pages embed the fingerprinted URLs.
+            caching.invalidate_pages()
+        self.stdout.write(self.style.SUCCESS(
+            f'{counts["hashed"]} hashed, {counts["touched"]} re-stamped, {counts["unchanged"]} unchanged, '
+            f'{counts["removed"]} removed, {counts["compressed"]} with compressed variants in {elapsed:.2f}s'
+        ))
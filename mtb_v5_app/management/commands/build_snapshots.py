@@ -0,0 +1,52 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from mtb_v5_app import caching, snapshots
+from mtb_v5_app.phases import PHASE_CODES, is_valid_phase, normalize_phase
+
+## Build all five phase snapshots (run by deploy.sh after collectstatic)
+#python manage.py build_snapshots
+
+## Rebuild a single phase into another directory
+#python manage.py build_snapshots --phase 3 --output /tmp/snapshots
+
+class Command(BaseCommand):
+    help = 'Materialize each phase (Media rows and History HTML) into a precomputed snapshot file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--phase',
+            action='append',
+            help='Phase to build (repeatable, default: all phases)'
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='Snapshot directory (default: SNAPSHOT_ROOT)'
+        )
+
+    def handle(self, *args, **options):
+        phases = [normalize_phase(p) for p in options['phase'] or PHASE_CODES]
+        invalid = [p for p in phases if not is_valid_phase(p)]
+        if invalid:
+            raise CommandError(f'Unknown phase(s): {", ".join(invalid)}')
+
+        root = options['output'] or settings.SNAPSHOT_ROOT
+        self.stdout.write(f'Writing snapshots to {root}')
+        if not settings.SNAPSHOT_ENABLED:
+            self.stdout.write(self.style.WARNING('SNAPSHOT_ENABLED is off; views.home will ignore these files'))
+
+        for phase in phases:
+            started = time.perf_counter()
+            data = snapshots.write_snapshot(phase, root=root)
+            elapsed = (time.perf_counter() - started) * 1000
+            self.stdout.write(
+                f'  Phase {phase}: {len(data["media"])} media, {len(data["history"])} history '
+                f'({elapsed:.1f} ms)'
+            )
+
+        # Versions cached before the rebuild may predate the new files.
+        caching.invalidate_pages(phases)
+        self.stdout.write(self.style.SUCCESS(f'Built {len(phases)} snapshot(s)'))
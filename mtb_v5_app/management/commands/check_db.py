@@ -1,56 +1,59 @@
-import sqlite3
-
-conn = sqlite3.connect('db.sqlite3')
-cursor = conn.cursor()
-
-# Get all tables
-cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-tables = cursor.fetchall()
-
-print("=" * 60)
-print("DATABASE VERIFICATION REPORT")
-print("=" * 60)
-print(f"\nTotal tables: {len(tables)}\n")
-
-for table in tables:
-    table_name = table[0]
-    cursor.execute(f'SELECT COUNT(*) FROM "{table_name}"')
-    count = cursor.fetchone()[0]
-    print(f"{table_name}: {count} rows")
-
-# Check specific tables for the project
-print("\n" + "=" * 60)
-print("PROJECT-SPECIFIC TABLE DETAILS")
-print("=" * 60)
-
-# Check Page table
-try:
-    cursor.execute("SELECT COUNT(*) FROM mtb_v5_app_page")
-    page_count = cursor.fetchone()[0]
-    cursor.execute("SELECT phase, COUNT(*) FROM mtb_v5_app_page GROUP BY phase ORDER BY phase")
-    pages_by_phase = cursor.fetchall()
-    print(f"\nPage table: {page_count} total pages")
-    print("Pages by phase:")
-    for phase, count in pages_by_phase:
-        print(f"  Phase {phase}: {count} pages")
-except Exception as e:
-    print(f"\nError checking Page table: {e}")
-
-# Check Media table
-try:
-    cursor.execute("SELECT COUNT(*) FROM mtb_v5_app_media")
-    media_count = cursor.fetchone()[0]
-    print(f"\nMedia table: {media_count} total media items")
-except Exception as e:
-    print(f"\nError checking Media table: {e}")
-
-# Check History table
-try:
-    cursor.execute("SELECT COUNT(*) FROM mtb_v5_app_history")
-    history_count = cursor.fetchone()[0]
-    print(f"\nHistory table: {history_count} total history entries")
-except Exception as e:
-    print(f"\nError checking History table: {e}")
-
-conn.close()
-print("\n" + "=" * 60)
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from mtb_v5_app import healthchecks
+from mtb_v5_app.phases import DEFAULT_PHASE, is_valid_phase, normalize_phase
+
+## Readiness probes, table sizes and the home page query plans of the default database
+#python manage.py check_db
+
+## Another alias / phase
+#python manage.py check_db --database readonly --phase 3
+
+class Command(BaseCommand):
+    help = 'Check the database like /health/?mode=ready, list table sizes and EXPLAIN the home page queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database',
+            default=DEFAULT_DB_ALIAS,
+            help='Database alias to check (default: default)'
+        )
+        parser.add_argument(
+            '--phase',
+            default=DEFAULT_PHASE,
+            help=f'Phase whose home page queries are explained (default: {DEFAULT_PHASE})'
+        )
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if using not in connections:
+            raise CommandError(f'Unknown database alias {using!r}')
+        phase = normalize_phase(options['phase'])
+        if not is_valid_phase(phase):
+            raise CommandError(f'Unknown phase {options["phase"]!r}')
+
+        self.stdout.write(f'Database {using!r}: {connections[using].settings_dict["NAME"]}')
+        result = healthchecks.run_checks(using)
+        for name, check in result['checks'].items():
+            details = ', '.join(
+                f'{key}: {value}' for key, value in check.items() if key not in ('ok', 'ms') and value
+            )
+            line = f'  {name:<18} {"ok" if check["ok"] else "FAILED":<6} {check["ms"]:8.2f} ms  {details}'
+            self.stdout.write(self.style.SUCCESS(line) if check['ok'] else self.style.ERROR(line))
+        if not result['checks']['database']['ok']:
+            raise CommandError('Database is not reachable')
+
+        self.stdout.write('\nTables:')
+        for table, rows, size in healthchecks.table_sizes(using):
+            size_text = f'{size / 1024:10.1f} KiB' if size is not None else ''
+            self.stdout.write(f'  {table:<40} {rows:>10} rows {size_text}')
+
+        self.stdout.write(f'\nHome page queries (phase {phase}):')
+        for label, sql, plan in healthchecks.home_query_plans(phase, using):
+            self.stdout.write(f'  {label}\n    {sql}')
+            for line in plan.splitlines():
+                self.stdout.write(f'    {line}')
+
+        if result['status'] != 'ok':
+            raise CommandError('Readiness checks failed')
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand, CommandError
 from django.core.cache import cache, caches
 from django.conf import settings
+from mtb_v5_app import caching as home_cache
 
 ## Basic usage with confirmation prompt
 #python manage.py clearcache
@@ -180,6 +181,16 @@ class Command(BaseCommand):
             else:
                 self.stdout.write(f'  • Backend: {backend_class}')
                 self.stdout.write('  • No detailed stats available for this backend')
+
+            # Home page response cache counters (stored in the cache itself)
+            if cache_instance is home_cache.get_cache():
+                page_stats = home_cache.get_stats(cache_instance)
+                self.stdout.write('  • Home page cache:')
+                self.stdout.write(f'      Hits: {self.style.SUCCESS(str(page_stats["hits"]))}')
+                self.stdout.write(f'      Misses: {self.style.SUCCESS(str(page_stats["misses"]))}')
+                hit_rate = f'{page_stats["hit_rate"] * 100:.1f}%'
+                self.stdout.write(f'      Hit rate: {self.style.SUCCESS(hit_rate)}')
+                self.stdout.write(f'      Cached phases: {self.style.SUCCESS(str(page_stats["cached_phases"]))}')
                 
         except Exception as e:
             self.stdout.write(f'  • Error retrieving stats: {str(e)}')
@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from mtb_v5_app.history_compiler import compile_history
+from mtb_v5_app.models import History
+from mtb_v5_app.signals import notify_content_changed
+
+## Recompile every History row (e.g. after changing history_compiler.py)
+#python manage.py compile_history
+
+## Only rows that were never compiled (bulk imports)
+#python manage.py compile_history --missing-only
+
+class Command(BaseCommand):
+    help = 'Backfill History.compiled_content (sanitized, enhanced HTML rendered by the home page)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--missing-only',
+            action='store_true',
+            help='Only compile rows whose compiled_content is empty'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Rows per bulk UPDATE (default: 500)'
+        )
+
+    def handle(self, *args, **options):
+        queryset = History.objects.only('id', 'content', 'compiled_content').order_by('id')
+        if options['missing_only']:
+            queryset = queryset.filter(compiled_content='')
+
+        started = time.perf_counter()
+        changed = 0
+        total = 0
+        batch = []
+        with transaction.atomic():
+            for history in queryset.iterator(chunk_size=options['batch_size']):
+                total += 1
+                compiled = compile_history(history.content)
+                if compiled != history.compiled_content:
+                    history.compiled_content = compiled
+                    batch.append(history)
+                if len(batch) >= options['batch_size']:
+                    History.objects.bulk_update(batch, ['compiled_content'])
+                    changed += len(batch)
+                    batch = []
+            if batch:
+                History.objects.bulk_update(batch, ['compiled_content'])
+                changed += len(batch)
+
+        if changed:
+            # bulk_update() sends no signals.
+            notify_content_changed()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Compiled {total} history row(s), {changed} updated in {elapsed:.2f}s'
+        ))
@@ -1,65 +1,203 @@
+import base64
+import gzip
+import json
 import os
+import pathlib
+import re
 import sqlite3
-import json
-from django.core.management.base import BaseCommand
+import time
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+
+## Whole database to one JSON file (same layout as before: {table: {columns, data}})
+#python manage.py dump-sqlite3 db.sqlite3 dump.json
+
+## NDJSON, gzip-compressed (inferred from .gz), only two tables
+#python manage.py dump-sqlite3 db.sqlite3 dump.ndjson.gz --format ndjson --table mtb_v5_app_media --table mtb_v5_app_history
+
+## One file per table in dump/, four tables at a time
+#python manage.py dump-sqlite3 db.sqlite3 dump/ --parallel 4 --format ndjson --compress gzip
+
+EXTENSIONS = { 'json': '.json', 'ndjson': '.ndjson' }
+_UNSAFE_FILENAME_RE = re.compile( r'[^A-Za-z0-9_.-]+' )
+
+
+def _connect( db_file ):
+	# Read-only: a dump must never create, lock for writing or modify the database.
+	uri = pathlib.Path( db_file ).resolve( ).as_uri( ) + '?mode=ro'
+	return sqlite3.connect( uri, uri = True )
+
+
+def _open_output( path, compress ):
+	if compress == 'gzip':
+		return gzip.open( path, 'wt', encoding = 'utf-8', compresslevel = 6 )
+	return open( path, 'w', encoding = 'utf-8' )
+
+
+def _json_default( value ):
+	# BLOB columns
+	if isinstance( value, bytes ):
+		return { '$base64': base64.b64encode( value ).decode( 'ascii' ) }
+	raise TypeError( f'Object of type {type( value ).__name__} is not JSON serializable' )
+
+
+def _dumps( value ):
+	return json.dumps( value, default = _json_default, ensure_ascii = False )
+
+
+def _quote( name ):
+	return '"' + name.replace( '"', '""' ) + '"'
+
+
+def table_filenames( table_names, suffix ):
+	"""``{table: file name}`` for --parallel: table names come from the database, so they may not touch the path."""
+	filenames = {}
+	used = set( )
+	for index, name in enumerate( table_names ):
+		stem = _UNSAFE_FILENAME_RE.sub( '_', name ).lstrip( '.' ) or 'table'
+		if stem != name or stem in used:
+			# Renamed, so it could clash with another table: the index keeps it unique.
+			stem = f'{stem}-{index}'
+		used.add( stem )
+		filenames[ name ] = stem + suffix
+	return filenames
+
+
+def list_tables( conn ):
+	cursor = conn.execute( "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name;" )
+	return [ row[ 0 ] for row in cursor ]
+
+
+def iter_rows( conn, table_name, batch_size ):
+	"""Yield ``(columns, row_dict)`` in ``fetchmany`` batches, so memory stays flat."""
+	cursor = conn.execute( f'SELECT * FROM {_quote( table_name )};' )
+	columns = [ description[ 0 ] for description in cursor.description ]
+	while True:
+		rows = cursor.fetchmany( batch_size )
+		if not rows:
+			break
+		for row in rows:
+			yield dict( zip( columns, row ) )
+
+
+def table_columns( conn, table_name ):
+	return [ row[ 1 ] for row in conn.execute( f'PRAGMA table_info({_quote( table_name )});' ) ]
+
+
+def write_table( out, conn, table_name, fmt, batch_size, indent = '' ):
+	"""Stream one table to ``out``; returns the number of rows written.
+
+	``json`` writes ``{"columns": [...], "data": [...]}`` with one row per
+	line, ``ndjson`` writes one ``{"table", "row"}`` object per line.
+	"""
+	count = 0
+	if fmt == 'ndjson':
+		for row in iter_rows( conn, table_name, batch_size ):
+			out.write( _dumps( { 'table': table_name, 'row': row } ) )
+			out.write( '\n' )
+			count += 1
+		return count
+
+	out.write( f'{{\n{indent}  "columns": {_dumps( table_columns( conn, table_name ) )},\n{indent}  "data": [' )
+	for row in iter_rows( conn, table_name, batch_size ):
+		out.write( ',\n' if count else '\n' )
+		out.write( f'{indent}    {_dumps( row )}' )
+		count += 1
+	out.write( f'\n{indent}  ]\n{indent}}}' if count else ']\n' + indent + '}' )
+	return count
+
+
+def dump_table_file( db_file, table_name, path, fmt, compress, batch_size ):
+	"""Worker for ``--parallel``: one table, one connection, one file."""
+	started = time.perf_counter( )
+	conn = _connect( db_file )
+	try:
+		with _open_output( path, compress ) as out:
+			count = write_table( out, conn, table_name, fmt, batch_size )
+			if fmt == 'json':
+				out.write( '\n' )
+	finally:
+		conn.close( )
+	return table_name, path, count, time.perf_counter( ) - started
+
 
 class Command( BaseCommand ):
-	help = 'Dump SQLite database contents to a JSON file'
-	
+	help = 'Dump SQLite database contents to JSON/NDJSON (streamed, optionally gzip-compressed or one file per table)'
+
 	def add_arguments( self, parser ):
 		parser.add_argument( 'db_file', type = str, help = 'Path to the SQLite database file' )
-		parser.add_argument( 'output_file', type = str, help = 'Path to the output JSON file' )
-	
+		parser.add_argument( 'output_file', type = str, help = 'Path to the output file (a directory with --parallel)' )
+		parser.add_argument( '--format', choices = [ 'json', 'ndjson' ], default = 'json', help = 'Output format (default: json)' )
+		parser.add_argument( '--compress', choices = [ 'none', 'gzip' ], help = 'Compression (default: gzip if the output ends in .gz)' )
+		parser.add_argument( '--table', action = 'append', dest = 'tables', help = 'Only dump this table (repeatable)' )
+		parser.add_argument( '--exclude-table', action = 'append', default = [ ], help = 'Skip this table (repeatable)' )
+		parser.add_argument( '--batch-size', type = int, default = 1000, help = 'Rows fetched per fetchmany() call (default: 1000)' )
+		parser.add_argument( '--parallel', type = int, default = 0, help = 'Dump N tables at a time into separate files in output_file/' )
+
 	def handle( self, *args, **options ):
 		db_file = options[ 'db_file' ]
 		output_file = options[ 'output_file' ]
-		
+		fmt = options[ 'format' ]
+		batch_size = options[ 'batch_size' ]
+		compress = options[ 'compress' ] or ( 'gzip' if output_file.endswith( '.gz' ) else 'none' )
+
 		if not os.path.exists( db_file ):
 			self.stdout.write( self.style.ERROR( f'Database file not found: {db_file}' ) )
 			return
-		
+		if batch_size < 1 or options[ 'parallel' ] < 0:
+			raise CommandError( '--batch-size must be positive and --parallel cannot be negative' )
+
 		self.stdout.write( self.style.SUCCESS( f'Dumping database: {db_file}' ) )
-		
-		# Connect to the database
-		conn = sqlite3.connect( db_file )
-		conn.row_factory = sqlite3.Row
-		cursor = conn.cursor( )
-		
-		# Get table names
-		cursor.execute( "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%';" )
-		tables = cursor.fetchall( )
-		table_names = [ table[ 'name' ] for table in tables ]
-		
-		# Initialize result dictionary
-		result = { }
-		
-		# Iterate through tables
-		for table_name in table_names:
-			self.stdout.write( f'Processing table: {table_name}' )
-			
-			# Get column names
-			cursor.execute( f"PRAGMA table_info({table_name});" )
-			columns_info = cursor.fetchall( )
-			column_names = [ column[ 'name' ] for column in columns_info ]
-			
-			# Get table data
-			cursor.execute( f"SELECT * FROM {table_name};" )
-			rows = cursor.fetchall( )
-			
-			# Format as list of dictionaries
-			table_data = [ ]
-			for row in rows:
-				row_dict = { column: row[ column ] for column in row.keys( ) }
-				table_data.append( row_dict )
-			
-			# Add to result
-			result[ table_name ] = {
-			'columns': column_names,
-			'data'   : table_data
-			}
-		
-		# Write to file
-		with open( output_file, 'w' ) as f:
-			json.dump( result, f, indent = 2 )
-		
-		self.stdout.write( self.style.SUCCESS( f'Database dump completed: {output_file}' ) )
+
+		conn = _connect( db_file )
+		try:
+			table_names = list_tables( conn )
+			if options[ 'tables' ]:
+				missing = set( options[ 'tables' ] ) - set( table_names )
+				if missing:
+					raise CommandError( f'Unknown table(s): {", ".join( sorted( missing ) )}' )
+				table_names = [ name for name in table_names if name in options[ 'tables' ] ]
+			table_names = [ name for name in table_names if name not in options[ 'exclude_table' ] ]
+
+			started = time.perf_counter( )
+			if options[ 'parallel' ]:
+				total = self._dump_parallel( db_file, table_names, output_file, fmt, compress, batch_size, options[ 'parallel' ] )
+			else:
+				total = self._dump_single( conn, table_names, output_file, fmt, compress, batch_size )
+		finally:
+			conn.close( )
+
+		elapsed = time.perf_counter( ) - started
+		self.stdout.write( self.style.SUCCESS(
+			f'Database dump completed: {output_file} ({len( table_names )} tables, {total} rows in {elapsed:.2f}s)'
+		) )
+
+	def _dump_single( self, conn, table_names, output_file, fmt, compress, batch_size ):
+		total = 0
+		with _open_output( output_file, compress ) as out:
+			if fmt == 'json':
+				out.write( '{' )
+			for index, table_name in enumerate( table_names ):
+				self.stdout.write( f'Processing table: {table_name}' )
+				if fmt == 'json':
+					out.write( f'{"," if index else ""}\n  {_dumps( table_name )}: ' )
+				total += write_table( out, conn, table_name, fmt, batch_size, indent = '  ' )
+			if fmt == 'json':
+				out.write( '\n}\n' if table_names else '}\n' )
+		return total
+
+	def _dump_parallel( self, db_file, table_names, output_dir, fmt, compress, batch_size, workers ):
+		os.makedirs( output_dir, exist_ok = True )
+		suffix = EXTENSIONS[ fmt ] + ( '.gz' if compress == 'gzip' else '' )
+		filenames = table_filenames( table_names, suffix )
+		total = 0
+		with ProcessPoolExecutor( max_workers = workers ) as pool:
+			futures = [
+			pool.submit( dump_table_file, db_file, name, os.path.join( output_dir, filenames[ name ] ), fmt, compress, batch_size )
+			for name in table_names
+			]
+			for future in futures:
+				table_name, path, count, elapsed = future.result( )
+				self.stdout.write( f'Processing table: {table_name} -> {path} ({count} rows, {elapsed:.2f}s)' )
+				total += count
+		return total
@@ -0,0 +1,44 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mtb_v5_app import caching, mp4
+
+## Move the moov box of every phase video in front of its media data (checked files are skipped until they change)
+#python manage.py faststart_media
+
+## Re-check every file, ignoring MEDIA_ROOT/.faststart.json
+#python manage.py faststart_media --force
+
+class Command(BaseCommand):
+    help = 'Rewrite the MP4 videos in MEDIA_ROOT/<phase>/ so playback can start before the whole file is fetched'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Worker processes (default: number of CPUs)'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Inspect files even when the state file says they are unchanged'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Checking the videos in {settings.MEDIA_ROOT}/<phase>/')
+        started = time.perf_counter()
+        counts = mp4.build(workers=options['workers'], force=options['force'])
+        elapsed = time.perf_counter() - started
+        if counts['optimized']:
+            # Media URLs and ETags derived from the old bytes.
+            caching.invalidate_pages()
+        if counts['skipped']:
+            self.stdout.write(self.style.WARNING(f'{counts["skipped"]} file(s) are not plain MP4s and were left alone'))
+        self.stdout.write(self.style.SUCCESS(
+            f'{counts["optimized"]} optimized, {counts["already"]} already faststart, '
+            f'{counts["unchanged"]} unchanged since the last run in {elapsed:.2f}s'
+        ))
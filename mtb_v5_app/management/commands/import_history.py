@@ -1,84 +1,130 @@
 import os
 import sqlite3
-from django.core.management.base import BaseCommand
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from mtb_v5_app import search
+from mtb_v5_app.history_compiler import compile_history
 from mtb_v5_app.models import Page, History
+from mtb_v5_app.phases import normalize_phase
+from mtb_v5_app.signals import notify_content_changed
+
+## Import the history table of an old database (rows get new ids)
+#python manage.py import_history db.sqlite3.new
+
+## Re-runnable import keeping the source ids (existing rows are updated)
+#python manage.py import_history legacy.sqlite3 --upsert --batch-size 2000
 
 class Command(BaseCommand):
 	help = 'Import history data from old database file'
-	
+
+	def add_arguments(self, parser):
+		parser.add_argument('source', nargs='?', default='db.sqlite3.new', help='Path to the old SQLite database (default: db.sqlite3.new)')
+		parser.add_argument('--table', help='History table in the old database (default: the first table named like "history")')
+		parser.add_argument('--batch-size', type=int, default=500, help='Rows per fetchmany()/bulk_create() batch (default: 500)')
+		parser.add_argument('--upsert', action='store_true', help='Keep the source ids and update rows that already exist, so the import can be re-run')
+
 	def handle(self, *args, **options):
-		old_db_path = 'db.sqlite3.new'  # Path to your old database
-		
+		old_db_path = options['source']
+		batch_size = options['batch_size']
+
 		if not os.path.exists(old_db_path):
 			self.stdout.write(self.style.ERROR(f'Old database file not found: {old_db_path}'))
 			return
-		
+		if batch_size < 1:
+			raise CommandError('--batch-size must be positive')
+
 		self.stdout.write(self.style.SUCCESS('Starting history data import from old database'))
-		
-		# Connect to the old database
-		conn = sqlite3.connect(old_db_path)
+
+		# Connect to the old database (read-only)
+		conn = sqlite3.connect(f'file:{os.path.abspath(old_db_path)}?mode=ro', uri=True)
 		conn.row_factory = sqlite3.Row  # This allows accessing columns by name
-		cursor = conn.cursor()
-		
-		# Get table names to verify the database structure
-		cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-		tables = cursor.fetchall()
-		table_names = [t['name'] for t in tables]
+		try:
+			history_table_name = self._find_table(conn, options['table'])
+			column_names = [col['name'] for col in conn.execute(f'PRAGMA table_info("{history_table_name}");')]
+			self.stdout.write(f"Columns in history table: {', '.join(column_names)}")
+			if 'page_id' not in column_names or (options['upsert'] and 'id' not in column_names):
+				raise CommandError(f"{history_table_name} needs a page_id column{' and an id column for --upsert' if options['upsert'] else ''}")
+
+			started = time.perf_counter()
+			with transaction.atomic():
+				pages_created = self._create_missing_pages(conn, history_table_name, batch_size)
+				imported = self._import_rows(conn, history_table_name, column_names, batch_size, options['upsert'], search.is_available())
+			elapsed = time.perf_counter() - started
+		finally:
+			conn.close()
+
+		if imported or pages_created:
+			# bulk_create() sends no signals: drop cached pages and snapshots once.
+			notify_content_changed()
+		rate = imported / elapsed if elapsed else 0
+		self.stdout.write(self.style.SUCCESS(
+			f'History data import completed! {imported} history rows ({pages_created} placeholder pages) '
+			f'in {elapsed:.2f}s, {rate:.0f} rows/s'
+		))
+
+	def _find_table(self, conn, table_name):
+		table_names = [t['name'] for t in conn.execute("SELECT name FROM sqlite_master WHERE type='table';")]
 		self.stdout.write(f"Tables in old database: {', '.join(table_names)}")
-		
-		# Check if History table exists
-		history_table_name = None
+		if table_name:
+			if table_name not in table_names:
+				raise CommandError(f'Table {table_name} not found in the old database')
+			return table_name
 		for table in table_names:
 			if 'history' in table.lower():
-				history_table_name = table
+				self.stdout.write(f"Found history table: {table}")
+				return table
+		raise CommandError('History table not found in the old database')
+
+	def _create_missing_pages(self, conn, history_table_name, batch_size):
+		# One query on each side instead of an exists() per history row.
+		referenced = {row[0] for row in conn.execute(f'SELECT DISTINCT page_id FROM "{history_table_name}" WHERE page_id IS NOT NULL;')}
+		existing = set(Page.objects.filter(id__in=referenced).values_list('id', flat=True)) if len(referenced) < 900 else set(Page.objects.values_list('id', flat=True))
+		missing = sorted(referenced - existing)
+		for page_id in missing:
+			self.stdout.write(f"Creating placeholder Page with ID {page_id}")
+		Page.objects.bulk_create(
+			[Page(id=page_id, name=f"Placeholder Page {page_id}", phase="01") for page_id in missing],
+			batch_size=batch_size,
+		)
+		return len(missing)
+
+	def _import_rows(self, conn, history_table_name, column_names, batch_size, upsert, index):
+		has_content = 'content' in column_names
+		has_phase = 'phase' in column_names
+		now = timezone.now()
+		cursor = conn.execute(f'SELECT * FROM "{history_table_name}" ORDER BY rowid;')
+		imported = 0
+		while True:
+			rows = cursor.fetchmany(batch_size)
+			if not rows:
 				break
-		
-		if not history_table_name:
-			self.stdout.write(self.style.ERROR('History table not found in the old database'))
-			return
-		
-		self.stdout.write(f"Found history table: {history_table_name}")
-		
-		# Get column names in the history table
-		cursor.execute(f"PRAGMA table_info({history_table_name});")
-		columns = cursor.fetchall()
-		column_names = [col['name'] for col in columns]
-		self.stdout.write(f"Columns in history table: {', '.join(column_names)}")
-		
-		# Import History data
-		try:
-			cursor.execute(f"SELECT * FROM {history_table_name};")
-			history_items = cursor.fetchall()
-			self.stdout.write(f"Found {len(history_items)} history items to import")
-			
-			# Check if the related Page objects exist
-			for history_data in history_items:
-				page_id = history_data['page_id']
-				
-				# Check if the page exists, create it if needed
-				if not Page.objects.filter(id=page_id).exists():
-					self.stdout.write(f"Creating placeholder Page with ID {page_id}")
-					# Create a placeholder page
-					Page.objects.create(
-					id=page_id,
-					name=f"Placeholder Page {page_id}",
-					phase="01"  # Default phase
-					)
-				
-				# Create the history record
-				history = History.objects.create(
-				content=history_data['content'] if 'content' in history_data else '',
-				phase=history_data['phase'] if 'phase' in history_data else '01',
-				page_id=page_id
+			batch = []
+			for history_data in rows:
+				content = (history_data['content'] if has_content else '') or ''
+				history = History(
+					content=content,
+					compiled_content=compile_history(content),
+					phase=normalize_phase(history_data['phase']) if has_phase else '01',
+					page_id=history_data['page_id'],
+					updated_at=now,
+				)
+				if upsert:
+					history.id = history_data['id']
+				batch.append(history)
+			if upsert:
+				History.objects.bulk_create(
+					batch,
+					update_conflicts=True,
+					unique_fields=['id'],
+					update_fields=['content', 'compiled_content', 'phase', 'page', 'updated_at'],
 				)
-				self.stdout.write(f"Imported history item: {history.id} for page {page_id}")
-		
-		except sqlite3.OperationalError as e:
-			self.stdout.write(self.style.ERROR(f"Error importing history: {str(e)}"))
-			# Get more details about the error
-			self.stdout.write(f"The error occurred while trying to access table: {history_table_name}")
-			self.stdout.write(f"Available columns: {', '.join(column_names)}")
-			self.stdout.write(f"Model requires: id, content, phase, page_id")
-		
-		conn.close()
-		self.stdout.write(self.style.SUCCESS('History data import completed!'))
+			else:
+				History.objects.bulk_create(batch)
+			if index:
+				# bulk_create() sends no post_save: index the batch for full-text search here.
+				search.index_rows([(history.id, history.phase, history.content) for history in batch])
+			imported += len(batch)
+			self.stdout.write(f"Imported {imported} history items")
+		return imported
@@ -0,0 +1,67 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mtb_v5_app import benchmark
+
+## Benchmark home/health/media with the defaults (throw-away test database)
+#python manage.py loadtest
+
+## Larger dataset, more concurrency, results kept for comparison across commits
+#python manage.py loadtest --media 20000 --history 5000 --concurrency 16 --requests 2000 --output bench/$(git rev-parse --short HEAD).json
+
+class Command(BaseCommand):
+    help = 'Seed a throw-away database and drive the WSGI application in-process, reporting req/s and latency percentiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=10, help='Page rows to seed (default: 10)')
+        parser.add_argument('--media', type=int, default=1000, help='Media rows to seed (default: 1000)')
+        parser.add_argument('--history', type=int, default=200, help='History rows to seed (default: 200)')
+        parser.add_argument('--video-size', type=int, default=4 * 1024 * 1024, help='Bytes per generated video file')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent client threads (default: 8)')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per scenario (default: 500)')
+        parser.add_argument('--scenario', action='append', help='Only run scenarios starting with this name (repeatable)')
+        parser.add_argument('--output', type=str, help='Write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        if min(options['concurrency'], options['requests'], options['video_size']) < 1:
+            raise CommandError('--concurrency, --requests and --video-size must be positive')
+
+        from mtb_v5_settings.wsgi import application
+
+        with benchmark.scratch_environment() as media_root:
+            started = time.perf_counter()
+            benchmark.seed(options['pages'], options['media'], options['history'], media_root, options['video_size'])
+            self.stdout.write(
+                f'Seeded {options["pages"]} pages, {options["media"]} media, {options["history"]} history '
+                f'in {time.perf_counter() - started:.2f}s'
+            )
+            results = self._run(application, options)
+
+        report = {
+            'meta': benchmark.run_metadata('wsgi', options, ('pages', 'media', 'history', 'video_size', 'concurrency', 'requests')),
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Results written to {options["output"]}'))
+
+    def _run(self, application, options):
+        results = {}
+        self.stdout.write(
+            f'\n{"scenario":<14} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"errors":>7}'
+        )
+        for name, path, headers in benchmark.default_scenarios(options['video_size']):
+            if options['scenario'] and not any(name.startswith(s) for s in options['scenario']):
+                continue
+            benchmark.wsgi_request(application, path, headers)  # warm-up (fills caches)
+            stats = benchmark.run_scenario(application, path, options['requests'], options['concurrency'], headers)
+            results[name] = stats
+            style = self.style.ERROR if stats['errors'] else self.style.SUCCESS
+            self.stdout.write(style(
+                f'{name:<14} {stats["rps"]:>9} {stats["p50_ms"]:>9} {stats["p95_ms"]:>9} '
+                f'{stats["p99_ms"]:>9} {stats["errors"]:>7}'
+            ))
+        return results
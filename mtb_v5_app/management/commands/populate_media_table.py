@@ -1,40 +1,134 @@
 import os
-from django.core.management.base import BaseCommand
-from django.core.exceptions import ObjectDoesNotExist
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from mtb_v5_app import mp4
 from mtb_v5_app.models import Media, Page
+from mtb_v5_app.phases import PHASE_CODES
+from mtb_v5_app.signals import notify_content_changed
+
+## Sync the Media table with MEDIA_ROOT/<phase>/ (safe to run on every deploy)
+#python manage.py populate_media_table
+
+## Show what would change without writing
+#python manage.py populate_media_table --dry-run
+
+## Leave the videos as they are (by default new or changed ones get moov moved to the front, see mp4.py)
+#python manage.py populate_media_table --no-faststart
+
+MEDIA_TYPES = { '.jpg': 'image', '.mp4': 'video' }
+
+def scan_phase( media_root, phase ):
+ """Scan one phase directory.
+
+ Returns ``( phase, found, skipped )`` where ``found`` maps ``( path, type )`` to
+ the title (both are the file name without extension) and ``skipped`` lists
+ files with unsupported extensions. ``found`` is ``None`` if the directory is missing.
+ """
+ phase_path = os.path.join( media_root, phase )
+ if not os.path.isdir( phase_path ):
+  return phase, None, [ ]
+ found = { }
+ skipped = [ ]
+ with os.scandir( phase_path ) as entries:
+  for entry in entries:
+   if not entry.is_file( ):
+    continue
+   title, ext = os.path.splitext( entry.name )
+   media_type = MEDIA_TYPES.get( ext.lower( ) )
+   if media_type:
+    found[ ( title, media_type ) ] = title
+   else:
+    skipped.append( entry.name )
+ return phase, found, skipped
 
 class Command( BaseCommand ):
- help = 'Populate the Media table with data from the /media folder'
-
- def handle( self, *args, **kwargs ):
-  media_root = os.path.join( os.getcwd( ), 'media' )
-  phases = [ '01', '02', '03', '04', '05' ]
-
-  self.stdout.write( self.style.SUCCESS( 'Starting to populate Media table' ) )
-
-  # Ensure Page object with pk=0 exists
-  try:
-   page = Page.objects.get( pk = 0 )
-  except ObjectDoesNotExist:
-   page = Page.objects.create( pk = 0, name = 'home', phase = 0 )  # Adjust fields as necessary
-   self.stdout.write( self.style.SUCCESS( 'Created default Page object with pk=0' ) )
-
-  for phase in phases:
-   phase_path = os.path.join( media_root, phase )
-   if os.path.isdir( phase_path ):
-    self.stdout.write( self.style.SUCCESS( f'Processing phase: {phase}' ) )
-    for file_name in os.listdir( phase_path ):
-     file_path = os.path.join( phase_path, file_name )
-     if os.path.isfile( file_path ):
-      title, ext = os.path.splitext( file_name )
-      media_type = 'image' if ext.lower( ) == '.jpg' else 'video' if ext.lower( ) == '.mp4' else None
-      if media_type:
-       Media.objects.create( title = title, phase = phase, path = title,  # Only the filename without extension
-        page = page, type = media_type )
-       self.stdout.write( self.style.SUCCESS( f'Successfully added {title} to Media table' ) )
-      else:
-       self.stdout.write( self.style.WARNING( f'Skipped file with unsupported extension: {file_name}' ) )
+ help = 'Sync the Media table with the files in MEDIA_ROOT/<phase>/ (bulk, idempotent)'
+
+ def add_arguments( self, parser ):
+  parser.add_argument( '--dry-run', action = 'store_true', help = 'Report the changes without writing them' )
+  parser.add_argument( '--media-root', type = str, help = 'Directory to scan (default: MEDIA_ROOT)' )
+  parser.add_argument( '--workers', type = int, default = len( PHASE_CODES ), help = 'Threads used to scan the phase directories' )
+  parser.add_argument( '--batch-size', type = int, default = 500, help = 'Rows per bulk INSERT' )
+  parser.add_argument( '--no-faststart', action = 'store_true', help = 'Do not move the moov box of the scanned videos to the front' )
+
+ def handle( self, *args, **options ):
+  media_root = options[ 'media_root' ] or settings.MEDIA_ROOT
+  dry_run = options[ 'dry_run' ]
+  if options[ 'workers' ] < 1:
+   raise CommandError( '--workers must be at least 1' )
+  started = time.perf_counter( )
+
+  self.stdout.write( self.style.SUCCESS( f'Scanning {media_root}' ) )
+  with ThreadPoolExecutor( max_workers = options[ 'workers' ] ) as pool:
+   scans = list( pool.map( lambda phase: scan_phase( media_root, phase ), PHASE_CODES ) )
+
+  scanned = { }
+  for phase, found, skipped in scans:
+   if found is None:
+    # A missing directory is treated as "not scanned", never as "delete everything".
+    self.stdout.write( self.style.WARNING( f'Phase directory does not exist: {os.path.join( media_root, phase )}' ) )
+    continue
+   scanned[ phase ] = found
+   for file_name in skipped:
+    self.stdout.write( self.style.WARNING( f'Skipped file with unsupported extension: {phase}/{file_name}' ) )
+
+  if not dry_run and not options[ 'no_faststart' ] and scanned:
+   # Process pool; files recorded in MEDIA_ROOT/.faststart.json with the same mtime and size are not read.
+   counts = mp4.build( media_root, sources = mp4.find_sources( media_root, phases = list( scanned ) ) )
+   self.stdout.write(
+    f'Faststart: {counts[ "optimized" ]} optimized, {counts[ "already" ]} already faststart, '
+    f'{counts[ "unchanged" ]} unchanged, {counts[ "skipped" ]} not a plain MP4'
+   )
+
+  # Diff against the existing rows by (phase, path, type); repeated keys left by
+  # earlier non-idempotent runs are duplicates and get removed.
+  summary = { phase: { 'files': len( found ), 'added': 0, 'removed': 0 } for phase, found in scanned.items( ) }
+  existing = { }
+  to_delete = [ ]
+  rows = Media.objects.filter( phase__in = scanned ).order_by( 'id' ).values_list( 'id', 'phase', 'path', 'type' )
+  for pk, phase, path, media_type in rows:
+   key = ( phase, path, media_type )
+   if key in existing or ( path, media_type ) not in scanned[ phase ]:
+    to_delete.append( pk )
+    summary[ phase ][ 'removed' ] += 1
    else:
-    self.stdout.write( self.style.WARNING( f'Phase directory does not exist: {phase_path}' ) )
+    existing[ key ] = pk
+
+  to_create = [ ( phase, path, media_type, title )
+   for phase, found in scanned.items( )
+   for ( path, media_type ), title in sorted( found.items( ) )
+   if ( phase, path, media_type ) not in existing ]
+
+  for phase, _, _, _ in to_create:
+   summary[ phase ][ 'added' ] += 1
+
+  if not dry_run and ( to_create or to_delete ):
+   with transaction.atomic( ):
+    # Ensure Page object with pk=0 exists
+    page, created = Page.objects.get_or_create( pk = 0, defaults = { 'name': 'home', 'phase': '00' } )
+    if created:
+     self.stdout.write( self.style.SUCCESS( 'Created default Page object with pk=0' ) )
+    batch_size = options[ 'batch_size' ]
+    for start in range( 0, len( to_delete ), batch_size ):
+     Media.objects.filter( pk__in = to_delete[ start:start + batch_size ] ).delete( )
+    Media.objects.bulk_create(
+     [ Media( title = title, phase = phase, path = path, page = page, type = media_type )  # path is the filename without extension
+      for phase, path, media_type, title in to_create ],
+     batch_size = batch_size,
+    )
+   # bulk_create() sends no signals; refresh the cached pages/snapshots once.
+   notify_content_changed( )
 
-  self.stdout.write( self.style.SUCCESS( 'Finished populating Media table' ) )
+  for phase, counts in summary.items( ):
+   self.stdout.write(
+    f'Phase {phase}: {counts[ "files" ]} files, +{counts[ "added" ]} added, '
+    f'-{counts[ "removed" ]} removed, {counts[ "files" ] - counts[ "added" ]} unchanged'
+   )
+  elapsed = time.perf_counter( ) - started
+  verb = 'Would apply' if dry_run else 'Applied'
+  self.stdout.write( self.style.SUCCESS(
+   f'{verb} {len( to_create )} insert(s) and {len( to_delete )} delete(s) in {elapsed:.2f}s'
+  ) )
@@ -0,0 +1,53 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from mtb_v5_app import media_probe
+from mtb_v5_app.models import Media
+from mtb_v5_app.phases import normalize_phase
+from mtb_v5_app.signals import notify_content_changed
+
+## Read dimensions, size, duration and content hash of every Media file (run by deploy.sh; unchanged files are skipped)
+#python manage.py probe_media
+
+## One phase, re-reading every file
+#python manage.py probe_media --phase 2 --force
+
+class Command(BaseCommand):
+    help = 'Fill the Media probe fields (width, height, size, duration, content hash) from the file headers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--phase',
+            type=str,
+            help='Only probe the media of this phase'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Worker processes (default: number of CPUs)'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Probe files even when their mtime and size are unchanged'
+        )
+
+    def handle(self, *args, **options):
+        queryset = Media.objects.all()
+        if options['phase']:
+            queryset = queryset.filter(phase=normalize_phase(options['phase']))
+
+        started = time.perf_counter()
+        counts = media_probe.build(queryset=queryset, workers=options['workers'], force=options['force'])
+        elapsed = time.perf_counter() - started
+        if counts['probed'] or counts['missing']:
+            # bulk_update() sends no signals.
+            notify_content_changed()
+        if counts['missing']:
+            self.stdout.write(self.style.WARNING(f'{counts["missing"]} Media row(s) point at a missing file'))
+        self.stdout.write(self.style.SUCCESS(
+            f'{counts["probed"]} probed, {counts["unchanged"]} unchanged in {elapsed:.2f}s'
+        ))
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from mtb_v5_app import search
+
+## Rebuild the FTS5 index behind /api/search/ and the History admin search
+#python manage.py rebuild_history_search
+
+## Bigger batches, then try a query
+#python manage.py rebuild_history_search --batch-size 10000 --query "cavern club"
+
+class Command(BaseCommand):
+    help = 'Rebuild the SQLite FTS5 full-text index of History content'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Rows stripped and indexed per batch (default: 2000)'
+        )
+        parser.add_argument(
+            '--database',
+            default='default',
+            help='Database alias (default: default)'
+        )
+        parser.add_argument(
+            '--query',
+            help='Run this search afterwards and print the ranked snippets'
+        )
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        if connections[using].vendor != 'sqlite':
+            raise CommandError('Full-text search uses SQLite FTS5; other databases fall back to icontains')
+
+        started = time.perf_counter()
+        with transaction.atomic(using=using):
+            count = search.rebuild(using=using, batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        rate = count / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} history rows in {elapsed:.2f}s ({rate:.0f} rows/s)'))
+
+        if options['query']:
+            started = time.perf_counter()
+            results = search.search(options['query'], using=using)
+            elapsed = (time.perf_counter() - started) * 1000
+            self.stdout.write(f'{len(results)} result(s) for {options["query"]!r} in {elapsed:.1f} ms')
+            for result in results:
+                self.stdout.write(f'  #{result["id"]} (phase {result["phase"]}, bm25 {result["rank"]}): {result["snippet"]}')
@@ -0,0 +1,45 @@
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from mtb_v5_app import caching, readonly_db
+
+## Replace the read-only copy at READ_ONLY_SQLITE_PATH with a fresh backup of db.sqlite3 (run by deploy.sh)
+#python manage.py refresh_readonly_db
+
+## Write the copy somewhere else
+#python manage.py refresh_readonly_db --path /tmp/readonly.sqlite3
+
+class Command(BaseCommand):
+    help = 'Atomically refresh the read-only SQLite copy used for public reads (SQLite backup API + rename)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            type=str,
+            help='Copy to write (default: READ_ONLY_SQLITE_PATH)'
+        )
+        parser.add_argument(
+            '--database',
+            default='default',
+            help='Database alias to copy (default: default)'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.READ_ONLY_SQLITE_PATH
+        if not path:
+            self.stdout.write('READ_ONLY_SQLITE_PATH is not set; nothing to refresh')
+            return
+
+        started = time.perf_counter()
+        try:
+            size = readonly_db.refresh_copy(path, using=options['database'])
+        except ImproperlyConfigured as exc:
+            raise CommandError(str(exc))
+        elapsed = (time.perf_counter() - started) * 1000
+
+        # Pages cached from the previous copy.
+        caching.invalidate_pages()
+        self.stdout.write(self.style.SUCCESS(f'Refreshed {path} ({size / 1024:.0f} KiB in {elapsed:.1f} ms)'))
@@ -0,0 +1,51 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from mtb_v5_app import caching, views
+from mtb_v5_app.phases import PHASE_CODES, is_valid_phase, normalize_phase
+
+## Pre-render all five phases and their /api/phase/ payloads (run by deploy.sh after build_snapshots)
+#python manage.py warmcache
+
+## Only some phases
+#python manage.py warmcache --phase 1 --phase 2
+
+class Command(BaseCommand):
+    help = 'Render every phase page and phase API payload into the cache so the first visitor gets a hit'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--phase',
+            action='append',
+            help='Phase to warm (repeatable, default: all phases)'
+        )
+
+    def handle(self, *args, **options):
+        phases = [normalize_phase(p) for p in options['phase'] or PHASE_CODES]
+        invalid = [p for p in phases if not is_valid_phase(p)]
+        if invalid:
+            raise CommandError(f'Unknown phase(s): {", ".join(invalid)}')
+
+        if not settings.HOME_CACHE_ENABLED:
+            self.stdout.write(self.style.WARNING('HOME_CACHE_ENABLED is off; the views do not read the cache, nothing to warm'))
+            return
+        backend = caching.get_cache().__class__.__name__
+        self.stdout.write(f'Warming {backend} ({settings.HOME_CACHE_ALIAS})')
+        if backend == 'LocMemCache':
+            self.stdout.write(self.style.WARNING(
+                'LocMemCache lives inside each process: these entries disappear when this command exits. '
+                'Set CACHE_BACKEND=file, redis or memcached to warm the cache the web workers use.'
+            ))
+
+        # Drop entries (and versions) rendered from the previous templates/content.
+        caching.invalidate_pages(phases)
+        total = time.perf_counter()
+        for phase in phases:
+            started = time.perf_counter()
+            page_size, api_size = views.warm_phase(phase)
+            elapsed = (time.perf_counter() - started) * 1000
+            self.stdout.write(f'  Phase {phase}: page {page_size / 1024:.1f} KiB, api {api_size / 1024:.1f} KiB ({elapsed:.1f} ms)')
+        elapsed = (time.perf_counter() - total) * 1000
+        self.stdout.write(self.style.SUCCESS(f'Warmed {len(phases)} phase(s) in {elapsed:.1f} ms'))
@@ -0,0 +1,220 @@
+"""Content-hashed URLs and precompressed variants for files in ``MEDIA_ROOT``.
+
+``manage.py build_media_manifest`` hashes every file below ``MEDIA_ROOT`` into
+``MEDIA_ROOT/media-manifest.json`` and writes ``.br``/``.gz`` siblings for
+compressible types (the same layout WhiteNoise uses for ``static/``). Files are
+not copied: ``url()`` returns a fingerprinted name such as
+``01/first_era-01.3fa2b1c9d0e4.jpg`` and ``views.serve_media`` maps it back to
+the original through ``resolve()``, sending it with an ``immutable`` far-future
+``Cache-Control``. A new hash, and therefore a new URL, appears only when the
+bytes change.
+
+The resized images in ``derivatives/`` already carry a content hash in their
+names and are skipped.
+"""
+
+import gzip
+import mimetypes
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .derivatives import DERIVATIVES_DIR, content_hash, load_json_cached, write_json_atomic
+from .derivatives import MANIFEST_NAME as DERIVATIVES_MANIFEST_NAME
+
+try:
+    import brotli
+except ImportError:  # Optional, as in WhiteNoise: only gzip variants are written.
+    brotli = None
+
+MANIFEST_NAME = 'media-manifest.json'
+MANIFEST_FORMAT = 1
+# Bookkeeping files stored in MEDIA_ROOT that views.serve_media must not publish.
+INTERNAL_FILES = frozenset({MANIFEST_NAME, f'{DERIVATIVES_DIR}/{DERIVATIVES_MANIFEST_NAME}'})
+
+# (Content-Encoding, file suffix) in order of preference.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+COMPRESSIBLE_TYPES = (
+    'text/', 'image/svg+xml', 'application/json', 'application/javascript',
+    'application/xml', 'application/xhtml+xml', 'application/wasm',
+)
+# Variants that do not save at least 5% are not worth a second file.
+MIN_SAVING = 0.95
+MIN_COMPRESS_SIZE = 512
+
+_HASHED_RE = re.compile(r'^(?P<stem>.+)\.(?P<hash>[0-9a-f]{12})(?P<ext>\.[^./]+)?$')
+
+
+def manifest_path(media_root=None):
+    return os.path.join(media_root or settings.MEDIA_ROOT, MANIFEST_NAME)
+
+
+def hashed_name(rel_path, digest):
+    """``01/clip.mp4`` -> ``01/clip.<digest>.mp4``."""
+    stem, ext = os.path.splitext(rel_path)
+    return f'{stem}.{digest}{ext}'
+
+
+def is_compressible(rel_path):
+    content_type, encoding = mimetypes.guess_type(rel_path)
+    return encoding is None and content_type is not None and content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def find_files(media_root=None):
+    """Relative paths of every servable file below ``media_root``."""
+    media_root = media_root or settings.MEDIA_ROOT
+    found = []
+    for dirpath, dirnames, filenames in os.walk(media_root):
+        rel_dir = os.path.relpath(dirpath, media_root).replace(os.sep, '/')
+        rel_dir = '' if rel_dir == '.' else rel_dir + '/'
+        dirnames[:] = sorted(
+            d for d in dirnames
+            if not d.startswith('.') and not (rel_dir == '' and d == DERIVATIVES_DIR)
+        )
+        names = set(filenames)
+        for name in sorted(names):
+            if name.startswith('.') or (rel_dir == '' and name == MANIFEST_NAME):
+                continue
+            # Our own .br/.gz variants are listed under their source file.
+            base, suffix = os.path.splitext(name)
+            if suffix in ('.br', '.gz') and base in names:
+                continue
+            found.append(rel_dir + name)
+    return found
+
+
+def _write_variant(source, encoding, suffix, size):
+    with open(source, 'rb') as f:
+        data = f.read()
+    if encoding == 'br':
+        compressed = brotli.compress(data)
+    else:
+        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+    target = source + suffix
+    if len(compressed) > size * MIN_SAVING:
+        if os.path.exists(target):
+            os.unlink(target)
+        return False
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(source), prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(compressed)
+        os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return True
+
+
+def _variants_exist(media_root, rel_path, entry):
+    suffixes = dict(ENCODINGS)
+    return all(os.path.exists(os.path.join(media_root, rel_path + suffixes[e])) for e in entry['encodings'])
+
+
+def process(media_root, rel_path, previous=None, force=False):
+    """Hash one file and (re)write its compressed variants.
+
+    Returns ``(rel_path, entry, status)`` with ``status`` one of
+    ``'unchanged'`` (mtime and size match the manifest), ``'touched'`` (mtime
+    changed, content did not) or ``'hashed'``.
+    """
+    source = os.path.join(media_root, rel_path)
+    st = os.stat(source)
+    if previous and not force and _variants_exist(media_root, rel_path, previous):
+        if (previous['mtime_ns'], previous['size']) == (st.st_mtime_ns, st.st_size):
+            return rel_path, previous, 'unchanged'
+        digest = content_hash(source)
+        if previous['hash'] == digest:
+            return rel_path, dict(previous, mtime_ns=st.st_mtime_ns, size=st.st_size), 'touched'
+    else:
+        digest = content_hash(source)
+
+    encodings = []
+    if is_compressible(rel_path) and st.st_size >= MIN_COMPRESS_SIZE:
+        for encoding, suffix in ENCODINGS:
+            if encoding == 'br' and brotli is None:
+                continue
+            if _write_variant(source, encoding, suffix, st.st_size):
+                encodings.append(encoding)
+    entry = {'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'hash': digest, 'encodings': encodings}
+    return rel_path, entry, 'hashed'
+
+
+def load_manifest(media_root=None):
+    return load_json_cached(manifest_path(media_root)).get('files', {})
+
+
+def build(media_root=None, workers=None, force=False):
+    """Hash every file in ``media_root`` and rewrite the manifest; returns ``{status: count}``.
+
+    Runs in threads: hashing and compression release the GIL. Variants of
+    files that no longer exist are deleted.
+    """
+    media_root = media_root or settings.MEDIA_ROOT
+    previous = load_manifest(media_root)
+    files = find_files(media_root)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda rel: process(media_root, rel, previous.get(rel), force), files))
+
+    counts = {'hashed': 0, 'touched': 0, 'unchanged': 0, 'removed': 0, 'compressed': 0}
+    manifest = {}
+    for rel_path, entry, status in results:
+        manifest[rel_path] = entry
+        counts[status] += 1
+        counts['compressed'] += bool(entry['encodings'])
+    suffixes = dict(ENCODINGS)
+    for rel_path in set(previous) - set(manifest):
+        for encoding in previous[rel_path]['encodings']:
+            variant = os.path.join(media_root, rel_path + suffixes[encoding])
+            if os.path.exists(variant):
+                os.unlink(variant)
+        counts['removed'] += 1
+    if manifest != previous:
+        write_json_atomic(manifest_path(media_root), {'format': MANIFEST_FORMAT, 'files': manifest})
+    return counts
+
+
+def url(rel_path):
+    """Fingerprinted URL of ``rel_path`` (the plain media URL if it is not in the manifest)."""
+    entry = load_manifest().get(rel_path)
+    if entry is None:
+        return f'{settings.MEDIA_URL}{rel_path}'
+    return f'{settings.MEDIA_URL}{hashed_name(rel_path, entry["hash"])}'
+
+
+def resolve(path):
+    """Map a requested media path to ``(file_path, immutable)``.
+
+    Fingerprinted names whose hash matches the manifest, and derivatives
+    (hashed by construction), may be cached forever by browsers and CDNs.
+    """
+    if path.startswith(f'{DERIVATIVES_DIR}/') and not path.endswith('.json'):
+        return path, True
+    match = _HASHED_RE.match(path)
+    if match:
+        original = match['stem'] + (match['ext'] or '')
+        entry = load_manifest().get(original)
+        if entry is not None and entry['hash'] == match['hash']:
+            return original, True
+    return path, False
+
+
+def negotiate(rel_path, accept_encoding):
+    """``(path to send, vary)``: the best precompressed variant the client accepts."""
+    entry = load_manifest().get(rel_path)
+    if not entry or not entry['encodings']:
+        return rel_path, False
+    accepted = {
+        token.split(';', 1)[0].strip().lower()
+        for token in (accept_encoding or '').split(',')
+        if not token.strip().endswith(';q=0')
+    }
+    suffixes = dict(ENCODINGS)
+    for encoding in entry['encodings']:
+        if encoding in accepted:
+            return rel_path + suffixes[encoding], True
+    return rel_path, True
@@ -0,0 +1,140 @@
+"""Header-only probing of the files behind ``Media`` rows.
+
+``manage.py probe_media`` fills ``Media.width``/``height``/``size``/``duration``/
+``content_hash``/``mtime_ns``. Dimensions come from the SOF marker of JPEG
+posters and from the ``tkhd`` box of videos. A video without one takes the
+size of its poster. The duration comes from the ``mvhd`` box. A file whose
+mtime and size still match the row is not opened at all. Changed files are
+read once more, in full, for the content hash. ``home.html`` uses the
+dimensions to reserve the card's space before the poster arrives.
+"""
+
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import mp4
+from .derivatives import content_hash, poster_source
+from .models import Media
+
+FIELDS = ('width', 'height', 'size', 'duration', 'content_hash', 'mtime_ns')
+
+# Start-of-frame markers (baseline, progressive, lossless, ...); C4/C8/CC are not frames.
+SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# Markers without a length field.
+STANDALONE_MARKERS = frozenset(range(0xD0, 0xD8)) | {0x01, 0xD8}
+
+
+def jpeg_size(path):
+    """``(width, height)`` from the first SOF marker of a JPEG, ``None`` if there is none."""
+    with open(path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            return None
+        while True:
+            byte = f.read(1)
+            if not byte:
+                return None
+            if byte != b'\xff':
+                continue
+            marker = f.read(1)
+            while marker == b'\xff':  # fill bytes
+                marker = f.read(1)
+            if not marker:
+                return None
+            code = marker[0]
+            if code in STANDALONE_MARKERS:
+                continue
+            if code in (0xD9, 0xDA):  # end of image / start of scan before any frame header
+                return None
+            length = f.read(2)
+            if len(length) < 2:
+                return None
+            if code in SOF_MARKERS:
+                frame = f.read(5)
+                if len(frame) < 5:
+                    return None
+                height, width = struct.unpack('>HH', frame[1:])
+                return (width, height) if width and height else None
+            f.seek(struct.unpack('>H', length)[0] - 2, os.SEEK_CUR)
+
+
+def media_file(phase, path, media_type):
+    """File of a ``Media`` row, relative to ``MEDIA_ROOT``."""
+    if media_type == 'video':
+        return f'{phase}/{path}.mp4'
+    return poster_source(phase, path)
+
+
+def probe(media_root, rel_path, poster=None, previous=None, force=False):
+    """Probe one file.
+
+    Returns ``(fields, status)`` with ``status`` one of ``'unchanged'``
+    (``previous`` mtime and size match; ``fields`` is ``None``), ``'probed'``
+    or ``'missing'`` (all fields cleared). Runs in worker processes, so it
+    only touches the filesystem.
+    """
+    source = os.path.join(media_root, rel_path)
+    try:
+        st = os.stat(source)
+    except FileNotFoundError:
+        if previous == (None, None):
+            return None, 'unchanged'
+        return dict.fromkeys(FIELDS) | {'content_hash': ''}, 'missing'
+    if not force and previous == (st.st_mtime_ns, st.st_size):
+        return None, 'unchanged'
+
+    fields = dict.fromkeys(FIELDS)
+    if rel_path.endswith('.mp4'):
+        try:
+            fields.update(mp4.movie_info(source))
+        except mp4.NotFaststartable:
+            pass  # e.g. a Git LFS pointer: size and hash only
+    else:
+        fields['width'], fields['height'] = jpeg_size(source) or (None, None)
+    if fields['width'] is None and poster and os.path.isfile(os.path.join(media_root, poster)):
+        fields['width'], fields['height'] = jpeg_size(os.path.join(media_root, poster)) or (None, None)
+    fields.update(size=st.st_size, mtime_ns=st.st_mtime_ns, content_hash=content_hash(source, length=64))
+    return fields, 'probed'
+
+
+def _probe_job(job):
+    pk, media_root, rel_path, poster, previous, force = job
+    return (pk, *probe(media_root, rel_path, poster, previous, force))
+
+
+def build(media_root=None, queryset=None, workers=None, force=False, batch_size=500):
+    """Probe the files of ``queryset`` (default: every ``Media`` row) and store the results.
+
+    Returns ``{status: count}``. Updated rows also get a new ``updated_at``,
+    so the phase ETags change with the markup that uses the new fields.
+    """
+    media_root = media_root or settings.MEDIA_ROOT
+    queryset = Media.objects.all() if queryset is None else queryset
+    jobs = [
+        (pk, media_root, media_file(phase, path, media_type),
+         poster_source(phase, path) if media_type == 'video' else None, (mtime_ns, size), force)
+        for pk, phase, path, media_type, mtime_ns, size in queryset.order_by('id').values_list(
+            'id', 'phase', 'path', 'type', 'mtime_ns', 'size',
+        )
+    ]
+    if workers == 1 or len(jobs) <= 1:
+        results = [_probe_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_probe_job, jobs, chunksize=16))
+
+    counts = {'probed': 0, 'unchanged': 0, 'missing': 0}
+    now = timezone.now()
+    updates = []
+    for pk, fields, status in results:
+        counts[status] += 1
+        if fields is not None:
+            updates.append(Media(pk=pk, updated_at=now, **fields))
+    if updates:
+        with transaction.atomic():
+            Media.objects.bulk_update(updates, [*FIELDS, 'updated_at'], batch_size=batch_size)
+    return counts
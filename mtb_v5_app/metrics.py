@@ -0,0 +1,182 @@
+"""Per-request query count and latency instrumentation.
+
+``RequestMetricsMiddleware`` records, for every request, the number of SQL
+queries, time spent in the database, time spent rendering templates and the
+total time. Records go into a fixed-size in-memory ring buffer (per process)
+that ``views.metrics`` summarizes as percentiles per view. GET/HEAD requests
+to views listed in ``settings.QUERY_BUDGETS`` are checked against their
+query budget (writes such as admin saves are recorded but not budgeted); with
+``QUERY_BUDGET_STRICT`` (meant for tests) an overrun raises
+``QueryBudgetExceeded`` so N+1 regressions fail loudly.
+"""
+
+import contextvars
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import Template as DjangoTemplate
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('mtb_request_metrics', default=None)
+_lock = threading.Lock()
+_buffer = deque(maxlen=1000)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A view ran more queries than ``settings.QUERY_BUDGETS`` allows."""
+
+
+def _timed_render(render):
+    def render_with_metrics(self, context=None, request=None):
+        record = _current.get()
+        if record is None:
+            return render(self, context, request)
+        started = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            record['render_ms'] += (time.perf_counter() - started) * 1000
+    render_with_metrics._mtb_metrics = True
+    return render_with_metrics
+
+
+def _install_template_timer():
+    # The backend Template.render is the entry point used by render() and
+    # TemplateResponse, so {% extends %}/{% include %} are counted once.
+    if not getattr(DjangoTemplate.render, '_mtb_metrics', False):
+        DjangoTemplate.render = _timed_render(DjangoTemplate.render)
+
+
+def _query_timer(execute, sql, params, many, context):
+    record = _current.get()
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if record is not None:
+            record['queries'] += 1
+            record['db_ms'] += (time.perf_counter() - started) * 1000
+
+
+def _install_query_timer(connection, **kwargs):
+    # Installed once per connection object (connections are per thread)
+    # instead of per request: the ASGI views run their queries through
+    # sync_to_async() in a database thread the middleware never sees.
+    if _query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _query_timer)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list (``None`` if empty)."""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def records():
+    with _lock:
+        return list(_buffer)
+
+
+def reset():
+    with _lock:
+        _buffer.clear()
+
+
+def summary():
+    """Percentiles of every recorded metric, grouped by view name."""
+    by_view = {}
+    for record in records():
+        by_view.setdefault(record['view'], []).append(record)
+    result = {}
+    for view, items in sorted(by_view.items()):
+        stats = {'requests': len(items)}
+        for field in ('total_ms', 'db_ms', 'render_ms', 'queries'):
+            values = sorted(item[field] for item in items)
+            stats[field] = {
+                'p50': percentile(values, 50),
+                'p95': percentile(values, 95),
+                'p99': percentile(values, 99),
+                'max': values[-1],
+            }
+        result[view] = stats
+    return result
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        global _buffer
+        if _buffer.maxlen != settings.REQUEST_METRICS_BUFFER_SIZE:
+            _buffer = deque(_buffer, maxlen=settings.REQUEST_METRICS_BUFFER_SIZE)
+        _install_template_timer()
+        connection_created.connect(_install_query_timer, dispatch_uid='mtb_request_metrics')
+        for conn in connections.all(initialized_only=True):
+            _install_query_timer(conn)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        record = {'queries': 0, 'db_ms': 0.0, 'render_ms': 0.0}
+        token = _current.set(record)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, record, started)
+
+    async def __acall__(self, request):
+        # sync_to_async() copies the context, so queries and renders running
+        # in worker threads still update this request's record.
+        record = {'queries': 0, 'db_ms': 0.0, 'render_ms': 0.0}
+        token = _current.set(record)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, record, started)
+
+    def _finish(self, request, response, record, started):
+        record['total_ms'] = (time.perf_counter() - started) * 1000
+
+        match = getattr(request, 'resolver_match', None)
+        record.update({
+            'view': (match.view_name if match else None) or 'unresolved',
+            'path': request.path,
+            'method': request.method,
+            'status': response.status_code,
+            'time': time.time(),
+        })
+        with _lock:
+            _buffer.append(record)
+
+        # Budgets are sized for page views; a POST (admin save, bulk action) legitimately runs more.
+        budget = settings.QUERY_BUDGETS.get(record['view']) if request.method in ('GET', 'HEAD') else None
+        if budget is not None and record['queries'] > budget:
+            message = (
+                f'{record["view"]} ran {record["queries"]} queries '
+                f'(budget {budget}) for {request.method} {request.get_full_path()}'
+            )
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
@@ -0,0 +1,95 @@
+"""Middleware that lets the same settings serve both WSGI and ASGI.
+
+Django runs a middleware chain asynchronously only if every middleware in it
+supports async; a single sync-only entry makes each ASGI request hop into a
+worker thread and back. WhiteNoise's middleware is sync-only, so it is
+subclassed here with an async entry point (static file lookups are in-memory
+dict hits once ``WHITENOISE_AUTOREFRESH`` is off).
+
+``PublicReadMiddleware`` marks public requests so their reads can be routed to
+the read-only database (see ``readonly_db``).
+"""
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.handlers.asgi import ASGIRequest
+from whitenoise.middleware import WhiteNoiseMiddleware as BaseWhiteNoiseMiddleware
+
+from . import readonly_db
+
+
+class WhiteNoiseMiddleware(BaseWhiteNoiseMiddleware):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            # Development only: the lookup hits the filesystem.
+            static_file = await sync_to_async(self.find_file, thread_sensitive=False)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+        return await self.get_response(request)
+
+
+class ASGIURLConfMiddleware:
+    """Route ASGI requests through ``settings.ASGI_URLCONF`` (the async views)."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self._route(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        self._route(request)
+        return await self.get_response(request)
+
+    @staticmethod
+    def _route(request):
+        if isinstance(request, ASGIRequest) and settings.ASGI_URLCONF:
+            request.urlconf = settings.ASGI_URLCONF
+
+
+class PublicReadMiddleware:
+    """Let ``readonly_db.ReadOnlyRouter`` send the reads of public requests to the read-only database."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.READ_ONLY_DATABASE:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with readonly_db.public_reads(readonly_db.is_public_request(request)):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with readonly_db.public_reads(readonly_db.is_public_request(request)):
+            return await self.get_response(request)
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.2 on 2026-10-18 06:50
+
+from django.db import migrations, models
+
+
+def zero_pad_phases(apps, schema_editor):
+    """Store every phase as a two-character string ('1' -> '01', 0 -> '00')."""
+    db_alias = schema_editor.connection.alias
+    for model_name in ('Page', 'Media', 'History'):
+        model = apps.get_model('mtb_v5_app', model_name)
+        for pk, phase in model.objects.using(db_alias).values_list('pk', 'phase'):
+            padded = str(phase).strip().zfill(2)
+            if padded != phase:
+                model.objects.using(db_alias).filter(pk=pk).update(phase=padded)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mtb_v5_app', '0003_media_history_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='history',
+            options={'ordering': ['phase', 'position', 'id'], 'verbose_name_plural': 'History'},
+        ),
+        migrations.AlterModelOptions(
+            name='media',
+            options={'ordering': ['phase', 'position', 'id'], 'verbose_name_plural': 'Media'},
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='position',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='media',
+            name='position',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='page',
+            name='phase',
+            field=models.CharField(max_length=2),
+        ),
+        migrations.RunPython(zero_pad_phases, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='history',
+            index=models.Index(fields=['phase', 'position', 'id'], name='history_phase_position_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='media',
+            index=models.Index(fields=['phase', 'position', 'id'], name='media_phase_position_idx'),
+        ),
+    ]
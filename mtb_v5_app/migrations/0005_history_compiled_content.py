@@ -0,0 +1,20 @@
+# Generated by Django 5.2.2 on 2026-10-18 06:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Existing rows are compiled by ``manage.py compile_history --missing-only``
+    # (run by deploy.sh); until then the home page compiles them on the fly.
+
+    dependencies = [
+        ('mtb_v5_app', '0004_normalize_phase_and_ordering'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='history',
+            name='compiled_content',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
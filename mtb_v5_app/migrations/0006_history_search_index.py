@@ -0,0 +1,62 @@
+import re
+from html import unescape
+
+from django.db import migrations
+from django.db.utils import OperationalError
+
+# Frozen copies of mtb_v5_app.search as of this migration: later changes to the
+# live module must not change what this migration does. Rows saved afterwards,
+# and ``manage.py rebuild_history_search``, use the live text extraction.
+TABLE = 'mtb_v5_app_history_fts'
+CREATE_SQL = (
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} '
+    "USING fts5(body, phase UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')"
+)
+DROP_SQL = f'DROP TABLE IF EXISTS {TABLE}'
+FILL_SQL = f'INSERT INTO {TABLE} (rowid, body, phase) VALUES (%s, %s, %s)'
+OPTIMIZE_SQL = f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')"
+
+_DROPPED_RE = re.compile(
+    r'<(script|style|iframe|object|embed|noscript|template|svg|math)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL
+)
+_TAG_RE = re.compile(r'<[^>]*>')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def _visible_text(html):
+    text = _TAG_RE.sub(' ', _DROPPED_RE.sub(' ', html or ''))
+    return _SPACE_RE.sub(' ', unescape(text)).strip()
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 is SQLite-only; elsewhere search.search() falls back to icontains.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(DROP_SQL)
+            cursor.execute(CREATE_SQL)
+    except OperationalError:
+        # SQLite compiled without FTS5: same fallback.
+        return
+    with schema_editor.connection.cursor() as source, schema_editor.connection.cursor() as cursor:
+        source.execute('SELECT id, phase, content FROM mtb_v5_app_history ORDER BY id')
+        while rows := source.fetchmany(2000):
+            cursor.executemany(FILL_SQL, [(pk, _visible_text(content), phase) for pk, phase, content in rows])
+        cursor.execute(OPTIMIZE_SQL)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(DROP_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mtb_v5_app', '0005_history_compiled_content'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,9 +1,10 @@
 from django.db import models
 from django_ckeditor_5.fields import CKEditor5Field
+from .history_compiler import compile_history
 
 class Page( models.Model ):
    name = models.CharField( max_length = 255 )
-   phase = models.IntegerField( )
+   phase = models.CharField( max_length = 2 )  # zero-padded like Media/History ('00' is the home page)
 
    class Meta:
       verbose_name_plural = "Page"
@@ -20,9 +21,23 @@ class Media( models.Model ):
       ('image', 'Poster'),
       ('video', 'Video'),
    ] )
+   position = models.PositiveIntegerField( default = 0 )
+   updated_at = models.DateTimeField( auto_now = True )
+   # Read from the file headers by `manage.py probe_media` (see media_probe.py); empty until then
+   width = models.PositiveIntegerField( null = True, blank = True, editable = False )
+   height = models.PositiveIntegerField( null = True, blank = True, editable = False )
+   size = models.PositiveBigIntegerField( null = True, blank = True, editable = False )  # bytes
+   duration = models.FloatField( null = True, blank = True, editable = False )  # seconds, videos only
+   content_hash = models.CharField( max_length = 64, blank = True, editable = False )
+   mtime_ns = models.BigIntegerField( null = True, blank = True, editable = False )
 
    class Meta:
       verbose_name_plural = "Media"
+      ordering = [ 'phase', 'position', 'id' ]
+      indexes = [
+         # Matches the home page query: WHERE phase = ? ORDER BY position, id
+         models.Index( fields = [ 'phase', 'position', 'id' ], name = 'media_phase_position_idx' ),
+      ]
 
    def __str__( self ):
       return f"Media: {self.title}"
@@ -34,12 +49,27 @@ class Media( models.Model ):
 
 class History( models.Model ):
    content = CKEditor5Field( config_name = 'default' )
+   # Sanitized/enhanced copy of ``content`` rendered by home.html (see history_compiler.py)
+   compiled_content = models.TextField( blank = True, editable = False )
    
    phase = models.CharField(max_length = 2  )
    page = models.ForeignKey( Page, on_delete = models.CASCADE )
+   position = models.PositiveIntegerField( default = 0 )
+   updated_at = models.DateTimeField( auto_now = True )
 
    class Meta:
       verbose_name_plural = "History"
+      ordering = [ 'phase', 'position', 'id' ]
+      indexes = [
+         models.Index( fields = [ 'phase', 'position', 'id' ], name = 'history_phase_position_idx' ),
+      ]
 
    def __str__( self ):
       return f"History: (Page {self.page.name})"
+
+   def save( self, *args, **kwargs ):
+      self.compiled_content = compile_history( self.content )
+      update_fields = kwargs.get( 'update_fields' )
+      if update_fields is not None and 'content' in update_fields:
+         kwargs[ 'update_fields' ] = { *update_fields, 'compiled_content' }
+      super( ).save( *args, **kwargs )
@@ -0,0 +1,337 @@
+"""Move the ``moov`` box of MP4 files in front of ``mdat`` ("faststart").
+
+Encoders often write the ``moov`` box (the index of every sample) after the
+media data. A browser must then fetch the end of the file before the first
+frame can play. ``faststart()`` rewrites such a file with ``moov`` directly
+before the first ``mdat``. The ``stco``/``co64`` chunk offsets inside it are
+shifted by the bytes inserted in front of the data. ``stco`` tables are
+widened to ``co64`` when a shifted offset no longer fits in 32 bits. Only the
+box headers and the ``moov`` box are parsed. The media data is copied in
+chunks to a temporary file next to the source, which then replaces it.
+
+``manage.py faststart_media`` and ``populate_media_table`` run ``build()``
+over the phase directories. ``MEDIA_ROOT/.faststart.json`` records the mtime
+and size of every file already checked, so it is not read again until it
+changes. ``movie_info()`` reads the duration and picture size from the same
+boxes for ``media_probe``.
+"""
+
+import os
+import shutil
+import struct
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+
+from .derivatives import load_json_cached, write_json_atomic
+from .phases import PHASE_CODES
+
+STATE_NAME = '.faststart.json'
+VIDEO_EXTENSIONS = ('.mp4',)
+
+# Boxes on the path from moov to the chunk offset tables.
+CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+COPY_CHUNK = 1024 * 1024
+MAX_32 = 0xFFFFFFFF
+
+
+class NotFaststartable(Exception):
+    """The file is not a plain MP4 that can be rewritten (no moov, fragmented, compressed moov, ...)."""
+
+
+def state_path(media_root=None):
+    return os.path.join(media_root or settings.MEDIA_ROOT, STATE_NAME)
+
+
+def find_sources(media_root=None, phases=PHASE_CODES):
+    """Relative paths of every video in the phase directories."""
+    media_root = media_root or settings.MEDIA_ROOT
+    sources = []
+    for phase in phases:
+        phase_dir = os.path.join(media_root, phase)
+        if not os.path.isdir(phase_dir):
+            continue
+        with os.scandir(phase_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(VIDEO_EXTENSIONS):
+                    sources.append(f'{phase}/{entry.name}')
+    return sorted(sources)
+
+
+def top_level_boxes(f):
+    """``[(type, offset, size)]`` of the top-level boxes, reading only their headers."""
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    boxes = []
+    offset = 0
+    while offset < file_size:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            raise NotFaststartable('truncated box header')
+        size, box_type = struct.unpack('>I4s', header)
+        if size == 1:
+            large = f.read(8)
+            if len(large) < 8:
+                raise NotFaststartable('truncated box header')
+            size = struct.unpack('>Q', large)[0]
+        elif size == 0:
+            size = file_size - offset
+        if size < 8 or offset + size > file_size:
+            raise NotFaststartable(f'bad size for box {box_type!r} at {offset}')
+        boxes.append((box_type, offset, size))
+        offset += size
+    return boxes
+
+
+def _parse(data):
+    """Split box payload ``data`` into ``[(type, header_size, children-or-bytes)]``."""
+    boxes = []
+    offset = 0
+    while offset < len(data):
+        if len(data) - offset < 8:
+            raise NotFaststartable('truncated box inside moov')
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header_size = 8
+        if size == 1:
+            if len(data) - offset < 16:
+                raise NotFaststartable('truncated box inside moov')
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = len(data) - offset
+        if size < header_size or offset + size > len(data):
+            raise NotFaststartable(f'bad size for box {box_type!r} inside moov')
+        payload = data[offset + header_size:offset + size]
+        if box_type == b'cmov':
+            raise NotFaststartable('compressed moov')
+        boxes.append((box_type, header_size, _parse(payload) if box_type in CONTAINERS else payload))
+        offset += size
+    return boxes
+
+
+def _serialize(boxes):
+    out = []
+    for box_type, header_size, body in boxes:
+        payload = _serialize(body) if isinstance(body, list) else body
+        size = len(payload) + header_size
+        if header_size == 16 or size > MAX_32:
+            out.append(struct.pack('>I4sQ', 1, box_type, size + (0 if header_size == 16 else 8)))
+        else:
+            out.append(struct.pack('>I4s', size, box_type))
+        out.append(payload)
+    return b''.join(out)
+
+
+def _offset_tables(boxes):
+    """Yield ``(list, index)`` of every stco/co64 box below ``boxes``."""
+    for index, (box_type, _, body) in enumerate(boxes):
+        if isinstance(body, list):
+            yield from _offset_tables(body)
+        elif box_type in (b'stco', b'co64'):
+            yield boxes, index
+
+
+def _read_offsets(box_type, payload):
+    if len(payload) < 8:
+        raise NotFaststartable(f'truncated {box_type.decode()} table')
+    version_flags, count = struct.unpack_from('>II', payload)
+    fmt = '>%dI' if box_type == b'stco' else '>%dQ'
+    width = 4 if box_type == b'stco' else 8
+    if len(payload) < 8 + count * width:
+        raise NotFaststartable(f'truncated {box_type.decode()} table')
+    return version_flags, list(struct.unpack_from(fmt % count, payload, 8))
+
+
+def _shifted_moov(moov_payload, shift):
+    """The ``moov`` box with every chunk offset passed through ``shift(offset, moov_size)``.
+
+    Widens ``stco`` to ``co64`` when needed, which changes the box size and
+    therefore the shift, so it iterates until the size is stable.
+    """
+    tree = _parse(moov_payload)
+    tables = [(boxes, index, *_read_offsets(boxes[index][0], boxes[index][2])) for boxes, index in _offset_tables(tree)]
+    wide = set()
+    while True:
+        size = len(_serialize([(b'moov', 8, tree)]))
+        for position, (boxes, index, version_flags, offsets) in enumerate(tables):
+            new_offsets = [shift(offset, size) for offset in offsets]
+            if position not in wide and max(new_offsets, default=0) > MAX_32:
+                wide.add(position)
+            if position in wide:
+                box_type, payload = b'co64', struct.pack(f'>II{len(new_offsets)}Q', version_flags, len(new_offsets), *new_offsets)
+            else:
+                box_type, payload = b'stco', struct.pack(f'>II{len(new_offsets)}I', version_flags, len(new_offsets), *new_offsets)
+            header_size = boxes[index][1]
+            boxes[index] = (box_type, header_size, payload)
+        moov = _serialize([(b'moov', 8, tree)])
+        if len(moov) == size:
+            return moov
+
+
+def needs_faststart(path):
+    """True if the ``moov`` box comes after the first ``mdat`` box."""
+    with open(path, 'rb') as f:
+        boxes = top_level_boxes(f)
+    types = [box_type for box_type, _, _ in boxes]
+    if types.count(b'moov') != 1 or b'mdat' not in types:
+        raise NotFaststartable('not exactly one moov box, or no mdat box')
+    if b'moof' in types:
+        raise NotFaststartable('fragmented MP4')
+    return types.index(b'moov') > types.index(b'mdat')
+
+
+def faststart(path):
+    """Rewrite ``path`` in place with ``moov`` first; returns False if it already was."""
+    if not needs_faststart(path):
+        return False
+    with open(path, 'rb') as f:
+        boxes = top_level_boxes(f)
+        [(_, moov_offset, moov_size)] = [box for box in boxes if box[0] == b'moov']
+        insert_at = next(offset for box_type, offset, _ in boxes if box_type == b'mdat')
+        f.seek(moov_offset)
+        header_size = 16 if struct.unpack('>I', f.read(4))[0] == 1 else 8
+        f.seek(moov_offset + header_size)
+        moov_payload = f.read(moov_size - header_size)
+
+        def shift(offset, new_size):
+            # Everything from the first mdat on moves back by the new moov;
+            # data that followed the old moov also loses its old position.
+            if offset >= moov_offset + moov_size:
+                return offset + new_size - moov_size
+            if offset >= insert_at:
+                return offset + new_size
+            return offset
+
+        moov = _shifted_moov(moov_payload, shift)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                f.seek(0)
+                _copy(f, out, insert_at)
+                out.write(moov)
+                _copy(f, out, moov_offset - insert_at)
+                f.seek(moov_offset + moov_size)
+                shutil.copyfileobj(f, out, COPY_CHUNK)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    try:
+        shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return True
+
+
+def _copy(source, target, length):
+    while length > 0:
+        chunk = source.read(min(COPY_CHUNK, length))
+        if not chunk:
+            raise NotFaststartable('file shrank while copying')
+        target.write(chunk)
+        length -= len(chunk)
+
+
+def _mvhd_duration(payload):
+    if len(payload) < 32:
+        return None
+    if payload[0] == 1:
+        timescale, duration = struct.unpack_from('>IQ', payload, 20)
+    else:
+        timescale, duration = struct.unpack_from('>II', payload, 12)
+        if duration == MAX_32:
+            return None
+    return round(duration / timescale, 3) if timescale else None
+
+
+def _tkhd_size(payload):
+    """Display ``(width, height)`` of a track, ``None`` for tracks without a picture."""
+    matrix = 52 if payload[:1] == b'\x01' else 40
+    if len(payload) < matrix + 44:
+        return None
+    width, height = (value >> 16 for value in struct.unpack_from('>II', payload, matrix + 36))
+    if not width or not height:
+        return None
+    a, b = struct.unpack_from('>ii', payload, matrix)
+    # Rotated by 90 or 270 degrees: the player shows it the other way round.
+    return (height, width) if a == 0 and b != 0 else (width, height)
+
+
+def movie_info(path):
+    """``{'duration', 'width', 'height'}`` from the ``mvhd`` box and the first video ``tkhd`` box.
+
+    Reads the top-level box headers and the ``moov`` box only. Values that
+    the file does not record are ``None``.
+    """
+    with open(path, 'rb') as f:
+        moov = [box for box in top_level_boxes(f) if box[0] == b'moov']
+        if not moov:
+            raise NotFaststartable('no moov box')
+        _, offset, size = moov[0]
+        f.seek(offset)
+        header_size = 16 if struct.unpack('>I', f.read(4))[0] == 1 else 8
+        f.seek(offset + header_size)
+        tree = _parse(f.read(size - header_size))
+    info = {'duration': None, 'width': None, 'height': None}
+    for box_type, _, body in tree:
+        if box_type == b'mvhd':
+            info['duration'] = _mvhd_duration(body)
+        elif box_type == b'trak' and info['width'] is None:
+            for child_type, _, child in body:
+                if child_type == b'tkhd':
+                    info['width'], info['height'] = _tkhd_size(child) or (None, None)
+    return info
+
+
+def optimize(media_root, rel_path, previous=None, force=False):
+    """Faststart one video.
+
+    Returns ``(rel_path, entry, status)`` with ``status`` one of ``'unchanged'``
+    (mtime and size match the state file), ``'optimized'``, ``'already'`` (moov
+    was already first) or ``'skipped'`` (not a rewritable MP4, e.g. a Git LFS
+    pointer). Runs in worker processes, so it only touches the filesystem.
+    """
+    source = os.path.join(media_root, rel_path)
+    st = os.stat(source)
+    if previous and not force and (previous['mtime_ns'], previous['size']) == (st.st_mtime_ns, st.st_size):
+        return rel_path, previous, 'unchanged'
+    try:
+        status = 'optimized' if faststart(source) else 'already'
+    except NotFaststartable as exc:
+        return rel_path, {'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'status': 'skipped', 'reason': str(exc)}, 'skipped'
+    st = os.stat(source)
+    return rel_path, {'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'status': status}, status
+
+
+def load_state(media_root=None):
+    return load_json_cached(state_path(media_root))
+
+
+def build(media_root=None, sources=None, workers=None, force=False):
+    """Faststart ``sources`` (default: every video) and update the state file; returns ``{status: count}``."""
+    media_root = media_root or settings.MEDIA_ROOT
+    full_build = sources is None
+    sources = find_sources(media_root) if full_build else list(sources)
+    state = dict(load_state(media_root))
+
+    jobs = [(media_root, rel, state.get(rel), force) for rel in sources]
+    if workers == 1 or len(jobs) <= 1:
+        results = [optimize(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(optimize, *zip(*jobs)))
+
+    counts = {'optimized': 0, 'already': 0, 'unchanged': 0, 'skipped': 0}
+    for rel_path, entry, status in results:
+        state[rel_path] = entry
+        counts[status] += 1
+    if full_build:
+        for rel_path in set(state) - set(sources):
+            del state[rel_path]
+    if counts['unchanged'] != len(results) or full_build:
+        write_json_atomic(state_path(media_root), state)
+    return counts
@@ -0,0 +1,40 @@
+"""Phase definitions shared by the views, caches and management commands."""
+
+# (code, label) pairs in display order. Codes are the zero-padded strings
+# stored in ``Media.phase`` / ``History.phase`` and used in ``?phase=``.
+PHASES = [
+    ('01', '1959 - 1962'),
+    ('02', '1962 - 1966'),
+    ('03', '1966 - 1970'),
+    ('04', '1970 - 9999'),
+    ('05', 'Karaokes'),
+]
+
+PHASE_CODES = tuple(code for code, _ in PHASES)
+
+DEFAULT_PHASE = '01'
+
+
+def normalize_phase(value):
+    """Return the zero-padded phase code for ``value`` (e.g. ``'1'`` -> ``'01'``)."""
+    if value is None:
+        return DEFAULT_PHASE
+    return str(value).strip().zfill(2)
+
+
+def is_valid_phase(phase):
+    """True if ``phase`` is one of the five known (normalized) phase codes."""
+    return phase in PHASE_CODES
+
+
+# Per-phase look: background image (relative to MEDIA_ROOT) and card colour.
+# Used by the phase API so the client can re-theme the page without a reload.
+PHASE_THEMES = {
+    '01': {'background': '01/first_era-background.jpg', 'card_color': 'black'},
+    '02': {'background': '02/second_era-background.jpg', 'card_color': 'navy'},
+    '03': {'background': '03/third_era-background.jpg', 'card_color': 'purple'},
+    '04': {'background': '04/fourth_era-background.jpg', 'card_color': 'gray'},
+    '05': {'background': '05/fifth_era-background.jpg', 'card_color': 'white'},
+}
+
+PHASE_LABELS = dict(PHASES)
@@ -0,0 +1,129 @@
+"""Optional read-only database for the public pages.
+
+When ``settings.READ_ONLY_DATABASE`` names a database alias, ``ReadOnlyRouter``
+sends reads of this app's models (``Page``, ``Media``, ``History``) to it, but
+only while ``PublicReadMiddleware`` has marked the request as public: a safe
+method outside ``READ_ONLY_EXCLUDED_PATHS`` (the admin). Writes, the admin,
+management commands and the snapshot builder keep using ``default``.
+
+The alias is either a replica from ``READ_ONLY_DATABASE_URL`` or a copy of the
+SQLite database at ``READ_ONLY_SQLITE_PATH``, opened with
+``mode=ro&immutable=1``. ``refresh_copy()`` rewrites that copy with the SQLite
+backup API into a temporary file and renames it over the old one, so readers
+see either the old or the new file, never a partial one. It runs from
+``manage.py refresh_readonly_db`` and after each content commit.
+"""
+
+import contextvars
+import os
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.transaction import TransactionManagementError
+
+_public = contextvars.ContextVar('mtb_public_reads', default=False)
+
+
+def is_public():
+    return _public.get()
+
+
+@contextmanager
+def public_reads(enabled=True):
+    """Route reads made inside the block like those of a public request."""
+    token = _public.set(enabled)
+    try:
+        yield
+    finally:
+        _public.reset(token)
+
+
+def is_public_request(request):
+    return request.method in ('GET', 'HEAD') and not request.path_info.startswith(
+        tuple(settings.READ_ONLY_EXCLUDED_PATHS)
+    )
+
+
+class ReadOnlyRouter:
+    """Send public reads of ``mtb_v5_app`` models to ``settings.READ_ONLY_DATABASE``."""
+
+    app_label = 'mtb_v5_app'
+
+    def db_for_read(self, model, **hints):
+        alias = settings.READ_ONLY_DATABASE
+        if alias and _public.get() and model._meta.app_label == self.app_label:
+            return alias
+        return None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Rows read from the copy may point at rows in default and vice versa.
+        if {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, settings.READ_ONLY_DATABASE}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        if settings.READ_ONLY_DATABASE and db == settings.READ_ONLY_DATABASE:
+            return False
+        return None
+
+
+def refresh_copy(path=None, using=DEFAULT_DB_ALIAS):
+    """Copy the SQLite database ``using`` to ``path`` atomically; returns the new file size."""
+    path = path or settings.READ_ONLY_SQLITE_PATH
+    if not path:
+        raise ImproperlyConfigured('Set READ_ONLY_SQLITE_PATH (or pass a path) to refresh the read-only copy.')
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        raise ImproperlyConfigured(f'Database {using!r} is not SQLite; replicas of other databases are kept up to date by the server.')
+    connection.ensure_connection()
+    if connection.connection.in_transaction:
+        # The backup would wait forever for the transaction's own lock.
+        raise TransactionManagementError('The read-only copy can only be refreshed outside a transaction.')
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.readonly-', suffix='.sqlite3')
+    os.close(fd)
+    try:
+        target = sqlite3.connect(tmp_path)
+        try:
+            connection.connection.backup(target)
+            # A mode=ro reader cannot create the -wal/-shm files a WAL database needs.
+            target.execute('PRAGMA journal_mode = DELETE')
+        finally:
+            target.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    # Connections of this process still read the replaced file.
+    alias = settings.READ_ONLY_DATABASE
+    if alias and alias in connections:
+        connections[alias].close()
+    return os.path.getsize(path)
+
+
+def _refresh_after_commit():
+    from . import caching
+
+    refresh_copy()
+    # Pages rendered between the commit and the refresh came from the old copy.
+    caching.invalidate_pages()
+
+
+def schedule_refresh():
+    """Refresh the SQLite copy once the current transaction commits (once per transaction)."""
+    if not settings.READ_ONLY_SQLITE_PATH or not settings.READ_ONLY_REFRESH_ON_SAVE:
+        return
+    pending = connections[DEFAULT_DB_ALIAS].run_on_commit
+    if not any(callback is _refresh_after_commit for _, callback, _ in pending):
+        transaction.on_commit(_refresh_after_commit)
@@ -0,0 +1,168 @@
+"""Full-text search over ``History`` content, backed by an SQLite FTS5 table.
+
+``mtb_v5_app_history_fts`` (created by migration 0006) holds one row per
+``History`` row with ``rowid = History.id``: the CKEditor HTML reduced to
+plain text (``body``) and the phase as an unindexed filter column. The model
+signals keep it in sync, bulk imports index their batches directly and
+``manage.py rebuild_history_search`` rebuilds it from the ``History`` table.
+
+``search()`` MATCHes the index, ranks by bm25 and returns highlighted
+snippets. On other databases, or an SQLite build without FTS5, it falls back
+to an unranked ``icontains`` scan.
+"""
+
+import re
+from html import escape
+from html.parser import HTMLParser
+
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, router
+
+from .history_compiler import DROP_CONTENT_TAGS
+from .models import History
+
+TABLE = 'mtb_v5_app_history_fts'
+CREATE_SQL = (
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} '
+    "USING fts5(body, phase UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')"
+)
+DROP_SQL = f'DROP TABLE IF EXISTS {TABLE}'
+
+SNIPPET_TOKENS = 16
+# Private-use markers around matches: the snippet text is escaped first, then they become <mark>.
+_OPEN, _CLOSE = '\ue000', '\ue001'
+_WORD_RE = re.compile(r'\w+')
+_SPACE_RE = re.compile(r'\s+')
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            self._skip += 1
+        self.parts.append(' ')
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS and self._skip:
+            self._skip -= 1
+        self.parts.append(' ')
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+
+def html_to_text(html):
+    """Visible text of CKEditor HTML, whitespace collapsed."""
+    parser = _TextExtractor()
+    parser.feed(html or '')
+    parser.close()
+    return _SPACE_RE.sub(' ', ''.join(parser.parts)).strip()
+
+
+def fts_query(text):
+    """Turn user input into a safe FTS5 query: every word must match, the last one as a prefix."""
+    words = _WORD_RE.findall(text or '')
+    if not words:
+        return ''
+    return ' '.join(f'"{word}"' for word in words) + '*'
+
+
+def is_available(using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [TABLE])
+        return cursor.fetchone() is not None
+
+
+def index_rows(rows, using=DEFAULT_DB_ALIAS):
+    """(Re)index ``(id, phase, content)`` tuples."""
+    with connections[using].cursor() as cursor:
+        cursor.executemany(
+            f'INSERT OR REPLACE INTO {TABLE} (rowid, body, phase) VALUES (%s, %s, %s)',
+            [(pk, html_to_text(content), phase) for pk, phase, content in rows],
+        )
+
+
+def remove_rows(ids, using=DEFAULT_DB_ALIAS):
+    with connections[using].cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {TABLE} WHERE rowid = %s', [(pk,) for pk in ids])
+
+
+def rebuild(using=DEFAULT_DB_ALIAS, batch_size=2000):
+    """Recreate the index from ``mtb_v5_app_history``; returns the number of rows indexed."""
+    connection = connections[using]
+    count = 0
+    with connection.cursor() as cursor:
+        cursor.execute(DROP_SQL)
+        cursor.execute(CREATE_SQL)
+    with connection.cursor() as source:
+        source.execute('SELECT id, phase, content FROM mtb_v5_app_history ORDER BY id')
+        while True:
+            rows = source.fetchmany(batch_size)
+            if not rows:
+                break
+            index_rows(rows, using=using)
+            count += len(rows)
+    with connection.cursor() as cursor:
+        # Merge the b-tree segments written batch by batch.
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+    return count
+
+
+def matching_ids_sql(text):
+    """``(sql, params)`` selecting the ids of matching rows, for ``id__in=RawSQL(...)``."""
+    return f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s', [fts_query(text)]
+
+
+def _highlight(snippet):
+    return escape(snippet).replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+
+
+def search(text, phase=None, limit=20, using=None):
+    """Best matches for ``text`` as ``[{'id', 'phase', 'snippet', 'rank'}]`` (``snippet`` is HTML)."""
+    query = fts_query(text)
+    if not query:
+        return []
+    using = using or router.db_for_read(History)
+    if not is_available(using):
+        return _search_fallback(text, phase, limit, using)
+
+    sql = (
+        f"SELECT rowid, phase, snippet({TABLE}, 0, %s, %s, '…', {SNIPPET_TOKENS}), bm25({TABLE}) "
+        f'FROM {TABLE} WHERE {TABLE} MATCH %s'
+    )
+    params = [_OPEN, _CLOSE, query]
+    if phase:
+        sql += ' AND phase = %s'
+        params.append(phase)
+    sql += f' ORDER BY bm25({TABLE}) LIMIT %s'
+    params.append(limit)
+    try:
+        with connections[using].cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+    except OperationalError:
+        # A query FTS5 still rejects (e.g. only stop characters): no results.
+        return []
+    return [
+        {'id': pk, 'phase': row_phase, 'snippet': _highlight(snippet), 'rank': round(rank, 6)}
+        for pk, row_phase, snippet, rank in rows
+    ]
+
+
+def _search_fallback(text, phase, limit, using):
+    rows = History.objects.using(using).filter(content__icontains=text.strip())
+    if phase:
+        rows = rows.filter(phase=phase)
+    results = []
+    for pk, row_phase, content in rows.values_list('id', 'phase', 'content')[:limit]:
+        plain = html_to_text(content)
+        start = max(plain.lower().find(text.strip().lower()), 0)
+        results.append({'id': pk, 'phase': row_phase, 'snippet': escape(plain[max(start - 60, 0):start + 120]), 'rank': None})
+    return results
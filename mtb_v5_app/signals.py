@@ -0,0 +1,64 @@
+"""Model signal handlers that keep derived copies of the phase content fresh."""
+
+import os
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from . import caching, derivatives, readonly_db, search, snapshots
+from .models import History, Media, Page
+
+
+def notify_content_changed():
+    """Invalidate everything derived from ``Page``/``Media``/``History``.
+
+    Called from the model signals below and directly by management commands
+    that write with ``bulk_create``/``QuerySet.delete`` (which skip signals).
+    """
+    caching.invalidate_pages()
+    snapshots.invalidate_snapshots()
+    readonly_db.schedule_refresh()
+
+
+def _content_changed(sender, **kwargs):
+    notify_content_changed()
+
+
+for _model in (Page, Media, History):
+    post_save.connect(_content_changed, sender=_model, dispatch_uid=f'mtb_content_saved_{_model.__name__}')
+    post_delete.connect(_content_changed, sender=_model, dispatch_uid=f'mtb_content_deleted_{_model.__name__}')
+
+
+def _build_poster_derivatives(source):
+    derivatives.build(sources=[source], workers=1)
+    # Pages rendered before the derivatives existed point at the original poster.
+    caching.invalidate_pages()
+
+
+def _media_saved(sender, instance, **kwargs):
+    """Build the poster derivatives of a saved ``Media`` row once it is committed."""
+    if not settings.DERIVATIVES_ON_SAVE:
+        return
+    source = derivatives.poster_source(instance.phase, instance.path)
+    if os.path.isfile(os.path.join(settings.MEDIA_ROOT, source)):
+        # robust: a broken image must not turn the admin save into an error.
+        transaction.on_commit(lambda: _build_poster_derivatives(source), robust=True)
+
+
+post_save.connect(_media_saved, sender=Media, dispatch_uid='mtb_media_poster_derivatives')
+
+
+def _history_saved(sender, instance, using, **kwargs):
+    """Keep the FTS5 search index (``search.TABLE``) in step with ``History``, in the same transaction."""
+    if search.is_available(using):
+        search.index_rows([(instance.pk, instance.phase, instance.content)], using=using)
+
+
+def _history_deleted(sender, instance, using, **kwargs):
+    if search.is_available(using):
+        search.remove_rows([instance.pk], using=using)
+
+
+post_save.connect(_history_saved, sender=History, dispatch_uid='mtb_history_search_saved')
+post_delete.connect(_history_deleted, sender=History, dispatch_uid='mtb_history_search_deleted')
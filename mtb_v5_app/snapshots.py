@@ -0,0 +1,145 @@
+"""Precomputed per-phase snapshots of the home page content.
+
+``manage.py build_snapshots`` (run from ``deploy.sh``) writes one JSON file per
+phase into ``settings.SNAPSHOT_ROOT`` holding the serialized ``Media`` rows,
+``History`` HTML and the phase content version. ``views.home`` reads them
+through ``load_snapshot()``, which keeps the parsed file in process memory and
+only re-reads it when its mtime/size change, so the hot path needs no database
+round-trip at all. The model signals delete the files as soon as content
+changes (readers fall back to the ORM) and rebuild them once the transaction
+commits.
+"""
+
+import json
+import os
+import tempfile
+from datetime import datetime
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from .history_compiler import compile_history
+from .models import History, Media
+from .phases import PHASE_CODES
+
+# Bump when the snapshot layout changes; older files are then treated as stale.
+SNAPSHOT_FORMAT = 3
+
+_loaded = {}
+
+
+def snapshot_path(phase, root=None):
+    return os.path.join(root or settings.SNAPSHOT_ROOT, f'phase-{phase}.json')
+
+
+def _database_name(using=DEFAULT_DB_ALIAS):
+    return str(connections[using].settings_dict['NAME'])
+
+
+def serialize_media(media):
+    return {
+        'id': media.id,
+        'title': media.title,
+        'phase': media.phase,
+        'path': media.path,
+        'type': media.type,
+        'width': media.width,
+        'height': media.height,
+        'duration': media.duration,
+    }
+
+
+def serialize_history(history):
+    return {
+        'id': history.id,
+        'phase': history.phase,
+        # Rows written with bulk_create() may not have been compiled yet.
+        'compiled_content': history.compiled_content or compile_history(history.content),
+    }
+
+
+def build_snapshot(phase, using=DEFAULT_DB_ALIAS):
+    """Materialize ``phase`` from the database into a JSON-serializable dict."""
+    from .caching import compute_version
+
+    version = compute_version(phase, using=using)
+    return {
+        'format': SNAPSHOT_FORMAT,
+        'database': _database_name(using),
+        'phase': phase,
+        'built_at': datetime.now().astimezone().isoformat(),
+        'etag': version['etag'],
+        'last_modified': version['last_modified'].isoformat(),
+        'assets': version['assets'],
+        'media': [serialize_media(m) for m in Media.objects.using(using).filter(phase=phase)],
+        'history': [serialize_history(h) for h in History.objects.using(using).filter(phase=phase)],
+    }
+
+
+def write_snapshot(phase, root=None, using=DEFAULT_DB_ALIAS):
+    """Build and atomically (write + rename) store the snapshot for ``phase``."""
+    root = root or settings.SNAPSHOT_ROOT
+    os.makedirs(root, exist_ok=True)
+    data = build_snapshot(phase, using=using)
+    fd, tmp_path = tempfile.mkstemp(dir=root, prefix=f'.phase-{phase}-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp_path, snapshot_path(phase, root))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return data
+
+
+def load_snapshot(phase):
+    """Return the snapshot dict for ``phase`` or ``None`` if missing or stale."""
+    path = snapshot_path(phase)
+    try:
+        st = os.stat(path)
+    except OSError:
+        _loaded.pop(phase, None)
+        return None
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _loaded.get(phase)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (
+        data.get('format') != SNAPSHOT_FORMAT
+        or data.get('phase') != phase
+        or data.get('database') != _database_name()
+    ):
+        return None
+    data['last_modified'] = datetime.fromisoformat(data['last_modified'])
+    _loaded[phase] = (stamp, data)
+    return data
+
+
+def _rebuild():
+    for phase in PHASE_CODES:
+        write_snapshot(phase)
+
+
+def invalidate_snapshots():
+    """Remove the snapshot files now and rebuild them after the current commit.
+
+    Does nothing until ``build_snapshots`` has created ``SNAPSHOT_ROOT``.
+    """
+    if not settings.SNAPSHOT_ENABLED or not os.path.isdir(settings.SNAPSHOT_ROOT):
+        return
+    for phase in PHASE_CODES:
+        try:
+            os.unlink(snapshot_path(phase))
+        except FileNotFoundError:
+            pass
+        _loaded.pop(phase, None)
+    # Bulk admin actions fire one signal per row; rebuild once per transaction.
+    pending = connections[DEFAULT_DB_ALIAS].run_on_commit
+    if not any(callback is _rebuild for _, callback, _ in pending):
+        transaction.on_commit(_rebuild)
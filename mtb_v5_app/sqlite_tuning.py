@@ -0,0 +1,55 @@
+"""Per-connection SQLite pragmas (WAL, ``synchronous``, mmap, page cache, busy timeout).
+
+Applied to every new SQLite connection through ``connection_created`` and
+driven by ``settings.SQLITE_PRAGMAS``. In WAL mode readers of the home page
+keep reading the last committed state while the admin writes, instead of
+waiting for (or failing on) the writer's lock. ``journal_mode`` is stored in
+the database file; the other pragmas only last as long as the connection,
+which is why they are set on each one and why ``CONN_MAX_AGE`` matters.
+"""
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.signals import connection_created
+
+# Pragma values cannot be bound as query parameters, so strings are checked against these.
+CHOICES = {
+    'journal_mode': {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'},
+    'synchronous': {'OFF', 'NORMAL', 'FULL', 'EXTRA'},
+    'temp_store': {'DEFAULT', 'FILE', 'MEMORY'},
+}
+# The others write to the database file, which a mode=ro connection cannot do.
+READ_ONLY_PRAGMAS = ('busy_timeout', 'cache_size', 'mmap_size')
+
+
+def pragma_statements(pragmas):
+    """``PRAGMA`` statements for ``{name: value}``, in order; unknown or unsafe values raise."""
+    statements = []
+    for name, value in pragmas.items():
+        if name in CHOICES:
+            value = str(value).upper()
+            if value not in CHOICES[name]:
+                raise ImproperlyConfigured(f'SQLITE_PRAGMAS[{name!r}] must be one of {sorted(CHOICES[name])}')
+        elif not isinstance(value, int) or isinstance(value, bool):
+            raise ImproperlyConfigured(f'SQLITE_PRAGMAS[{name!r}] must be an integer')
+        statements.append(f'PRAGMA {name} = {value}')
+    return statements
+
+
+def apply_pragmas(connection):
+    """Run ``settings.SQLITE_PRAGMAS`` on a Django SQLite connection."""
+    if connection.vendor != 'sqlite' or not settings.SQLITE_TUNING:
+        return
+    pragmas = settings.SQLITE_PRAGMAS
+    if 'mode=ro' in str(connection.settings_dict['NAME']):
+        pragmas = {name: value for name, value in pragmas.items() if name in READ_ONLY_PRAGMAS}
+    with connection.cursor() as cursor:
+        for statement in pragma_statements(pragmas):
+            cursor.execute(statement)
+
+
+def _connection_created(sender, connection, **kwargs):
+    apply_pragmas(connection)
+
+
+connection_created.connect(_connection_created, dispatch_uid='mtb_sqlite_tuning')
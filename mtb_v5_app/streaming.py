@@ -0,0 +1,97 @@
+"""Helpers for serving large media files with HTTP Range support."""
+
+import asyncio
+import re
+
+# Read size used when streaming files through Python (the full-file path is
+# usually handed to the server's ``wsgi.file_wrapper``/sendfile instead).
+CHUNK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    """The requested byte range lies outside the file."""
+
+
+def file_etag(stat_result):
+    """Weak-enough validator built from mtime and size (same idea as nginx)."""
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def parse_range(header, size):
+    """Parse a ``Range`` header into an inclusive ``(start, end)`` pair.
+
+    Returns ``None`` when the header is absent, malformed or asks for several
+    ranges; the caller then serves the whole file with a 200 as RFC 9110
+    allows. Raises ``RangeNotSatisfiable`` for ranges beyond the end of file.
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = int(last) if last else size - 1
+        if start >= size:
+            raise RangeNotSatisfiable
+        if end < start:
+            return None
+        return start, min(end, size - 1)
+    if last:
+        # Suffix range: the final N bytes.
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable
+        return max(size - length, 0), size - 1
+    return None
+
+
+class RangeFile:
+    """File-like wrapper that yields only ``length`` bytes from ``start``.
+
+    It deliberately exposes no ``fileno()`` so servers fall back to reading
+    through it instead of sendfile()-ing the rest of the file.
+    """
+
+    def __init__(self, fileobj, start, length):
+        self._file = fileobj
+        self._file.seek(start)
+        self._remaining = length
+
+    def read(self, size=-1):
+        if self._remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+async def aiter_file(path, start=0, length=None, chunk_size=CHUNK_SIZE):
+    """Yield ``length`` bytes of ``path`` from ``start`` (all by default).
+
+    Every blocking call runs in the default executor, so slow disks and slow
+    clients never stall the event loop serving other requests.
+    """
+    f = await asyncio.to_thread(open, path, 'rb')
+    try:
+        if start:
+            await asyncio.to_thread(f.seek, start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            chunk = await asyncio.to_thread(f.read, size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+    finally:
+        await asyncio.to_thread(f.close)
@@ -0,0 +1,19 @@
+from django import template
+from django.templatetags.cache import CacheNode, do_cache
+
+register = template.Library()
+
+
+class FragmentCacheNode(CacheNode):
+    def render(self, context):
+        # Django's tag still reads and writes the entry for a timeout of 0; here 0 means no caching at all.
+        if self.expire_time_var.resolve(context) in (0, '0'):
+            return self.nodelist.render(context)
+        return super().render(context)
+
+
+@register.tag('cache')
+def do_fragment_cache(parser, token):
+    """``{% cache %}`` from ``django.templatetags.cache``, minus the cache round-trip when the timeout is 0."""
+    node = do_cache(parser, token)
+    return FragmentCacheNode(node.nodelist, node.expire_time_var, node.fragment_name, node.vary_on, node.cache_name)
@@ -0,0 +1,15 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from mtb_v5_app.history_compiler import compile_history
+
+register = template.Library()
+
+
+@register.filter
+def compiled_html(history):
+    """Sanitized HTML of a History row or snapshot dict; never the raw CKEditor content."""
+    if isinstance(history, dict):
+        return mark_safe(history['compiled_content'])
+    # Rows written with bulk_create() may not have been compiled yet.
+    return mark_safe(history.compiled_content or compile_history(history.content))
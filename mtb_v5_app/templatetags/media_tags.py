@@ -0,0 +1,75 @@
+from django import template
+from django.conf import settings
+from django.utils.html import format_html
+
+from mtb_v5_app import derivatives, media_manifest
+
+register = template.Library()
+
+
+def _field(media, name):
+    # Works for Media instances and the dicts stored in phase snapshots.
+    return media[name] if isinstance(media, dict) else getattr(media, name)
+
+
+def _poster(media):
+    return derivatives.poster_source(_field(media, 'phase'), _field(media, 'path'))
+
+
+@register.simple_tag
+def media_url(rel_path):
+    """Fingerprinted URL of a file in ``MEDIA_ROOT`` (see ``media_manifest``)."""
+    return media_manifest.url(rel_path)
+
+
+@register.simple_tag
+def video_url(media):
+    return media_manifest.url(f"{_field(media, 'phase')}/{_field(media, 'path')}.mp4")
+
+
+@register.simple_tag
+def poster_url(media, width=None):
+    """Poster derivative for ``media`` sized for a card (original .jpg as fallback)."""
+    poster = _poster(media)
+    if not derivatives.load_manifest().get(poster):
+        return media_manifest.url(poster)
+    return derivatives.url_for_width(poster, width or settings.POSTER_WIDTH)
+
+
+@register.simple_tag
+def poster_srcset(media, fmt='webp'):
+    return derivatives.srcset(_poster(media), fmt)
+
+
+@register.filter
+def first_video(media_list):
+    """The first video in ``media_list``: the card visible on load."""
+    return next((media for media in media_list if _field(media, 'type') == 'video'), None)
+
+
+@register.simple_tag
+def poster_preload(media_list):
+    """``<link rel=preload>`` for the poster of the first video card, if any."""
+    media = first_video(media_list)
+    if media is None:
+        return ''
+    srcset = poster_srcset(media)
+    if not srcset:
+        return format_html('<link rel="preload" as="image" href="{}">', poster_url(media))
+    return format_html(
+        '<link rel="preload" as="image" href="{}" imagesrcset="{}" imagesizes="{}">',
+        poster_url(media), srcset, settings.POSTER_SIZES,
+    )
+
+
+@register.simple_tag
+def background_image_set(rel_path):
+    """CSS ``image-set()`` (WebP with JPEG fallback) for a phase background."""
+    width = settings.BACKGROUND_WIDTH
+    if not derivatives.load_manifest().get(rel_path):
+        return format_html("url('{}')", media_manifest.url(rel_path))
+    return format_html(
+        'image-set(url("{}") type("image/webp"), url("{}") type("image/jpeg"))',
+        derivatives.url_for_width(rel_path, width, 'webp'),
+        derivatives.url_for_width(rel_path, width, 'jpeg'),
+    )
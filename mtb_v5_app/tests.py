@@ -1,5 +1,35 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import tempfile
+import threading
+from io import StringIO
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.db.transaction import TransactionManagementError
+from django.db.utils import ConnectionHandler
+from django.template import Context, Template
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from PIL import Image
+
+from . import (
+    benchmark, caching, derivatives, healthchecks, media_manifest, media_probe, metrics, mp4, readonly_db, search, snapshots,
+    views,
+)
+from .history_compiler import compile_history
+from .middleware import PublicReadMiddleware
+from .models import History, Media, Page
 
 
 class HealthTest(TestCase):
@@ -8,3 +38,1102 @@ class HealthTest(TestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json(), {'status': 'ok'})
+
+    def test_readiness_probes_are_cached(self):
+        healthchecks.clear_cache()
+        self.addCleanup(healthchecks.clear_cache)
+        url = reverse('health')
+        response = self.client.get(url, {'mode': 'ready'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()['checks']), {'database', 'migrations', 'media_root'})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, {'mode': 'ready'}).json(), response.json())
+        self.assertEqual(self.client.get(url, {'mode': 'deep'}).status_code, 400)
+
+    def test_readiness_fails_without_media_root(self):
+        healthchecks.clear_cache()
+        self.addCleanup(healthchecks.clear_cache)
+        with self.settings(MEDIA_ROOT=os.path.join(tempfile.gettempdir(), 'mtb-missing-media'), HEALTH_CACHE_SECONDS=0):
+            response = self.client.get(reverse('health'), {'mode': 'ready'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['status'], 'error')
+        self.assertFalse(response.json()['checks']['media_root']['ok'])
+        self.assertTrue(response.json()['checks']['database']['ok'])
+
+    def test_check_db_command(self):
+        out = StringIO()
+        call_command('check_db', '--phase', '2', stdout=out)
+        self.assertIn('migrations', out.getvalue())
+        self.assertIn('mtb_v5_app_media', out.getvalue())
+        self.assertIn('media_phase_position_idx', out.getvalue())
+
+
+@override_settings(HOME_CACHE_ENABLED=True)
+class HomePageCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.page = Page.objects.create(name='home', phase='00')
+        self.media = Media.objects.create(title='Clip One', phase='01', path='first_era-01', page=self.page, type='video')
+        History.objects.create(content='<p>Hamburg days</p>', phase='01', page=self.page)
+
+    def test_second_request_is_served_from_cache(self):
+        url = reverse('home')
+        first = self.client.get(url, {'phase': '1'})
+        with self.assertNumQueries(0):
+            second = self.client.get(url, {'phase': '01'})
+        self.assertEqual(first.content, second.content)
+        self.assertContains(second, 'Hamburg days')
+        stats = caching.get_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['cached_phases']), (1, 1, 1))
+
+    def test_cached_responses_keep_their_headers(self):
+        url = reverse('home')
+        first = self.client.get(url, {'phase': '01'})
+        second = self.client.get(url, {'phase': '01'})
+        self.assertEqual(caching.get_stats()['hits'], 1)
+        self.assertEqual(dict(second.items()), dict(first.items()))
+
+        response = HttpResponse('<p>Hallo</p>', content_type='text/html; charset=utf-8')
+        response.headers['Vary'] = 'Accept-Language'
+        response.headers['Content-Language'] = 'de'
+        caching.set_page('02', response)
+        replayed = caching.get_page('02')
+        self.assertEqual(replayed.content, b'<p>Hallo</p>')
+        self.assertEqual(
+            (replayed['Content-Type'], replayed['Vary'], replayed['Content-Language']),
+            ('text/html; charset=utf-8', 'Accept-Language', 'de'),
+        )
+
+    def test_model_changes_invalidate_cached_pages(self):
+        url = reverse('home')
+        self.client.get(url, {'phase': '01'})
+        self.media.title = 'Renamed Clip'
+        self.media.save()
+        self.assertContains(self.client.get(url, {'phase': '01'}), 'Renamed Clip')
+        self.media.delete()
+        self.assertContains(self.client.get(url, {'phase': '01'}), 'No media available')
+
+    def test_file_cache_counts_per_process_and_flushes_periodically(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        files = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}
+        url = reverse('home')
+        with self.settings(
+            CACHES={**settings.CACHES, 'files': files}, HOME_CACHE_ALIAS='files', HOME_CACHE_STATS_FLUSH_SECONDS=3600,
+        ):
+            shared = caching.get_cache()
+            self.client.get(url, {'phase': '01'})
+            self.client.get(url, {'phase': '01'})
+            self.assertIsNone(shared.get(caching.HITS_KEY))
+            self.assertEqual((caching.get_stats()['hits'], caching.get_stats()['misses']), (1, 1))
+            caching.flush_stats()
+            self.assertEqual((shared.get(caching.HITS_KEY), shared.get(caching.MISSES_KEY)), (1, 1))
+            self.assertEqual((caching.get_stats()['hits'], caching.get_stats()['misses']), (1, 1))
+
+    def test_unknown_phase_is_not_cached(self):
+        self.client.get(reverse('home'), {'phase': '42'})
+        self.assertEqual(caching.get_stats()['misses'], 0)
+
+    def test_warmcache_prerenders_pages_and_api_payloads(self):
+        call_command('warmcache', stdout=StringIO())
+        self.assertEqual(caching.get_stats()['cached_phases'], 5)
+        with self.assertNumQueries(0):
+            page = self.client.get(reverse('home'), {'phase': '01'})
+            payload = self.client.get(reverse('phase_api', args=['01']))
+        self.assertContains(page, 'Hamburg days')
+        self.assertEqual(payload.json()['media'][0]['title'], 'Clip One')
+        self.assertEqual(caching.get_stats()['hits'], 2)
+
+
+@override_settings(TEMPLATE_FRAGMENT_TIMEOUT=600)
+class TemplateFragmentTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_phase_fragments_are_cached_and_dropped_with_the_pages(self):
+        response = self.client.get(reverse('home'), {'phase': '02'})
+        self.assertContains(response, 'background-color: navy;')
+        self.assertContains(response, '02/second_era-background.jpg')
+        keys = caching.fragment_keys(['02'])
+        self.assertEqual(len(cache.get_many(keys)), 3)
+        self.assertContains(self.client.get(reverse('home'), {'phase': '05'}), 'background-color: white;')
+        caching.invalidate_pages(['02'])
+        self.assertEqual(cache.get_many(keys), {})
+
+    def test_unknown_phase_has_no_theme_and_no_fragments(self):
+        response = self.client.get(reverse('home'), {'phase': '42'})
+        self.assertNotContains(response, 'background-color:')
+        self.assertEqual(cache.get_many(caching.fragment_keys(['42'])[1:]), {})
+
+    def test_invalid_phases_leave_the_cache_empty(self):
+        for i in range(5):
+            self.assertContains(self.client.get(reverse('home'), {'phase': f'x{i}'}), 'Meet The Beatles!')
+        self.assertEqual(cache._cache, {})
+
+    @override_settings(TEMPLATE_FRAGMENT_TIMEOUT=0)
+    def test_zero_timeout_never_writes_fragments(self):
+        self.assertContains(self.client.get(reverse('home'), {'phase': '02'}), 'background-color: navy;')
+        # Not even expired entries: LocMemCache keeps those until they are read.
+        stored = [key for key in caching.fragment_keys(['02']) if cache.make_key(key) in cache._cache]
+        self.assertEqual(stored, [])
+
+
+class HomeConditionalGetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.page = Page.objects.create(name='home', phase='00')
+        self.history = History.objects.create(content='<p>Cavern Club</p>', phase='02', page=self.page)
+
+    def test_matching_etag_returns_304_without_queries(self):
+        url = reverse('home')
+        response = self.client.get(url, {'phase': '02'})
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(url, {'phase': '02'}, headers={'if-none-match': response['ETag']})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+
+    def test_if_modified_since_returns_304(self):
+        url = reverse('home')
+        response = self.client.get(url, {'phase': '02'})
+        not_modified = self.client.get(url, {'phase': '02'}, headers={'if-modified-since': response['Last-Modified']})
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_content_change_produces_new_etag(self):
+        url = reverse('home')
+        etag = self.client.get(url, {'phase': '02'})['ETag']
+        self.history.delete()
+        response = self.client.get(url, {'phase': '02'}, headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @override_settings(SNAPSHOT_ENABLED=True)
+    def test_rebuilt_manifest_produces_new_etag(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        snapshot_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, snapshot_root)
+        url = reverse('home')
+        with self.settings(MEDIA_ROOT=media_root, SNAPSHOT_ROOT=snapshot_root):
+            snapshots.write_snapshot('02')
+            etag = self.client.get(url, {'phase': '02'})['ETag']
+            self.assertEqual(etag, snapshots.load_snapshot('02')['etag'])
+            derivatives.write_json_atomic(media_manifest.manifest_path(), {'format': 1, 'files': {}})
+            caching.invalidate_pages()
+            response = self.client.get(url, {'phase': '02'}, headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@override_settings(HOME_CACHE_ENABLED=True, SNAPSHOT_ENABLED=False, DERIVATIVES_ON_SAVE=False)
+class PhaseApiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.page = Page.objects.create(name='home', phase='00')
+        Media.objects.create(title='Love Me Do', phase='02', path='love-me-do', type='video', page=self.page)
+        History.objects.create(content='<p>In 1962 Ringo joined.</p>', phase='02', page=self.page)
+
+    def test_payload(self):
+        response = self.client.get(reverse('phase_api', args=['02']))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['phase'], '02')
+        self.assertEqual(data['label'], '1962 - 1966')
+        self.assertEqual(data['theme']['card_color'], 'navy')
+        self.assertEqual(response['ETag'], f'"{data["version"]}"')
+        [media] = data['media']
+        self.assertEqual(media['title'], 'Love Me Do')
+        self.assertEqual(media['src'], '/media/02/love-me-do.mp4')
+        self.assertEqual(media['poster'], '/media/02/love-me-do.jpg')
+        self.assertIn('<span class="beatle-name">Ringo</span>', data['history'][0]['compiled_content'])
+
+    def test_cached_and_revalidated(self):
+        url = reverse('phase_api', args=['02'])
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 200)
+            self.assertEqual(self.client.get(url, headers={'if-none-match': etag}).status_code, 304)
+
+    def test_content_change_invalidates_payload(self):
+        url = reverse('phase_api', args=['02'])
+        self.client.get(url)
+        Media.objects.create(title='Help!', phase='02', path='help', type='video', page=self.page)
+        self.assertEqual(len(self.client.get(url).json()['media']), 2)
+
+    def test_unknown_phase_is_404(self):
+        self.assertEqual(self.client.get(reverse('phase_api', args=['9'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('phase_api', args=['06'])).status_code, 404)
+
+    def test_home_page_enables_switcher(self):
+        response = self.client.get(reverse('home'), {'phase': '02'})
+        self.assertContains(response, 'data-phase-api="/api/phase/__phase__/"')
+        self.assertContains(response, 'js/phase-switcher.js')
+        with override_settings(PHASE_CLIENT_SWITCHING=False, HOME_CACHE_ENABLED=False):
+            self.assertNotContains(self.client.get(reverse('home')), 'phase-switcher.js')
+
+
+class MediaServingTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        os.makedirs(os.path.join(self.media_root, '01'))
+        with open(os.path.join(self.media_root, '01', 'clip.mp4'), 'wb') as f:
+            f.write(bytes(range(256)) * 4)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_SENDFILE_HEADER='')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_full_file(self):
+        response = self.client.get('/media/01/clip.mp4')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'video/mp4')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('max-age=', response['Cache-Control'])
+        self.assertEqual(len(b''.join(response.streaming_content)), 1024)
+
+    def test_byte_range(self):
+        response = self.client.get('/media/01/clip.mp4', headers={'range': 'bytes=10-19'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(10, 20)))
+
+    def test_suffix_and_unsatisfiable_ranges(self):
+        response = self.client.get('/media/01/clip.mp4', headers={'range': 'bytes=-4'})
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(252, 256)))
+        response = self.client.get('/media/01/clip.mp4', headers={'range': 'bytes=5000-'})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+    def test_etag_revalidation(self):
+        etag = self.client.get('/media/01/clip.mp4')['ETag']
+        response = self.client.get('/media/01/clip.mp4', headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_x_accel_redirect(self):
+        with override_settings(MEDIA_SENDFILE_HEADER='X-Accel-Redirect'):
+            response = self.client.get('/media/01/clip.mp4')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/01/clip.mp4')
+        self.assertEqual(response.content, b'')
+
+    def test_path_traversal_and_missing_files(self):
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/01/missing.mp4').status_code, 404)
+        self.assertEqual(self.client.get('/media/01/').status_code, 404)
+
+
+@override_settings(HOME_CACHE_ENABLED=True, SNAPSHOT_ENABLED=False, DERIVATIVES_ON_SAVE=False, MEDIA_SENDFILE_HEADER='')
+class AsyncViewsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        page = Page.objects.create(name='home', phase='00')
+        History.objects.create(content='<p>Abbey Road</p>', phase='03', page=page)
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        os.makedirs(os.path.join(self.media_root, '03'))
+        with open(os.path.join(self.media_root, '03', 'clip.mp4'), 'wb') as f:
+            f.write(bytes(range(256)) * 1024)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    async def test_asgi_requests_use_async_views(self):
+        response = await self.async_client.get('/', {'phase': '03'})
+        self.assertIs(response.resolver_match.func, views.ahome)
+        self.assertContains(response, 'Abbey Road')
+        health = await self.async_client.get('/health/')
+        self.assertIs(health.resolver_match.func, views.ahealth)
+        self.assertEqual(health.json(), {'status': 'ok'})
+        healthchecks.clear_cache()
+        ready = await self.async_client.get('/health/', {'mode': 'ready'})
+        self.assertEqual((ready.status_code, ready.json()['status']), (200, 'ok'))
+        healthchecks.clear_cache()
+        # WSGI requests are untouched.
+        self.assertIs((await sync_to_async(self.client.get)('/health/')).resolver_match.func, views.health)
+
+    async def test_home_conditional_get_and_cache(self):
+        response = await self.async_client.get('/', {'phase': '03'})
+        sync_response = await sync_to_async(self.client.get)('/', {'phase': '03'})
+        self.assertEqual(response['ETag'], sync_response['ETag'])
+        self.assertEqual(response.content, sync_response.content)
+        not_modified = await self.async_client.get('/', {'phase': '03'}, headers={'if-none-match': response['ETag']})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(caching.get_stats()['hits'], 1)
+        [record] = [r for r in metrics.records() if r['view'] == 'home' and r['status'] == 200][:1]
+        self.assertGreater(record['queries'], 0)
+
+    async def test_media_streaming_and_ranges(self):
+        response = await self.async_client.get('/media/03/clip.mp4')
+        self.assertIs(response.resolver_match.func, views.aserve_media)
+        self.assertEqual(response['Content-Length'], str(256 * 1024))
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(body, bytes(range(256)) * 1024)
+        response = await self.async_client.get('/media/03/clip.mp4', headers={'range': 'bytes=70000-70009'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 70000-70009/{256 * 1024}')
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(body, bytes(range(256))[70000 % 256:70000 % 256 + 10])
+        missing = await self.async_client.get('/media/03/missing.mp4')
+        self.assertEqual(missing.status_code, 404)
+
+
+@override_settings(MEDIA_SENDFILE_HEADER='', DERIVATIVES_ON_SAVE=False)
+class MediaManifestTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        os.makedirs(os.path.join(self.media_root, '01'))
+        with open(os.path.join(self.media_root, '01', 'clip.mp4'), 'wb') as f:
+            f.write(os.urandom(4096))
+        with open(os.path.join(self.media_root, '01', 'clip.vtt'), 'w') as f:
+            f.write('WEBVTT\n\n' + '00:00.000 --> 00:01.000\nShe loves you, yeah, yeah, yeah\n\n' * 50)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        call_command('build_media_manifest', '--workers', '2', stdout=StringIO())
+
+    def test_manifest_and_variants(self):
+        files = media_manifest.load_manifest()
+        self.assertEqual(sorted(files), ['01/clip.mp4', '01/clip.vtt'])
+        self.assertEqual(files['01/clip.mp4']['encodings'], [])
+        self.assertIn('gzip', files['01/clip.vtt']['encodings'])
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, '01', 'clip.vtt.gz')))
+        digest = files['01/clip.mp4']['hash']
+        self.assertEqual(media_manifest.url('01/clip.mp4'), f'/media/01/clip.{digest}.mp4')
+        self.assertEqual(media_manifest.url('01/unknown.jpg'), '/media/01/unknown.jpg')
+
+    def test_incremental_rebuild_and_removal(self):
+        self.assertEqual(media_manifest.build()['unchanged'], 2)
+        os.unlink(os.path.join(self.media_root, '01', 'clip.vtt'))
+        counts = media_manifest.build()
+        self.assertEqual(counts['removed'], 1)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, '01', 'clip.vtt.gz')))
+
+    def test_fingerprinted_urls_are_immutable(self):
+        url = media_manifest.url('01/clip.mp4')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        self.assertNotIn('immutable', self.client.get('/media/01/clip.mp4')['Cache-Control'])
+        self.assertEqual(self.client.get('/media/01/clip.000000000000.mp4').status_code, 404)
+
+    def test_manifests_are_not_served(self):
+        derivatives.write_manifest({})
+        self.assertTrue(os.path.exists(media_manifest.manifest_path()))
+        for url in ('/media/media-manifest.json', '/media/01/../media-manifest.json', '/media/derivatives/manifest.json'):
+            self.assertEqual(self.client.get(url).status_code, 404, url)
+
+    def test_precompressed_variant_negotiation(self):
+        url = media_manifest.url('01/clip.vtt')
+        response = self.client.get(url, headers={'accept-encoding': 'gzip, deflate'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/vtt')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'\x1f\x8b'))
+        plain = self.client.get(url)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+    def test_templates_use_fingerprinted_urls(self):
+        page = Page.objects.create(name='home', phase='00')
+        media = Media.objects.create(title='Clip', phase='01', path='clip', type='video', page=page)
+        rendered = Template('{% load media_tags %}{% video_url media %}').render(Context({'media': media}))
+        self.assertEqual(rendered, media_manifest.url('01/clip.mp4'))
+
+
+@override_settings(HOME_CACHE_ENABLED=False, DERIVATIVES_ON_SAVE=False)
+class PhaseSnapshotTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        # Created by build_snapshots; until then signals leave snapshots alone.
+        settings_override = override_settings(SNAPSHOT_ENABLED=True, SNAPSHOT_ROOT=os.path.join(tmp, 'snapshots'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        page = Page.objects.create(name='home', phase='00')
+        self.media = Media.objects.create(title='Shea Stadium', phase='03', path='third_era-01', page=page, type='video')
+
+    def test_home_is_served_from_snapshot_without_queries(self):
+        call_command('build_snapshots', stdout=StringIO())
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('home'), {'phase': '03'})
+        self.assertContains(response, 'Shea Stadium')
+
+    def test_content_change_removes_and_rebuilds_snapshot(self):
+        call_command('build_snapshots', stdout=StringIO())
+        self.media.title = 'Candlestick Park'
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.media.save()
+        self.assertIsNone(snapshots.load_snapshot('03'))
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertEqual(snapshots.load_snapshot('03')['media'][0]['title'], 'Candlestick Park')
+
+    def test_missing_snapshot_falls_back_to_orm(self):
+        self.assertContains(self.client.get(reverse('home'), {'phase': '03'}), 'Shea Stadium')
+
+
+class PopulateMediaTableTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        for name in ('clip.mp4', 'clip.jpg', 'notes.txt'):
+            os.makedirs(os.path.join(self.media_root, '01'), exist_ok=True)
+            open(os.path.join(self.media_root, '01', name), 'w').close()
+
+    def sync(self, *args):
+        call_command('populate_media_table', '--media-root', self.media_root, *args, stdout=StringIO())
+
+    def test_sync_is_idempotent_and_removes_missing_files(self):
+        self.sync()
+        self.sync()
+        self.assertEqual(
+            sorted(Media.objects.values_list('phase', 'path', 'type')),
+            [('01', 'clip', 'image'), ('01', 'clip', 'video')],
+        )
+        os.remove(os.path.join(self.media_root, '01', 'clip.jpg'))
+        self.sync()
+        self.assertEqual(list(Media.objects.values_list('type', flat=True)), ['video'])
+
+    def test_duplicates_are_collapsed_and_dry_run_writes_nothing(self):
+        self.sync()
+        clip = Media.objects.get(type='video')
+        Media.objects.create(title='clip', phase='01', path='clip', page=clip.page, type='video')
+        self.sync('--dry-run')
+        self.assertEqual(Media.objects.count(), 3)
+        self.sync()
+        self.assertEqual(Media.objects.filter(type='video').get().pk, clip.pk)
+
+
+def _box(box_type, payload):
+    return struct.pack('>I4s', len(payload) + 8, box_type) + payload
+
+
+class Mp4FaststartTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        os.makedirs(os.path.join(self.media_root, '01'))
+        self.path = os.path.join(self.media_root, '01', 'clip.mp4')
+        # ftyp, mdat (two chunks), then moov whose stco points at both chunks.
+        ftyp = _box(b'ftyp', b'isom\x00\x00\x02\x00isomiso2mp41')
+        mdat = _box(b'mdat', b'A' * 100 + b'B' * 50)
+        first_chunk = len(ftyp) + 8
+        stco = _box(b'stco', struct.pack('>III', 0, 2, first_chunk) + struct.pack('>I', first_chunk + 100))
+        stbl = _box(b'stbl', _box(b'stsd', b'\x00' * 8) + stco)
+        moov = _box(b'moov', _box(b'mvhd', b'\x00' * 100) + _box(b'trak', _box(b'mdia', _box(b'minf', stbl))))
+        with open(self.path, 'wb') as f:
+            f.write(ftyp + mdat + moov)
+        with open(os.path.join(self.media_root, '01', 'pointer.mp4'), 'w') as f:
+            f.write('version https://git-lfs.github.com/spec/v1\noid sha256:0\nsize 1\n')
+
+    def chunks(self):
+        with open(self.path, 'rb') as f:
+            boxes = mp4.top_level_boxes(f)
+            moov_offset, moov_size = [(offset, size) for box_type, offset, size in boxes if box_type == b'moov'][0]
+            f.seek(moov_offset + 8)
+            [(tables, index)] = list(mp4._offset_tables(mp4._parse(f.read(moov_size - 8))))
+            offsets = mp4._read_offsets(tables[index][0], tables[index][2])[1]
+            data = []
+            for offset in offsets:
+                f.seek(offset)
+                data.append(f.read(1))
+        return [box_type for box_type, _, _ in boxes], data
+
+    def test_moov_moves_in_front_with_corrected_offsets(self):
+        self.assertEqual(self.chunks(), ([b'ftyp', b'mdat', b'moov'], [b'A', b'B']))
+        self.assertTrue(mp4.faststart(self.path))
+        self.assertEqual(self.chunks(), ([b'ftyp', b'moov', b'mdat'], [b'A', b'B']))
+        self.assertFalse(mp4.faststart(self.path))
+
+    def test_offsets_past_4gib_widen_stco_to_co64(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        # moov is the last box: its payload runs to the end of the file.
+        moov_payload = data[data.index(b'moov') + 4:]
+        moov = mp4._shifted_moov(moov_payload, lambda offset, size: offset + size + 2 ** 32)
+        self.assertIn(b'co64', moov)
+        self.assertNotIn(b'stco', moov)
+        [(boxes, index)] = list(mp4._offset_tables(mp4._parse(moov[8:])))
+        offsets = mp4._read_offsets(b'co64', boxes[index][2])[1]
+        self.assertEqual(offsets[1] - offsets[0], 100)
+        self.assertEqual(offsets[0], 36 + len(moov) + 2 ** 32)
+
+    def test_state_file_skips_processed_files_and_populate_hook(self):
+        self.assertEqual(
+            mp4.build(self.media_root, workers=1),
+            {'optimized': 1, 'already': 0, 'unchanged': 0, 'skipped': 1},
+        )
+        self.assertEqual(mp4.load_state(self.media_root)['01/pointer.mp4']['status'], 'skipped')
+        out = StringIO()
+        call_command('populate_media_table', '--media-root', self.media_root, stdout=out)
+        self.assertIn('Faststart: 0 optimized, 0 already faststart, 2 unchanged', out.getvalue())
+        self.assertEqual(Media.objects.filter(type='video').count(), 2)
+
+
+class MediaProbeTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        phase_dir = os.path.join(self.media_root, '01')
+        os.makedirs(phase_dir)
+        # 12.5 s at timescale 1000, one 1280x720 video track.
+        mvhd = _box(b'mvhd', struct.pack('>5I', 0, 0, 0, 1000, 12500) + b'\x00' * 80)
+        matrix = struct.pack('>9i', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+        tkhd = _box(b'tkhd', struct.pack('>6I', 0, 0, 0, 1, 0, 12500) + b'\x00' * 16 + matrix + struct.pack('>II', 1280 << 16, 720 << 16))
+        with open(os.path.join(phase_dir, 'clip.mp4'), 'wb') as f:
+            f.write(_box(b'ftyp', b'isom\x00\x00\x02\x00') + _box(b'moov', mvhd + _box(b'trak', tkhd)) + _box(b'mdat', b'\x00' * 64))
+        Image.new('RGB', (64, 36)).save(os.path.join(phase_dir, 'clip.jpg'), 'JPEG', progressive=True)
+        Image.new('RGB', (48, 64)).save(os.path.join(phase_dir, 'pointer.jpg'), 'JPEG')
+        with open(os.path.join(phase_dir, 'pointer.mp4'), 'w') as f:
+            f.write('version https://git-lfs.github.com/spec/v1\n')
+        page = Page.objects.create(name='home', phase='00')
+        self.video = Media.objects.create(title='clip', phase='01', path='clip', type='video', page=page)
+        self.poster = Media.objects.create(title='clip', phase='01', path='clip', type='image', page=page)
+        self.pointer = Media.objects.create(title='pointer', phase='01', path='pointer', type='video', page=page, position=1)
+
+    def test_headers_fill_the_fields_and_unchanged_files_are_skipped(self):
+        self.assertEqual(media_probe.build(self.media_root, workers=1), {'probed': 3, 'unchanged': 0, 'missing': 0})
+        video, poster, pointer = (Media.objects.get(pk=m.pk) for m in (self.video, self.poster, self.pointer))
+        self.assertEqual((video.width, video.height, video.duration), (1280, 720, 12.5))
+        self.assertEqual((poster.width, poster.height, poster.duration), (64, 36, None))
+        # No moov box: the poster's size, still the file's own size and hash.
+        self.assertEqual((pointer.width, pointer.height, pointer.size), (48, 64, 43))
+        self.assertEqual(len(pointer.content_hash), 64)
+        with self.assertNumQueries(1):
+            self.assertEqual(media_probe.build(self.media_root, workers=1)['unchanged'], 3)
+        os.remove(os.path.join(self.media_root, '01', 'clip.jpg'))
+        self.assertEqual(media_probe.build(self.media_root, workers=1)['missing'], 1)
+        self.assertIsNone(Media.objects.get(pk=self.poster.pk).width)
+
+    def test_home_reserves_card_space_and_preloads_only_the_first_card(self):
+        with self.settings(MEDIA_ROOT=self.media_root, SNAPSHOT_ENABLED=False, HOME_CACHE_ENABLED=False):
+            call_command('probe_media', '--workers', '1', stdout=StringIO())
+            response = self.client.get(reverse('home'), {'phase': '01'})
+        self.assertContains(response, 'style="aspect-ratio: 1280 / 720;"')
+        self.assertContains(response, 'width="48" height="64"')
+        self.assertContains(response, 'preload="metadata"', count=1)
+        self.assertContains(response, 'preload="none"', count=1)
+        self.assertContains(response, 'rel="preload"', count=1)
+
+
+class PosterDerivativeTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        os.makedirs(os.path.join(self.media_root, '01'))
+        Image.new('RGB', (800, 450), 'navy').save(os.path.join(self.media_root, '01', 'clip.jpg'))
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media_root, DERIVATIVE_WIDTHS=[320, 640, 1280], DERIVATIVES_ON_SAVE=False,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_build_creates_hashed_variants_and_skips_unchanged_sources(self):
+        counts = derivatives.build(workers=1)
+        self.assertEqual(counts['generated'], 1)
+        entry = derivatives.load_manifest()['01/clip.jpg']
+        self.assertEqual(sorted(entry['variants']['webp'], key=int), ['320', '640', '800'])
+        self.assertIn(entry['hash'], entry['variants']['jpeg']['320'])
+        with Image.open(os.path.join(self.media_root, entry['variants']['webp']['320'])) as image:
+            self.assertEqual(image.size, (320, 180))
+        self.assertEqual(derivatives.build(workers=1)['unchanged'], 1)
+
+    def test_template_tags_emit_srcset(self):
+        derivatives.build(workers=1)
+        media = {'phase': '01', 'path': 'clip', 'type': 'video'}
+        html = Template('{% load media_tags %}{% poster_url media %}|{% poster_preload media_list %}').render(
+            Context({'media': media, 'media_list': [media]})
+        )
+        self.assertIn('/media/derivatives/01/clip-', html)
+        self.assertIn('-640.webp', html)
+        self.assertIn('imagesrcset="/media/derivatives/01/clip-', html)
+        self.assertIn(' 320w, ', html)
+
+    def test_missing_derivatives_fall_back_to_original(self):
+        media = {'phase': '02', 'path': 'other', 'type': 'video'}
+        html = Template('{% load media_tags %}{% poster_url media %}').render(Context({'media': media}))
+        self.assertEqual(html, '/media/02/other.jpg')
+
+
+class RequestMetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        page = Page.objects.create(name='home', phase='00')
+        History.objects.create(content='<p>Abbey Road</p>', phase='04', page=page)
+
+    def test_requests_are_recorded_with_query_counts(self):
+        self.client.get(reverse('home'), {'phase': '04'})
+        record = metrics.records()[-1]
+        self.assertEqual(record['view'], 'home')
+        self.assertEqual(record['status'], 200)
+        self.assertGreaterEqual(record['queries'], 2)
+        self.assertGreater(record['render_ms'], 0)
+        self.assertGreaterEqual(record['total_ms'], record['render_ms'])
+
+    @override_settings(DEBUG=True)
+    def test_metrics_endpoint_reports_percentiles(self):
+        self.client.get(reverse('health'))
+        data = self.client.get(reverse('metrics')).json()
+        self.assertEqual(data['views']['health']['requests'], 1)
+        self.assertEqual(data['views']['health']['queries']['p95'], 0)
+
+    @override_settings(DEBUG=False)
+    def test_metrics_endpoint_is_hidden_from_anonymous_users(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_home_stays_within_query_budget(self):
+        self.client.get(reverse('home'), {'phase': '04'})
+
+    @override_settings(QUERY_BUDGET_STRICT=True, QUERY_BUDGETS={'home': 1})
+    def test_budget_overrun_fails_in_strict_mode(self):
+        with self.assertRaises(metrics.QueryBudgetExceeded):
+            self.client.get(reverse('home'), {'phase': '04'})
+
+    def test_percentile(self):
+        self.assertEqual(metrics.percentile(list(range(1, 101)), 95), 95)
+        self.assertIsNone(metrics.percentile([], 50))
+
+
+class SQLiteTuningTest(TestCase):
+    """Readers keep working while a writer holds the database (file-backed, not the in-memory test DB)."""
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.handler = ConnectionHandler({'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(tmp, 'tuned.sqlite3'),
+        }})
+        self.addCleanup(self.handler.close_all)
+        with self.handler['default'].cursor() as cursor:
+            cursor.execute('CREATE TABLE history (content TEXT)')
+            cursor.execute("INSERT INTO history VALUES ('committed')")
+
+    def _read_during_write(self):
+        """Count rows from another thread while this one holds an exclusive write transaction."""
+        result = {}
+
+        def reader():
+            conn = self.handler['default']
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute('SELECT COUNT(*) FROM history')
+                    result['rows'] = cursor.fetchone()[0]
+            except OperationalError as exc:
+                result['error'] = str(exc)
+            finally:
+                conn.close()
+
+        with self.handler['default'].cursor() as cursor:
+            cursor.execute('BEGIN EXCLUSIVE')
+            cursor.execute("INSERT INTO history VALUES ('admin save in progress')")
+            thread = threading.Thread(target=reader)
+            thread.start()
+            thread.join()
+            cursor.execute('COMMIT')
+        return result
+
+    def test_pragmas_are_applied_to_new_connections(self):
+        with self.handler['default'].cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+    def test_reads_continue_while_admin_writes(self):
+        self.assertEqual(self._read_during_write(), {'rows': 1})
+        with self.handler['default'].cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM history')
+            self.assertEqual(cursor.fetchone()[0], 2)
+
+    def test_rollback_journal_blocks_readers(self):
+        pragmas = {'busy_timeout': 100, 'journal_mode': 'DELETE'}
+        with override_settings(SQLITE_PRAGMAS=pragmas):
+            self.handler.close_all()
+            self.assertIn('locked', self._read_during_write()['error'])
+
+
+@override_settings(READ_ONLY_DATABASE='readonly')
+class ReadOnlyDatabaseTest(TestCase):
+    def test_router_sends_only_public_reads_of_app_models(self):
+        router = readonly_db.ReadOnlyRouter()
+        self.assertIsNone(router.db_for_read(Page))
+        with readonly_db.public_reads():
+            self.assertEqual(router.db_for_read(Page), 'readonly')
+            self.assertEqual(router.db_for_read(History), 'readonly')
+            self.assertIsNone(router.db_for_read(User))
+            self.assertIsNone(router.db_for_write(Media))
+        self.assertFalse(router.allow_migrate('readonly', 'mtb_v5_app'))
+        self.assertIsNone(router.allow_migrate('default', 'mtb_v5_app'))
+
+    def test_middleware_keeps_admin_and_unsafe_methods_on_default(self):
+        seen = []
+        middleware = PublicReadMiddleware(lambda request: seen.append(readonly_db.is_public()) or HttpResponse())
+        factory = RequestFactory()
+        for request in (factory.get('/'), factory.head('/api/phase/02/'), factory.post('/'), factory.get('/admin/')):
+            middleware(request)
+        self.assertEqual(seen, [True, True, False, False])
+        self.assertFalse(readonly_db.is_public())
+
+
+class ReadOnlyCopyRefreshTest(TransactionTestCase):
+    # The SQLite backup API needs a source without an open transaction.
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.path = os.path.join(tmp, 'readonly.sqlite3')
+
+    def test_refresh_command_swaps_in_a_readonly_copy(self):
+        Page.objects.create(name='Copied', phase='01')
+        out = StringIO()
+        call_command('refresh_readonly_db', '--path', self.path, stdout=out)
+        self.assertIn('Refreshed', out.getvalue())
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['readonly.sqlite3'])
+        conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+        self.addCleanup(conn.close)
+        self.assertEqual(conn.execute('SELECT name FROM mtb_v5_app_page').fetchall(), [('Copied',)])
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'delete')
+
+    def test_refresh_inside_a_transaction_is_refused(self):
+        with transaction.atomic():
+            Page.objects.create(name='Pending', phase='01')
+            with self.assertRaises(TransactionManagementError):
+                readonly_db.refresh_copy(self.path)
+        self.assertFalse(os.path.exists(self.path))
+
+
+class BenchmarkDriverTest(TestCase):
+    def test_run_scenario_reports_throughput_and_percentiles(self):
+        from mtb_v5_settings.wsgi import application
+
+        stats = benchmark.run_scenario(application, '/health/', requests=20, concurrency=4)
+        self.assertEqual((stats['requests'], stats['errors']), (20, 0))
+        self.assertGreater(stats['rps'], 0)
+        self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+
+    def test_errors_are_counted(self):
+        from mtb_v5_settings.wsgi import application
+
+        stats = benchmark.run_scenario(application, '/media/missing.mp4', requests=3, concurrency=1)
+        self.assertEqual(stats['errors'], 3)
+
+    async def test_asgi_capacity_run(self):
+        from mtb_v5_settings.asgi import application
+
+        stats = await benchmark.run_capacity_asgi(
+            application, '/health/', '/media/missing.mp4', viewers=2, pages=6, concurrency=2, chunk_delay=0,
+        )
+        self.assertEqual((stats['pages']['requests'], stats['pages']['errors']), (6, 0))
+        self.assertEqual(stats['videos']['errors'], 2)
+
+
+class DumpSqliteTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.db_file = os.path.join(self.tmp, 'source.sqlite3')
+        conn = sqlite3.connect(self.db_file)
+        conn.execute('CREATE TABLE songs (id INTEGER PRIMARY KEY, title TEXT, cover BLOB)')
+        conn.executemany('INSERT INTO songs (title, cover) VALUES (?, ?)', [(f'Song {i}', b'\x00\x01') for i in range(25)])
+        conn.execute('CREATE TABLE empty (id INTEGER PRIMARY KEY)')
+        conn.commit()
+        conn.close()
+
+    def dump(self, output, *args):
+        call_command('dump-sqlite3', self.db_file, os.path.join(self.tmp, output), '--batch-size', '7', *args, stdout=StringIO())
+        return os.path.join(self.tmp, output)
+
+    def test_json_layout(self):
+        with open(self.dump('dump.json')) as f:
+            data = json.load(f)
+        self.assertEqual(data['empty'], {'columns': ['id'], 'data': []})
+        self.assertEqual(data['songs']['columns'], ['id', 'title', 'cover'])
+        self.assertEqual(len(data['songs']['data']), 25)
+        self.assertEqual(data['songs']['data'][0], {'id': 1, 'title': 'Song 0', 'cover': {'$base64': 'AAE='}})
+
+    def test_gzip_ndjson_with_table_filter(self):
+        with gzip.open(self.dump('dump.ndjson.gz', '--format', 'ndjson', '--table', 'songs'), 'rt') as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(len(lines), 25)
+        self.assertEqual({line['table'] for line in lines}, {'songs'})
+
+    def test_parallel_files(self):
+        output = self.dump('out', '--parallel', '2', '--exclude-table', 'empty')
+        self.assertEqual(os.listdir(output), ['songs.json'])
+        with open(os.path.join(output, 'songs.json')) as f:
+            self.assertEqual(len(json.load(f)['data']), 25)
+
+    def test_parallel_file_names_stay_inside_the_output_directory(self):
+        conn = sqlite3.connect(self.db_file)
+        conn.execute('CREATE TABLE "../escape" (id INTEGER PRIMARY KEY)')
+        conn.execute('CREATE TABLE "a b" (id INTEGER PRIMARY KEY)')
+        conn.execute('CREATE TABLE a_b (id INTEGER PRIMARY KEY)')
+        conn.commit()
+        conn.close()
+        output = self.dump('out', '--parallel', '2')
+        self.assertEqual(
+            sorted(os.listdir(output)), ['_escape-0.json', 'a_b-1.json', 'a_b.json', 'empty.json', 'songs.json']
+        )
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, 'escape.json')))
+
+
+class ExtractHistoryTest(TestCase):
+    def test_streams_cleaned_rows_to_both_outputs(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        source = os.path.join(tmp, 'legacy.sqlite3')
+        conn = sqlite3.connect(source)
+        conn.execute('CREATE TABLE app_history (id INTEGER PRIMARY KEY, content TEXT)')
+        conn.executemany(
+            'INSERT INTO app_history (content) VALUES (?)',
+            [('Love\\r\\nMe\\tDo \n\n  1962',), (None,)] * 10,
+        )
+        conn.commit()
+        conn.close()
+        output = os.path.join(tmp, 'history.json')
+        out = StringIO()
+        call_command('extract_history', source, output, '--batch-size', '3', '--workers', '2', stdout=out)
+        self.assertIn('records/s', out.getvalue())
+        with open(output) as f:
+            records = json.load(f)
+        self.assertEqual(len(records), 20)
+        self.assertEqual(records[0], {'id': 1, 'content': 'Love Me Do 1962'})
+        self.assertEqual(records[1], {'id': 2, 'content': None})
+        with open(os.path.join(tmp, 'history_preview.txt')) as f:
+            self.assertEqual(f.read().count('=== Record '), 20)
+
+
+class ImportHistoryTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.source = os.path.join(self.tmp, 'legacy.sqlite3')
+        conn = sqlite3.connect(self.source)
+        conn.execute('CREATE TABLE mtb_v4_app_history (id INTEGER PRIMARY KEY, content TEXT, phase TEXT, page_id INTEGER)')
+        conn.executemany(
+            'INSERT INTO mtb_v4_app_history (id, content, phase, page_id) VALUES (?, ?, ?, ?)',
+            [(100 + i, f'<p>In 196{i % 10} John</p>', str(i % 5 + 1), 7 if i % 2 else 8) for i in range(30)],
+        )
+        conn.commit()
+        conn.close()
+        Page.objects.create(id=7, name='existing', phase='00')
+
+    def test_batched_import_creates_missing_pages(self):
+        out = StringIO()
+        # Page lookup, one placeholder insert, the search index check and four history batches
+        # with one search index executemany each (plus the savepoint pair).
+        with self.assertNumQueries(13):
+            call_command('import_history', self.source, '--batch-size', '8', stdout=out)
+        self.assertIn('rows/s', out.getvalue())
+        self.assertEqual(History.objects.count(), 30)
+        self.assertEqual(Page.objects.get(id=8).name, 'Placeholder Page 8')
+        history = History.objects.order_by('id').first()
+        self.assertEqual(history.phase, '01')
+        self.assertIn('<span class="beatle-name">John</span>', history.compiled_content)
+
+    def test_upsert_is_rerunnable(self):
+        call_command('import_history', self.source, '--upsert', stdout=StringIO())
+        conn = sqlite3.connect(self.source)
+        conn.execute("UPDATE mtb_v4_app_history SET content = '<p>Changed</p>' WHERE id = 100")
+        conn.commit()
+        conn.close()
+        call_command('import_history', self.source, '--upsert', stdout=StringIO())
+        self.assertEqual(History.objects.count(), 30)
+        self.assertEqual(History.objects.get(id=100).compiled_content, '<p>Changed</p>')
+
+
+class HistorySearchTest(TestCase):
+    def setUp(self):
+        page = Page.objects.create(name='history', phase='01')
+        self.cavern = History.objects.create(
+            content='<p>They played the <strong>Cavern</strong> Club in Liverpool</p><script>abbey()</script>',
+            phase='01', page=page,
+        )
+        History.objects.create(content='<p>Back at the Cavern &amp; the Casbah</p>', phase='02', page=page)
+        History.objects.create(content='<p>Recording at Abbey Road studios</p>', phase='05', page=page)
+
+    def test_search_endpoint_returns_ranked_snippets(self):
+        response = self.client.get(reverse('history_search'), {'q': 'cavern'})
+        results = response.json()['results']
+        self.assertEqual(len(results), 2)
+        self.assertIn('<mark>Cavern</mark>', results[0]['snippet'])
+        self.assertIn('&amp; the Casbah', [r for r in results if r['phase'] == '02'][0]['snippet'])
+        filtered = self.client.get(reverse('history_search'), {'q': 'Cavern', 'phase': '2'}).json()
+        self.assertEqual([r['phase'] for r in filtered['results']], ['02'])
+        self.assertEqual(self.client.get(reverse('history_search'), {'q': 'cav', 'phase': '9'}).status_code, 400)
+
+    def test_last_word_is_a_prefix_and_hidden_markup_is_not_indexed(self):
+        results = search.search('abb')
+        self.assertEqual([r['phase'] for r in results], ['05'])
+        self.assertEqual(search.search('"); DROP TABLE x; --'), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.cavern.content = '<p>The Star-Club in Hamburg</p>'
+        self.cavern.save()
+        self.assertEqual([r['id'] for r in search.search('hamburg')], [self.cavern.id])
+        self.assertEqual(len(search.search('cavern')), 1)
+        self.cavern.delete()
+        self.assertEqual(search.search('hamburg'), [])
+
+    def test_rebuild_command_and_admin_search(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.TABLE}')
+        out = StringIO()
+        call_command('rebuild_history_search', '--query', 'cavern', stdout=out)
+        self.assertIn('Indexed 3 history rows', out.getvalue())
+        self.assertIn('2 result(s)', out.getvalue())
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        response = self.client.get(reverse('admin:mtb_v5_app_history_changelist'), {'q': 'cavern'})
+        self.assertEqual(response.context['cl'].result_count, 2)
+
+
+class AdminQueryCountTest(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        self.page = Page.objects.create(name='history', phase='01')
+
+    def add_rows(self, count):
+        History.objects.bulk_create(
+            History(content=f'<p>Entry {i}</p>', phase='01', page=self.page, position=i) for i in range(count)
+        )
+        Media.objects.bulk_create(
+            Media(title=f'Media {i}', phase='01', path=f'01/{i}.jpg', page=self.page, type='image', position=i)
+            for i in range(count)
+        )
+
+    def count_queries(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        urls = [
+            reverse('admin:mtb_v5_app_history_changelist'),
+            reverse('admin:mtb_v5_app_media_changelist'),
+            reverse('admin:mtb_v5_app_page_change', args=[self.page.pk]),
+        ]
+        self.add_rows(5)
+        # Warm the per-process caches (ContentType, ...) so only per-row queries could differ.
+        for url in urls:
+            self.count_queries(url)
+        small = [self.count_queries(url) for url in urls]
+        self.add_rows(120)
+        self.assertEqual([self.count_queries(url) for url in urls], small)
+        self.assertEqual(self.count_queries(urls[0], phase='01'), small[0])
+        self.assertLessEqual(max(small), 12)
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_admin_pages_stay_within_query_budget(self):
+        metrics.reset()
+        self.add_rows(60)
+        for model in ('page', 'media', 'history'):
+            self.client.get(reverse(f'admin:mtb_v5_app_{model}_changelist'))
+        self.client.get(reverse('admin:mtb_v5_app_page_change', args=[self.page.pk]))
+        views = [record['view'] for record in metrics.records()]
+        self.assertEqual(len(views), 4)
+        self.assertLessEqual(set(views), set(settings.QUERY_BUDGETS))
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_admin_save_is_not_held_to_the_page_budget(self):
+        self.add_rows(30)
+        url = reverse('admin:mtb_v5_app_page_change', args=[self.page.pk])
+        response = self.client.get(url)
+        data = {}
+        forms = [response.context['adminform'].form]
+        for inline in response.context['inline_admin_formsets']:
+            formset = inline.formset
+            data.update({f'{formset.management_form.prefix}-{name}': value
+                         for name, value in formset.management_form.initial.items()})
+            forms += formset.forms
+        for form in forms:
+            for name in form.fields:
+                value = form[name].value()
+                if value is not None and value is not False:
+                    data[form.add_prefix(name)] = getattr(value, 'pk', value)
+        data['media_set-0-title'] = 'Renamed'
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Media.objects.get(position=0).title, 'Renamed')
+        self.assertEqual(metrics.records()[-1]['method'], 'POST')
+
+    def test_inlines_are_paginated_without_editors(self):
+        self.add_rows(60)
+        url = reverse('admin:mtb_v5_app_page_change', args=[self.page.pk])
+        response = self.client.get(url, {'history_set-page': 3})
+        formsets = {formset.formset.prefix: formset.formset for formset in response.context['inline_admin_formsets']}
+        self.assertEqual(len(formsets['history_set'].forms), 10)
+        self.assertEqual(formsets['history_set'].page.number, 3)
+        self.assertEqual(len(formsets['media_set'].forms), 25)
+        self.assertContains(response, 'history_set-page=2')
+        self.assertNotContains(response, 'django_ckeditor_5')
+
+
+class HistoryCompilerTest(TestCase):
+    def test_sanitizes_and_collapses_whitespace(self):
+        html = compile_history(
+            '<p style="text-align:center; position:fixed" onclick="x()">Hello\n\n   world</p>'
+            '<script>alert(1)</script><a href="javascript:alert(1)">bad</a><a href="https://example.com" target="_blank">ok</a>'
+        )
+        self.assertEqual(
+            html,
+            '<p style="text-align: center">Hello world</p><a>bad</a>'
+            '<a href="https://example.com" target="_blank" rel="noopener noreferrer">ok</a>',
+        )
+
+    def test_applies_enhancer_rules_to_text_only(self):
+        html = compile_history('<p title="The Beatles 1963">In 1963 The Beatles met Ringo\'s "Fab" fans</p>')
+        self.assertEqual(
+            html,
+            '<p title="The Beatles 1963">In <span class="year">1963</span> '
+            '<span class="band-name">The Beatles</span> met <span class="beatle-name">Ringo</span>\'s '
+            '<span class="quote">"Fab"</span> fans</p>',
+        )
+
+    def test_unclosed_tags_are_closed(self):
+        self.assertEqual(compile_history('<ul><li>one<li>two'), '<ul><li>one</li><li>two</li></ul>')
+        self.assertEqual(
+            compile_history('<ul><li>one<li>two</ul><p>a<p>b'), '<ul><li>one</li><li>two</li></ul><p>a</p><p>b</p>'
+        )
+        self.assertEqual(
+            compile_history('<ol><li>a<ul><li>b<li>c</ul><li>d</ol>'),
+            '<ol><li>a<ul><li>b</li><li>c</li></ul></li><li>d</li></ol>',
+        )
+        self.assertEqual(
+            compile_history('<table><tr><td>1<td>2<tr><td>3</table>'),
+            '<table><tr><td>1</td><td>2</td></tr><tr><td>3</td></tr></table>',
+        )
+
+    def test_save_compiles_and_home_renders_compiled_content(self):
+        cache.clear()
+        page = Page.objects.create(name='home', phase='00')
+        history = History.objects.create(content='<p>Hi <script>x</script>George</p>', phase='01', page=page)
+        self.assertEqual(history.compiled_content, '<p>Hi <span class="beatle-name">George</span></p>')
+        response = self.client.get(reverse('home'), {'phase': '01'})
+        self.assertContains(response, '<span class="beatle-name">George</span>')
+        self.assertNotContains(response, '<script>x</script>')
+
+    @override_settings(SNAPSHOT_ENABLED=False)
+    def test_home_compiles_uncompiled_rows_instead_of_rendering_raw_content(self):
+        cache.clear()
+        page = Page.objects.create(name='home', phase='00')
+        History.objects.bulk_create([History(content='<p>Ringo<script>x</script></p>', phase='01', page=page)])
+        response = self.client.get(reverse('home'), {'phase': '01'})
+        self.assertContains(response, '<span class="beatle-name">Ringo</span>')
+        self.assertNotContains(response, '<script>x</script>')
+
+    def test_backfill_command(self):
+        page = Page.objects.create(name='home', phase='00')
+        History.objects.bulk_create([History(content='<p>1964</p>', phase='02', page=page)])
+        call_command('compile_history', '--missing-only', stdout=StringIO())
+        self.assertEqual(History.objects.get().compiled_content, '<p><span class="year">1964</span></p>')
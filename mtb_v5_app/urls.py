@@ -4,4 +4,7 @@ from . import views
 urlpatterns = [
  path( '', views.home, name = 'home' ),
  path( 'health/', views.health, name = 'health' ),
+ path( 'health/metrics/', views.request_metrics, name = 'metrics' ),
+ path( 'api/phase/<str:phase>/', views.phase_api, name = 'phase_api' ),
+ path( 'api/search/', views.history_search, name = 'history_search' ),
 ]
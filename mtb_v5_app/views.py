@@ -1,25 +1,377 @@
 
 
+import mimetypes
+import os
+import stat
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import (
+    FileResponse, Http404, HttpRequest, HttpResponse, HttpResponseNotAllowed, JsonResponse, QueryDict,
+    StreamingHttpResponse,
+)
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.views.decorators.http import condition, require_safe
+from . import caching, healthchecks, media_manifest, metrics, search, snapshots, streaming
 from .models import Media, History
+from .phases import PHASE_LABELS, PHASE_THEMES, PHASES, is_valid_phase, normalize_phase
+from .templatetags import media_tags
+
+def _phase_version(request, phase):
+    """Cached content version of ``phase`` (None for unknown phases)."""
+    if not hasattr(request, '_phase_version'):
+        request._phase_version = caching.get_version(phase) if is_valid_phase(phase) else None
+    return request._phase_version
+
+
+def _home_etag(request):
+    version = _phase_version(request, normalize_phase(request.GET.get('phase')))
+    return version['etag'] if version else None
+
+
+def _home_last_modified(request):
+    version = _phase_version(request, normalize_phase(request.GET.get('phase')))
+    return version['last_modified'] if version else None
+
+
+def _phase_content(phase):
+    """``(media_list, history_list)`` for ``phase``: snapshot first, ORM as fallback."""
+    # Deploy-time snapshot first (no database round-trip), ORM as fallback.
+    snapshot = snapshots.load_snapshot(phase) if settings.SNAPSHOT_ENABLED else None
+    if snapshot is not None:
+        return snapshot['media'], snapshot['history']
+    return Media.objects.filter(phase=phase), History.objects.filter(phase=phase)
 
-def home(request):
-    current_phase = request.GET.get('phase', '01').zfill(2)  # Ensure phase is a string with leading zeros
-    media_list = Media.objects.filter(phase=current_phase)
-    history_list = History.objects.filter(phase=current_phase)
-    phases = [(1, '1959 - 1962'), (2, '1962 - 1966'), (3, '1966 - 1970'), (4, '1970 - 9999'), (5, 'Karaokes')]
 
-    context = {
-        'current_phase': current_phase,
+def _home_context(phase, media_list, history_list):
+    valid = is_valid_phase(phase)
+    return {
+        'current_phase': phase,
         'media_list': media_list,
         'history_list': history_list,
-        'phases': [(str(phase).zfill(2), label) for phase, label in phases]  # Ensure phases are strings with leading zeros
+        'phases': PHASES,
+        'phase_theme': PHASE_THEMES.get(phase),
+        'phase_switching': settings.PHASE_CLIENT_SWITCHING,
+        # Fragments of arbitrary ?phase= values are rendered without touching the cache
+        # (a timeout of 0 skips {% cache %}, see templatetags/fragment_cache.py).
+        'fragment_timeout': settings.TEMPLATE_FRAGMENT_TIMEOUT if valid else 0,
+        'fragment_cache': settings.HOME_CACHE_ALIAS,
+    }
+
+
+@condition(etag_func=_home_etag, last_modified_func=_home_last_modified)
+def home(request):
+    current_phase = normalize_phase(request.GET.get('phase'))  # Ensure phase is a string with leading zeros
+
+    # Only the five known phases are cached; anything else renders as before.
+    use_cache = settings.HOME_CACHE_ENABLED and is_valid_phase(current_phase)
+    response = caching.get_page(current_phase) if use_cache else None
+
+    if response is None:
+        media_list, history_list = _phase_content(current_phase)
+        response = render(request, 'home.html', _home_context(current_phase, media_list, history_list))
+        if use_cache:
+            caching.set_page(current_phase, response)
+
+    if is_valid_phase(current_phase):
+        # Let browsers keep the page but revalidate it (cheap 304) on every visit.
+        patch_cache_control(response, no_cache=True)
+    return response
+
+
+async def _aphase_content(phase):
+    snapshot = None
+    if settings.SNAPSHOT_ENABLED:
+        snapshot = await sync_to_async(snapshots.load_snapshot, thread_sensitive=False)(phase)
+    if snapshot is not None:
+        return snapshot['media'], snapshot['history']
+    media_list = [media async for media in Media.objects.filter(phase=phase)]
+    history_list = [history async for history in History.objects.filter(phase=phase)]
+    return media_list, history_list
+
+
+async def ahome(request):
+    """``home`` for the ASGI path (routed by ``middleware.ASGIURLConfMiddleware``).
+
+    Cache and ORM access are awaited and the template is rendered in a worker
+    thread, so page renders are not queued behind long-running media streams.
+    """
+    current_phase = normalize_phase(request.GET.get('phase'))
+    valid = is_valid_phase(current_phase)
+
+    version = await caching.aget_version(current_phase) if valid else None
+    if version is not None:
+        last_modified = int(version['last_modified'].timestamp())
+        not_modified = get_conditional_response(request, etag=version['etag'], last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+
+    use_cache = settings.HOME_CACHE_ENABLED and valid
+    response = await caching.aget_page(current_phase) if use_cache else None
+
+    if response is None:
+        media_list, history_list = await _aphase_content(current_phase)
+        context = _home_context(current_phase, media_list, history_list)
+        response = await sync_to_async(render, thread_sensitive=False)(request, 'home.html', context)
+        if use_cache:
+            await caching.aset_page(current_phase, response)
+
+    if version is not None:
+        response.headers['ETag'] = version['etag']
+        response.headers['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, no_cache=True)
+    return response
+
+
+def _api_etag(request, phase):
+    version = _phase_version(request, phase)
+    return version['etag'] if version else None
+
+
+def _api_last_modified(request, phase):
+    version = _phase_version(request, phase)
+    return version['last_modified'] if version else None
+
+
+def _phase_payload(phase):
+    """JSON-serializable content of ``phase`` for the client-side phase switcher."""
+    media_list, history_list = _phase_content(phase)
+    theme = PHASE_THEMES[phase]
+    media = []
+    for item in media_list:
+        data = item if isinstance(item, dict) else snapshots.serialize_media(item)
+        if data['type'] != 'video':
+            continue
+        media.append({
+            **data,
+            'src': media_tags.video_url(data),
+            'poster': media_tags.poster_url(data),
+        })
+    history = [
+        item if isinstance(item, dict) else snapshots.serialize_history(item)
+        for item in history_list
+    ]
+    return {
+        'phase': phase,
+        'label': PHASE_LABELS[phase],
+        'version': caching.get_version(phase)['etag'].strip('"'),
+        'theme': {
+            'card_color': theme['card_color'],
+            'background_url': f"url('{media_manifest.url(theme['background'])}')",
+            'background': media_tags.background_image_set(theme['background']),
+        },
+        'media': media,
+        'history': history,
     }
-    
-    return render(request, 'home.html', context)
+
+
+@require_safe
+@condition(etag_func=_api_etag, last_modified_func=_api_last_modified)
+def phase_api(request, phase):
+    """Media and History of one phase as JSON, cached and revalidated like the page."""
+    if not is_valid_phase(phase):
+        raise Http404('Unknown phase')
+
+    use_cache = settings.HOME_CACHE_ENABLED
+    response = caching.get_page(phase, kind='api') if use_cache else None
+    if response is None:
+        response = JsonResponse(_phase_payload(phase))
+        if use_cache:
+            caching.set_page(phase, response, kind='api')
+
+    # The ETag changes with the content, so clients revalidate with a cheap 304.
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+@require_safe
+def history_search(request):
+    """Ranked History snippets for ``?q=`` (optionally ``&phase=NN``, ``&limit=N`` up to 50)."""
+    text = request.GET.get('q', '').strip()
+    phase = request.GET.get('phase')
+    if phase:
+        phase = normalize_phase(phase)
+        if not is_valid_phase(phase):
+            return JsonResponse({'error': 'Unknown phase'}, status=400)
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 50)
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+    results = search.search(text, phase=phase, limit=limit) if text else []
+    return JsonResponse({'query': text, 'phase': phase or None, 'results': results})
+
+
+def warm_phase(phase):
+    """Render the page and the JSON payload of ``phase`` into the cache; returns their sizes.
+
+    Used by ``manage.py warmcache`` so the first visitor after a deploy gets a
+    cache hit. The entries are the ones ``home`` and ``phase_api`` would store.
+    """
+    caching.get_version(phase)
+    request = HttpRequest()
+    request.method = 'GET'
+    request.GET = QueryDict(f'phase={phase}')
+    media_list, history_list = _phase_content(phase)
+    page = render(request, 'home.html', _home_context(phase, media_list, history_list))
+    caching.set_page(phase, page)
+    payload = JsonResponse(_phase_payload(phase))
+    caching.set_page(phase, payload, kind='api')
+    return len(page.content), len(payload.content)
+
+
+def _readiness_response(result):
+    # Which probe failed, not why: error messages can contain paths and hostnames (see check_db).
+    checks = {name: {'ok': check['ok'], 'ms': check['ms']} for name, check in result['checks'].items()}
+    response = JsonResponse({'status': result['status'], 'checks': checks}, status=200 if result['status'] == 'ok' else 503)
+    patch_cache_control(response, no_store=True)
+    return response
 
 
 def health(request):
-    """Simple health check for uptime / monitoring."""
+    """Liveness check for uptime monitoring; ``?mode=ready`` adds the readiness probes (see healthchecks.py)."""
+    mode = request.GET.get('mode', 'live')
+    if mode == 'ready':
+        return _readiness_response(healthchecks.readiness())
+    if mode != 'live':
+        return JsonResponse({'error': 'mode must be live or ready'}, status=400)
     return JsonResponse({'status': 'ok'})
+
+
+async def ahealth(request):
+    mode = request.GET.get('mode', 'live')
+    if mode == 'ready':
+        return _readiness_response(await sync_to_async(healthchecks.readiness)())
+    if mode != 'live':
+        return JsonResponse({'error': 'mode must be live or ready'}, status=400)
+    return JsonResponse({'status': 'ok'})
+
+
+def request_metrics(request):
+    """Per-view latency/query percentiles from this process (staff or DEBUG only)."""
+    if not (settings.DEBUG or request.user.is_staff):
+        raise Http404
+    return JsonResponse({'views': metrics.summary()})
+
+
+def _media_file(path):
+    """Resolve ``path`` below ``MEDIA_ROOT`` or raise ``Http404``."""
+    if any(part.startswith('.') for part in path.split('/')):
+        raise Http404('Hidden files are not served')
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+        st = os.stat(fullpath)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404(f'"{path}" does not exist')
+    if os.path.relpath(fullpath, settings.MEDIA_ROOT).replace(os.sep, '/') in media_manifest.INTERNAL_FILES:
+        raise Http404('Manifests are not served')
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404(f'"{path}" does not exist')
+    return fullpath, st
+
+
+def serve_media(request, path):
+    """Serve a file from ``MEDIA_ROOT`` with Range, ETag and long-lived caching.
+
+    Works with ``DEBUG=False``. When ``MEDIA_SENDFILE_HEADER`` is set the bytes
+    are left to the fronting proxy (``X-Sendfile`` or ``X-Accel-Redirect``).
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    located = _locate_media(request, path)
+    return _media_response(request, *located, _file_body)
+
+
+async def aserve_media(request, path):
+    """``serve_media`` for the ASGI path; the file is read without blocking the event loop."""
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    located = await sync_to_async(_locate_media, thread_sensitive=False)(request, path)
+    return _media_response(request, *located, _async_file_body)
+
+
+def _locate_media(request, path):
+    """Resolve fingerprinted names and pick a precompressed variant (see ``media_manifest``)."""
+    rel_path, immutable = media_manifest.resolve(path)
+    served_path, vary = media_manifest.negotiate(rel_path, request.headers.get('Accept-Encoding'))
+    fullpath, st = _media_file(served_path)
+    return served_path, fullpath, st, immutable, vary
+
+
+def _media_response(request, path, fullpath, st, immutable, vary, file_body):
+    etag = streaming.file_etag(st)
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(st.st_mtime))
+    if response is None:
+        sendfile_header = settings.MEDIA_SENDFILE_HEADER
+        if sendfile_header:
+            response = HttpResponse(content_type=content_type)
+            if sendfile_header.lower() == 'x-accel-redirect':
+                response[sendfile_header] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + quote(path)
+            else:
+                response[sendfile_header] = fullpath
+        else:
+            response = _media_file_response(request, fullpath, st, etag, content_type, file_body)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Accept-Ranges'] = 'bytes'
+
+    if response.status_code != 416:
+        response.headers['ETag'] = etag
+        response.headers['Last-Modified'] = http_date(st.st_mtime)
+        if immutable:
+            patch_cache_control(response, public=True, max_age=settings.MEDIA_HASHED_MAX_AGE, immutable=True)
+        else:
+            patch_cache_control(response, public=True, max_age=settings.MEDIA_CACHE_MAX_AGE)
+    if vary:
+        patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
+def _media_file_response(request, fullpath, st, etag, content_type, file_body):
+    size = st.st_size
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    # A stale If-Range means the client's partial copy is outdated: send it all.
+    if not if_range or if_range in (etag, http_date(st.st_mtime)):
+        try:
+            byte_range = streaming.parse_range(request.headers.get('Range'), size)
+        except streaming.RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if byte_range is None:
+        return file_body(fullpath, content_type, 0, size, status=200)
+    start, end = byte_range
+    response = file_body(fullpath, content_type, start, end - start + 1, status=206)
+    response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
+
+
+def _file_body(fullpath, content_type, start, length, status):
+    if status == 200:
+        response = FileResponse(open(fullpath, 'rb'), content_type=content_type)
+    else:
+        response = FileResponse(
+            streaming.RangeFile(open(fullpath, 'rb'), start, length),
+            status=status,
+            content_type=content_type,
+        )
+        response.headers['Content-Length'] = str(length)
+    response.block_size = streaming.CHUNK_SIZE
+    return response
+
+
+def _async_file_body(fullpath, content_type, start, length, status):
+    response = StreamingHttpResponse(
+        streaming.aiter_file(fullpath, start, length), status=status, content_type=content_type,
+    )
+    response.headers['Content-Length'] = str(length)
+    return response
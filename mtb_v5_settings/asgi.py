@@ -2,6 +2,8 @@
 ASGI config for mtb_v4_project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Requests served through it are routed to the async views in ``urls_asgi.py``
+(see ``ASGI_URLCONF`` in settings); see README.md for server commands.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
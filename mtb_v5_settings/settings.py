@@ -100,8 +100,11 @@ CKEDITOR_5_UPLOAD_PATH = "uploads/"
 CKEDITOR_5_FILE_STORAGE = "django.core.files.storage.FileSystemStorage"
 
 MIDDLEWARE = [
+'mtb_v5_app.metrics.RequestMetricsMiddleware',
+'mtb_v5_app.middleware.ASGIURLConfMiddleware',
+'mtb_v5_app.middleware.PublicReadMiddleware',  # only used when READ_ONLY_DATABASE is set
 'django.middleware.security.SecurityMiddleware',
-'whitenoise.middleware.WhiteNoiseMiddleware',
+'mtb_v5_app.middleware.WhiteNoiseMiddleware',  # whitenoise's middleware with async support
 'django.contrib.sessions.middleware.SessionMiddleware',
 'django.middleware.common.CommonMiddleware',
 'django.middleware.csrf.CsrfViewMiddleware',
@@ -112,12 +115,20 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'mtb_v5_settings.urls'
 
+# Templates are compiled once per process and kept by the cached loader in production; with DEBUG
+# the plain loaders re-read them on every render, so edits show up without a restart.
+TEMPLATE_LOADERS = [
+'django.template.loaders.filesystem.Loader',
+'django.template.loaders.app_directories.Loader',
+]
+
 TEMPLATES = [
 {
 'BACKEND' : 'django.template.backends.django.DjangoTemplates',
 'DIRS'    : [ BASE_DIR / 'templates' ],
-'APP_DIRS': True,
+'APP_DIRS': False,  # the loaders are listed explicitly
 'OPTIONS' : {
+'loaders': TEMPLATE_LOADERS if DEBUG else [ ( 'django.template.loaders.cached.Loader', TEMPLATE_LOADERS ) ],
 'context_processors': [
 'django.template.context_processors.debug',
 'django.template.context_processors.request',
@@ -133,10 +144,22 @@ WSGI_APPLICATION = 'mtb_v5_settings.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 #
+# SQLITE_TUNING applies SQLITE_PRAGMAS (end of this file) to every connection and begins write
+# transactions with BEGIN IMMEDIATE, so a writer waits for the busy timeout instead of failing.
+# DB_CONN_MAX_AGE keeps connections open between requests (0 closes them after each request).
+SQLITE_TUNING = _bool_env('SQLITE_TUNING', True)
+try:
+    DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', '0' if DEBUG else '600'))
+except ValueError:
+    DB_CONN_MAX_AGE = 0 if DEBUG else 600
+
 DATABASES = {
 'default': {
 'ENGINE': 'django.db.backends.sqlite3',
 'NAME'  : BASE_DIR / 'db.sqlite3',
+'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+'CONN_HEALTH_CHECKS': True,
+'OPTIONS': {'transaction_mode': 'IMMEDIATE'} if SQLITE_TUNING else {},
 }
 }
 
@@ -260,3 +283,176 @@ except ValueError:
 # Additional HSTS settings configurable via environment variables
 SECURE_HSTS_INCLUDE_SUBDOMAINS = _bool_env('SECURE_HSTS_INCLUDE_SUBDOMAINS', False)
 SECURE_HSTS_PRELOAD = _bool_env('SECURE_HSTS_PRELOAD', False)
+
+# Cache backend, chosen with CACHE_BACKEND:
+#   locmem     per-process memory: every worker has its own copy, so `manage.py warmcache` and
+#              invalidation from another process cannot reach it (the development default)
+#   file       a directory shared by all workers on the host (CACHE_LOCATION, the production default)
+#   redis      Django's RedisCache, CACHE_LOCATION=redis://127.0.0.1:6379/1 (needs the redis package)
+#   memcached  PyMemcacheCache, CACHE_LOCATION=127.0.0.1:11211 (needs the pymemcache package)
+# CACHE_MAX_ENTRIES bounds the locmem and file backends (the oldest third is culled when full).
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem' if DEBUG else 'file').strip().lower()
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'mtb-v5'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', str(BASE_DIR / '.django_cache')),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379/1'),
+    'memcached': ('django.core.cache.backends.memcached.PyMemcacheCache', '127.0.0.1:11211'),
+}
+if CACHE_BACKEND not in CACHE_BACKENDS:
+    raise ImproperlyConfigured(f"CACHE_BACKEND must be one of {', '.join(CACHE_BACKENDS)}, not {CACHE_BACKEND!r}")
+try:
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '1000'))
+except ValueError:
+    CACHE_MAX_ENTRIES = 1000
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': os.environ.get('CACHE_LOCATION', CACHE_BACKENDS[CACHE_BACKEND][1]),
+        'KEY_PREFIX': os.environ.get('CACHE_KEY_PREFIX', 'mtb_v5'),
+    }
+}
+if CACHE_BACKEND in ('locmem', 'file'):
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': CACHE_MAX_ENTRIES, 'CULL_FREQUENCY': 3}
+
+# Full-response cache for the phase home page (see mtb_v5_app/caching.py).
+# Enabled by default in production only, so template edits show up immediately while developing.
+HOME_CACHE_ENABLED = _bool_env('HOME_CACHE_ENABLED', not DEBUG)
+HOME_CACHE_ALIAS = os.environ.get('HOME_CACHE_ALIAS', 'default')
+try:
+    HOME_CACHE_TIMEOUT = int(os.environ.get('HOME_CACHE_TIMEOUT', '600'))
+except ValueError:
+    HOME_CACHE_TIMEOUT = 600
+# How often each process adds its hit/miss counts to the shared counters when the cache backend
+# has no atomic incr() (file, database); other backends count every request directly.
+try:
+    HOME_CACHE_STATS_FLUSH_SECONDS = float(os.environ.get('HOME_CACHE_STATS_FLUSH_SECONDS', '30'))
+except ValueError:
+    HOME_CACHE_STATS_FLUSH_SECONDS = 30.0
+# {% cache %} fragments of base.html/home.html (head, phase style, phase menu), stored in the same
+# alias and dropped with the pages. 0 (the DEBUG default) renders them every time without reading
+# or writing the cache.
+try:
+    TEMPLATE_FRAGMENT_TIMEOUT = int(os.environ.get('TEMPLATE_FRAGMENT_TIMEOUT', '0' if DEBUG else '3600'))
+except ValueError:
+    TEMPLATE_FRAGMENT_TIMEOUT = 0 if DEBUG else 3600
+
+# Media serving (see mtb_v5_app.views.serve_media). When a proxy can serve files itself set
+# MEDIA_SENDFILE_HEADER to 'X-Sendfile' (Apache/lighttpd) or 'X-Accel-Redirect' (nginx); for nginx
+# MEDIA_ACCEL_REDIRECT_PREFIX must match an `internal` location aliased to MEDIA_ROOT.
+MEDIA_SENDFILE_HEADER = os.environ.get('MEDIA_SENDFILE_HEADER', '').strip()
+MEDIA_ACCEL_REDIRECT_PREFIX = os.environ.get('MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+try:
+    MEDIA_CACHE_MAX_AGE = int(os.environ.get('MEDIA_CACHE_MAX_AGE', '604800'))
+except ValueError:
+    MEDIA_CACHE_MAX_AGE = 604800
+# Fingerprinted names from `manage.py build_media_manifest` (and derivatives) never change content.
+try:
+    MEDIA_HASHED_MAX_AGE = int(os.environ.get('MEDIA_HASHED_MAX_AGE', '31536000'))
+except ValueError:
+    MEDIA_HASHED_MAX_AGE = 31536000
+
+# Precomputed phase snapshots written by `manage.py build_snapshots` (see mtb_v5_app/snapshots.py)
+SNAPSHOT_ENABLED = _bool_env('SNAPSHOT_ENABLED', not DEBUG)
+SNAPSHOT_ROOT = os.environ.get('SNAPSHOT_ROOT', os.path.join(BASE_DIR, 'snapshots'))
+
+# Poster/background derivatives written by `manage.py build_derivatives` (see mtb_v5_app/derivatives.py)
+try:
+    DERIVATIVE_WIDTHS = [int(w) for w in os.environ.get('DERIVATIVE_WIDTHS', '320,640,1280').split(',') if w.strip()]
+except ValueError:
+    DERIVATIVE_WIDTHS = [320, 640, 1280]
+POSTER_WIDTH = 640
+POSTER_SIZES = '(max-width: 768px) 100vw, 33vw'
+BACKGROUND_WIDTH = 1280
+DERIVATIVES_ON_SAVE = _bool_env('DERIVATIVES_ON_SAVE', True)
+
+# Per-request query/latency metrics (see mtb_v5_app/metrics.py), summarized at /health/metrics/.
+# QUERY_BUDGETS maps URL names to the maximum number of SQL queries a GET/HEAD request may run.
+# The middleware wraps every query and template render of the process, so production opts in explicitly.
+REQUEST_METRICS_ENABLED = _bool_env('REQUEST_METRICS_ENABLED', DEBUG)
+try:
+    REQUEST_METRICS_BUFFER_SIZE = int(os.environ.get('REQUEST_METRICS_BUFFER_SIZE', '1000'))
+except ValueError:
+    REQUEST_METRICS_BUFFER_SIZE = 1000
+QUERY_BUDGETS = {
+    'home': 4,
+    'phase_api': 4,
+    'history_search': 2,
+    'health': 4,  # 0 for liveness; readiness probes the database(s) once per HEALTH_CACHE_SECONDS
+    # Admin pages (session, user, page count without a full COUNT, rows with their Page joined)
+    'admin:mtb_v5_app_page_changelist': 6,
+    'admin:mtb_v5_app_media_changelist': 6,
+    'admin:mtb_v5_app_history_changelist': 6,
+    'admin:mtb_v5_app_page_change': 10,  # plus one paginated query and count per inline
+}
+QUERY_BUDGET_STRICT = _bool_env('QUERY_BUDGET_STRICT', False)
+
+# Phase buttons swap content in place from /api/phase/<nn>/ and prefetch neighbouring phases
+# (static/js/phase-switcher.js). Without JavaScript they remain plain ?phase= links.
+PHASE_CLIENT_SWITCHING = _bool_env('PHASE_CLIENT_SWITCHING', True)
+
+# Requests arriving through mtb_v5_settings/asgi.py are routed to the async views in this URLconf
+# (see mtb_v5_app/middleware.py); WSGI requests keep using ROOT_URLCONF. Set to '' to disable.
+ASGI_URLCONF = os.environ.get('ASGI_URLCONF', 'mtb_v5_settings.urls_asgi')
+
+# SQLite pragmas run on each new connection when SQLITE_TUNING is on (see mtb_v5_app/sqlite_tuning.py).
+# WAL lets readers continue while the admin writes; synchronous=NORMAL is safe in WAL mode (a power
+# loss can only drop the last commits). cache_size < 0 is in KiB, mmap_size and the timeout in bytes/ms.
+try:
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+except ValueError:
+    SQLITE_BUSY_TIMEOUT_MS = 5000
+try:
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', '-20000'))
+except ValueError:
+    SQLITE_CACHE_SIZE = -20000
+try:
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+except ValueError:
+    SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+SQLITE_PRAGMAS = {
+    # First, so that switching the journal mode waits for other connections too.
+    'busy_timeout': SQLITE_BUSY_TIMEOUT_MS,
+    'journal_mode': 'WAL' if _bool_env('SQLITE_WAL', True) else 'DELETE',
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL').strip(),
+    'cache_size': SQLITE_CACHE_SIZE,
+    'mmap_size': SQLITE_MMAP_SIZE,
+}
+
+# Optional read-only database for public GET/HEAD requests (see mtb_v5_app/readonly_db.py): a replica
+# from READ_ONLY_DATABASE_URL, or a copy of the SQLite database at READ_ONLY_SQLITE_PATH kept up to date
+# by `manage.py refresh_readonly_db` and, with READ_ONLY_REFRESH_ON_SAVE, after every content change.
+# The copy is replaced rather than modified, so its connections are not kept open by default.
+READ_ONLY_DATABASE = ''
+READ_ONLY_SQLITE_PATH = os.environ.get('READ_ONLY_SQLITE_PATH', '').strip()
+READ_ONLY_REFRESH_ON_SAVE = _bool_env('READ_ONLY_REFRESH_ON_SAVE', True)
+READ_ONLY_EXCLUDED_PATHS = ('/admin/', '/django_ckeditor_5/')
+try:
+    READ_ONLY_CONN_MAX_AGE = int(os.environ.get('READ_ONLY_CONN_MAX_AGE', '0'))
+except ValueError:
+    READ_ONLY_CONN_MAX_AGE = 0
+if os.environ.get('READ_ONLY_DATABASE_URL'):
+    try:
+        import dj_database_url
+        DATABASES['readonly'] = dj_database_url.parse(os.environ['READ_ONLY_DATABASE_URL'], conn_max_age=DB_CONN_MAX_AGE)
+        READ_ONLY_DATABASE = 'readonly'
+    except ImportError:
+        # dj-database-url not installed; everything keeps reading from default
+        pass
+elif READ_ONLY_SQLITE_PATH:
+    DATABASES['readonly'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f'file:{os.path.abspath(READ_ONLY_SQLITE_PATH)}?mode=ro&immutable=1',
+        'CONN_MAX_AGE': READ_ONLY_CONN_MAX_AGE,
+    }
+    READ_ONLY_DATABASE = 'readonly'
+if READ_ONLY_DATABASE:
+    # Tests read the routed models from the test database.
+    DATABASES[READ_ONLY_DATABASE]['TEST'] = {'MIRROR': 'default'}
+DATABASE_ROUTERS = ['mtb_v5_app.readonly_db.ReadOnlyRouter']
+
+# /health/?mode=ready probes the database, pending migrations and MEDIA_ROOT (see mtb_v5_app/healthchecks.py)
+# and keeps the result in process memory for this many seconds; plain /health/ never touches them.
+try:
+    HEALTH_CACHE_SECONDS = float(os.environ.get('HEALTH_CACHE_SECONDS', '5'))
+except ValueError:
+    HEALTH_CACHE_SECONDS = 5.0
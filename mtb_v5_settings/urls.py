@@ -1,8 +1,10 @@
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
 from django.views.generic.base import RedirectView
+from mtb_v5_app import views as app_views
 
 urlpatterns = [
     path("admin/", admin.site.urls),
@@ -11,5 +13,11 @@ urlpatterns = [
         "favicon.ico",
         RedirectView.as_view(url=settings.STATIC_URL + "imgs/icons/favicon.ico"),
     ),
+    # Media is served by the app (Range/ETag aware) so it also works with DEBUG=False.
+    re_path(
+        r"^%s(?P<path>.*)$" % re.escape(settings.MEDIA_URL.lstrip("/")),
+        app_views.serve_media,
+        name="media",
+    ),
     path("", include("mtb_v5_app.urls")),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
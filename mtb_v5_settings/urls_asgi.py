@@ -0,0 +1,26 @@
+"""URLconf for requests served through ``asgi.py``.
+
+Same routes as ``urls.py``, except that the home page, health check and media
+files are answered by the async views. Selected per request by
+``mtb_v5_app.middleware.ASGIURLConfMiddleware`` via ``settings.ASGI_URLCONF``.
+"""
+
+import re
+
+from django.conf import settings
+from django.urls import path, re_path
+from mtb_v5_app import views as app_views
+
+from . import urls
+
+urlpatterns = [
+    re_path(
+        r"^%s(?P<path>.*)$" % re.escape(settings.MEDIA_URL.lstrip("/")),
+        app_views.aserve_media,
+        name="media",
+    ),
+    path("", app_views.ahome, name="home"),
+    path("health/", app_views.ahealth, name="health"),
+    # Everything else (admin, API, CKEditor uploads, ...) as in the WSGI URLconf.
+    *urls.urlpatterns,
+]
@@ -0,0 +1,149 @@
+// Client-side phase switching: the phase buttons load /api/phase/<nn>/ and swap
+// the cards, history and theme in place instead of navigating. Neighbouring
+// phases are prefetched in idle time, so most switches need no request at all.
+// Without fetch/history support the buttons stay plain ?phase= links.
+(function () {
+ const container = document.querySelector("#phase-selection-container[data-phase-api]");
+ if (!container || !window.fetch || !window.history.pushState) return;
+
+ const apiTemplate = container.dataset.phaseApi;
+ const buttons = Array.from(container.querySelectorAll("a[data-phase]"));
+ const order = buttons.map((button) => button.dataset.phase);
+ const payloads = new Map();
+
+ function load(phase) {
+  if (!payloads.has(phase)) {
+   const request = fetch(apiTemplate.replace("__phase__", phase), {
+    headers: { Accept: "application/json" },
+   }).then((response) => {
+    if (!response.ok) throw new Error("Phase " + phase + ": HTTP " + response.status);
+    return response.json();
+   });
+   // Forget failures so the next click (or a full navigation) can retry.
+   request.catch(() => payloads.delete(phase));
+   payloads.set(phase, request);
+  }
+  return payloads.get(phase);
+ }
+
+ function whenIdle(callback) {
+  if (window.requestIdleCallback) {
+   window.requestIdleCallback(callback, { timeout: 2000 });
+  } else {
+   window.setTimeout(callback, 200);
+  }
+ }
+
+ function prefetchNeighbours(phase) {
+  const index = order.indexOf(phase);
+  [order[index + 1], order[index - 1]].forEach((neighbour) => {
+   if (!neighbour) return;
+   whenIdle(() => load(neighbour).then((data) => {
+    // Warm the first poster too, so the swapped-in cards paint immediately.
+    if (data.media.length) new Image().src = data.media[0].poster;
+   }).catch(() => {}));
+  });
+ }
+
+ function buildCard(media, index) {
+  const li = document.createElement("li");
+  li.className = "slide slide" + (index + 1);
+  const wrapper = document.createElement("div");
+  wrapper.className = "video-container";
+  const video = document.createElement("video");
+  video.className = "video-slide";
+  video.controls = true;
+  video.poster = media.poster;
+  video.preload = index === 0 ? "metadata" : "none";
+  if (media.width && media.height) {
+   // Same reserved space as the server-rendered cards.
+   wrapper.style.aspectRatio = media.width + " / " + media.height;
+   video.width = media.width;
+   video.height = media.height;
+  }
+  const source = document.createElement("source");
+  source.src = media.src;
+  source.type = "video/mp4";
+  video.appendChild(source);
+  video.appendChild(document.createTextNode("Your browser does not support this video."));
+  const overlay = document.createElement("div");
+  overlay.className = "overlay";
+  overlay.textContent = media.title;
+  wrapper.append(video, overlay);
+  li.appendChild(wrapper);
+  return li;
+ }
+
+ function render(data) {
+  // Replace the whole cards container: stackedCards binds its swipe handler to
+  // it, and a fresh node drops the handlers of the previous phase.
+  const oldCards = document.querySelector(".stacked-cards-slide");
+  document.querySelectorAll(".stacked-cards video").forEach((video) => video.pause());
+  const cards = oldCards.cloneNode(true);
+  const list = cards.querySelector("ul");
+  list.replaceChildren();
+  list.removeAttribute("style");
+  if (data.media.length) {
+   data.media.forEach((media, index) => list.appendChild(buildCard(media, index)));
+  } else {
+   const empty = document.createElement("li");
+   empty.textContent = "No media available";
+   list.appendChild(empty);
+  }
+  oldCards.replaceWith(cards);
+
+  const text = document.querySelector(".text-container");
+  text.replaceChildren(...data.history.map((history) => {
+   const entry = document.createElement("div");
+   entry.className = "history-entry";
+   // compiled_content is sanitized on the server (mtb_v5_app/history_compiler.py).
+   entry.innerHTML = history.compiled_content;
+   return entry;
+  }));
+
+  const body = document.body;
+  body.classList.remove("phase-" + body.dataset.phase);
+  body.classList.add("phase-" + data.phase);
+  body.dataset.phase = data.phase;
+  body.style.backgroundImage = data.theme.background_url;
+  body.style.backgroundImage = data.theme.background;
+  cards.querySelectorAll("li.slide").forEach((li) => {
+   li.style.backgroundColor = data.theme.card_color;
+  });
+
+  buttons.forEach((button) => {
+   button.classList.toggle("active", button.dataset.phase === data.phase);
+  });
+  if (data.media.length && window.initStackedCards) window.initStackedCards();
+ }
+
+ function show(phase, push) {
+  return load(phase).then((data) => {
+   render(data);
+   if (push) window.history.pushState({ phase: phase }, "", "?phase=" + phase);
+   prefetchNeighbours(phase);
+  });
+ }
+
+ buttons.forEach((button) => {
+  button.addEventListener("click", (event) => {
+   if (event.metaKey || event.ctrlKey || event.shiftKey || event.button !== 0) return;
+   const phase = button.dataset.phase;
+   if (phase === document.body.dataset.phase) {
+    event.preventDefault();
+    return;
+   }
+   event.preventDefault();
+   // Fall back to a normal navigation if the API is unreachable.
+   show(phase, true).catch(() => { window.location.href = button.href; });
+  });
+ });
+
+ window.addEventListener("popstate", (event) => {
+  const phase = (event.state && event.state.phase) || container.dataset.initialPhase;
+  show(phase, false).catch(() => window.location.reload());
+ });
+
+ window.history.replaceState({ phase: document.body.dataset.phase }, "", window.location.href);
+ prefetchNeighbours(document.body.dataset.phase);
+})();
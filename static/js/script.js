@@ -1,4 +1,6 @@
-document.addEventListener("DOMContentLoaded", function () {
+// Stacked cards and their video controls. Called on load and again by
+// phase-switcher.js after it replaces the cards of the current phase.
+function initStackedCards() {
  // Initialize the stacked cards
  var stackedCardSlide = new stackedCards({
   selector: ".stacked-cards-slide",
@@ -31,20 +33,6 @@ document.addEventListener("DOMContentLoaded", function () {
   },
  });
  stackedCardSlide.init();
- // Accordion Logic
- const accordionHeaders = document.querySelectorAll(".accordion.hide-initially");
- accordionHeaders.forEach(function (header) {
-  header.classList.add("show-initially");
- });
- // Phase Selection Container Logic
- const phaseSelectionContainer = document.querySelector("#phase-selection-container");
- if (phaseSelectionContainer) {
-  phaseSelectionContainer.classList.remove("hide-initially");
-  // Remove conflicting inline styles to let CSS handle layout
-  phaseSelectionContainer.style.removeProperty("width");
-  phaseSelectionContainer.style.removeProperty("margin");
-  phaseSelectionContainer.style.removeProperty("display");
- }
  // Video Controls Logic with touch support
  const videos = document.querySelectorAll(".video-slide");
  videos.forEach(function (video) {
@@ -105,7 +93,24 @@ document.addEventListener("DOMContentLoaded", function () {
    }, { passive: false });
   });
  }
- 
+}
+
+document.addEventListener("DOMContentLoaded", function () {
+ initStackedCards();
+ // Accordion Logic
+ const accordionHeaders = document.querySelectorAll(".accordion.hide-initially");
+ accordionHeaders.forEach(function (header) {
+  header.classList.add("show-initially");
+ });
+ // Phase Selection Container Logic
+ const phaseSelectionContainer = document.querySelector("#phase-selection-container");
+ if (phaseSelectionContainer) {
+  phaseSelectionContainer.classList.remove("hide-initially");
+  // Remove conflicting inline styles to let CSS handle layout
+  phaseSelectionContainer.style.removeProperty("width");
+  phaseSelectionContainer.style.removeProperty("margin");
+  phaseSelectionContainer.style.removeProperty("display");
+ }
  // Update current year
  const currentYearElement = document.getElementById("currentYear");
  if (currentYearElement) {